@@ -147,8 +147,9 @@ class EntityRecognitionSingleton:
 
         # print('模型初始化完成 ......')
 
-    def ner(self, question):
-        return get_ner_result(self.model, self.tokenizer, question, self.rule, self.tfidf_r, self.device, self.idx2tag)
+    def ner(self, question, with_scores=False):
+        return get_ner_result(self.model, self.tokenizer, question, self.rule, self.tfidf_r, self.device, self.idx2tag,
+                              with_scores=with_scores)
 
 
 class KGQueryAgent:
@@ -9,6 +9,8 @@ from pymilvus import (
     connections, FieldSchema, CollectionSchema,
     DataType, Collection, utility
 )
+from src.stores.chunk_store import ChunkStore
+from src.stores.vector_index import build_index_params
 
 
 class MilvusStorage:
@@ -18,15 +20,22 @@ class MilvusStorage:
             dim: int = 1024,
             host: str = "localhost",
             port: str = "19530",
-            overwrite: bool = False
+            overwrite: bool = False,
+            index_type: Optional[str] = None,
+            text_store: Optional[str] = None
     ):
         """
         一个轻量封装:
         - 只负责把带有 embedding 的 Document 存进 Milvus
         - 不做 embedding
+        - index_type: 索引类型，缺省为 IVF_FLAT；IVF_SQ8 / IVF_PQ 为量化索引
+        - text_store: ChunkStore 目录，设置后分块文本写入本地（按 Milvus 主键索引），Milvus 的 text 字段留空，
+          VectorRecaller 的 recall_text_store 应指向同一目录
         """
         self.collection_name = collection_name
         self.dim = dim
+        self.index_type = index_type
+        self.text_store = ChunkStore(text_store) if text_store else None
 
         connections.connect(alias="default", host=host, port=port)
 
@@ -56,7 +65,7 @@ class MilvusStorage:
             self.collection = self._create_collection()
 
         if not self.collection.has_index():
-            self._create_index()
+            self._create_index(build_index_params(index_type, "COSINE", dim, nlist=16) if index_type else None)
 
     def _create_collection(self) -> Collection:
         print(f"创建新集合: {self.collection_name}")
@@ -116,19 +125,34 @@ class MilvusStorage:
                 lengths.append(len(doc.page_content))
 
             entities = [
-                texts,  # text
+                [""] * len(texts) if self.text_store is not None else texts,  # text
                 embeddings,  # embedding
                 metas,  # metadata
                 lengths,  # text_length
             ]
-            self.collection.insert(entities)
+            result = self.collection.insert(entities)
+            if self.text_store is not None:
+                self._store_texts(result.primary_keys, texts, metas)
             inserted += len(batch)
             print(f"已插入 {inserted}/{total_docs} 条...")
 
         self.collection.flush()
         print(f"插入完成, {self.collection.num_entities} 条数据在集合 {self.collection_name} 中.")
 
+    def _store_texts(self, pks: List[int], texts: List[str], metas: List[dict]):
+        """按 Milvus 自动生成的主键把文本写入 ChunkStore，按来源文件分组，便于按文件删除"""
+        groups = {}
+        for pk, text, meta in zip(pks, texts, metas):
+            file_id = str(meta.get("file_id") or meta.get("source", ""))
+            ids, group_texts = groups.setdefault(file_id, ([], []))
+            ids.append(pk)
+            group_texts.append(text)
+        for file_id, (ids, group_texts) in groups.items():
+            self.text_store.put(ids, file_id, group_texts)
+
     def close(self):
+        if self.text_store is not None:
+            self.text_store.close()
         # Milvus官方SDK: 指定alias (默认 "default")
         connections.disconnect(alias="default")
         print("Milvus 连接已关闭")
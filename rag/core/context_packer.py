@@ -0,0 +1,144 @@
+"""
+按 token 预算打包检索到的参考资料
+"""
+import re
+from functools import lru_cache
+from typing import Any, Dict, List, Tuple
+
+from src.utils.cache import normalize_text
+
+_TOKEN_RE = re.compile(r"\n+|[一-鿿]|[A-Za-z0-9]+|[^\sA-Za-z0-9一-鿿]")
+_SENTENCE_RE = re.compile(r"(?<=[。！？!?；;\n])")
+
+
+@lru_cache(maxsize=8192)
+def count_tokens(text: str) -> int:
+    """
+    估算文本的 token 数：中文按字计，英文/数字串按约 4 个字符一个 token 计，标点与连续换行各计 1。
+    结果按文本缓存，同一个 chunk 多次出现只计算一次。
+    """
+    total = 0
+    for tk in _TOKEN_RE.findall(text):
+        total += (len(tk) + 3) // 4 if tk.isascii() and tk.isalnum() else 1
+    return total
+
+
+def _bigrams(text: str) -> set:
+    text = normalize_text(text)
+    return {text[i:i + 2] for i in range(len(text) - 1)} or {text}
+
+
+class ContextPacker:
+    """
+    在 token 预算内组织知识库、图数据库、网络搜索的参考资料：
+    - 知识库与网络搜索中重复的段落只保留一份
+    - 知识库段落按重排序分数排序
+    - 过长的段落只保留与问题最相关的句子
+    - 按 图数据库 -> 知识库 -> 网络搜索 的顺序填充，直到用完预算
+    """
+
+    def __init__(self, budget: int = 3000, max_passage_tokens: int = 400) -> None:
+        self.budget = budget
+        self.max_passage_tokens = max_passage_tokens
+
+    def trim(self, text: str, query: str, max_tokens: int) -> str:
+        """保留与问题最相关的句子（保持原顺序），使其不超过 max_tokens"""
+        if count_tokens(text) <= max_tokens:
+            return text
+
+        sentences = [s for s in _SENTENCE_RE.split(text) if s.strip()]
+        query_grams = _bigrams(query)
+        ranked = sorted(range(len(sentences)),
+                        key=lambda i: len(query_grams & _bigrams(sentences[i])), reverse=True)
+
+        chosen, used = set(), 0
+        for i in ranked:
+            n = count_tokens(sentences[i])
+            if used + n <= max_tokens:
+                chosen.add(i)
+                used += n
+
+        if not chosen:
+            # 单句就超长，按字符截断最相关的句子
+            best = sentences[ranked[0]]
+            while best and count_tokens(best) > max_tokens:
+                best = best[:int(len(best) * 0.9)]
+            return best
+
+        return "".join(sentences[i] for i in sorted(chosen))
+
+    @staticmethod
+    def _dedup(kb_passages: List[str], web_passages: List[Tuple[str, str]]) -> List[Tuple[str, str]]:
+        """去掉与知识库段落重复（相同或互相包含）的网络搜索结果"""
+        kb_norm = [normalize_text(p) for p in kb_passages]
+        kept = []
+        for title, content in web_passages:
+            norm = normalize_text(content)
+            if any(norm == k or (norm and norm in k) or (k and k in norm) for k in kb_norm):
+                continue
+            kept.append((title, content))
+        return kept
+
+    def pack(self, query: str, refs: Dict[str, Any], reserved: int = 0,
+             budget: int = None) -> Tuple[List[str], Dict[str, Any]]:
+        """
+        返回 (external_parts, stats)。reserved 为模板与问题本身占用的 token 数。
+        """
+        budget = budget or self.budget
+        headers = ("图数据库信息:", "知识库信息:", "网络搜索信息:")
+        # 各部分之间用 "\n\n" 连接、段落之间用 "\n" 连接，分隔符与标题一起预留
+        sep = count_tokens("\n")
+        reserved += sum(count_tokens(h) + 2 * sep for h in headers)
+        remaining = max(budget - reserved, 0)
+
+        kb_res = list(refs.get("knowledge_base", {}).get("results", []))
+        if all(r.get("rerank_score") is not None for r in kb_res):
+            kb_res.sort(key=lambda r: r["rerank_score"], reverse=True)
+        kb_items = [(r.get("id", i), r["entity"]["text"]) for i, r in enumerate(kb_res)]
+
+        graph = refs.get("graph_base", {}) or {}
+        db_res = graph.get("results") or graph.get("subgraph") or {}
+        graph_lines = [f"{edge['source_name']}和{edge['target_name']}的关系是{edge['type']}"
+                       for edge in db_res.get("edges", [])] if db_res.get("nodes") else []
+
+        web_res = refs.get("web_search", {}).get("results", [])
+        web_items = self._dedup([t for _, t in kb_items], [(r["title"], r["content"]) for r in web_res])
+
+        original = (sum(count_tokens(line) for line in graph_lines)
+                    + sum(count_tokens(f"{rid}: {t}") for rid, t in kb_items)
+                    + sum(count_tokens(f"{r['title']}: {r['content']}") for r in web_res))
+
+        def take(prefix, text):
+            """裁剪并占用预算，prefix（编号/标题）与段落前的换行也计入预算"""
+            nonlocal remaining
+            room = remaining - count_tokens(prefix) - sep
+            text = self.trim(text, query, min(self.max_passage_tokens, room)) if room > 0 else ""
+            n = count_tokens(prefix + text) + sep
+            if not text or n > remaining:
+                return None
+            remaining -= n
+            return prefix + text
+
+        graph_kept = [kept for kept in (take("", line) for line in graph_lines) if kept]
+        kb_kept = [kept for kept in (take(f"{rid}: ", text) for rid, text in kb_items) if kept]
+        web_kept = [kept for kept in (take(f"{title}: ", content) for title, content in web_items) if kept]
+
+        sections = [(h, lines) for h, lines in zip(headers, (graph_kept, kb_kept, web_kept)) if lines]
+
+        external_parts = []
+        for header, lines in sections:
+            external_parts.extend([header, "\n".join(lines)])
+
+        packed = count_tokens("\n\n".join(external_parts))
+        stats = {
+            "budget": budget,
+            "original_tokens": original,
+            "packed_tokens": packed,
+            "saved_tokens": max(original - packed, 0),
+            "dropped": {
+                "graph": len(graph_lines) - len(graph_kept),
+                "knowledge_base": len(kb_items) - len(kb_kept),
+                "web_search": len(web_res) - len(web_kept),
+            },
+        }
+        return external_parts, stats
@@ -5,6 +5,28 @@ def get_system_prompt():
     return (f"当前时间：{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
 
 
+knowbase_qa_instruction = "请利用查询到的资料回答问题，回答问题时，不要过度的分点作答。"
+
+
+def get_stable_system_prompt(system_prompt=None, static_context=None):
+    """
+    稳定前缀布局下的 system 提示：只包含不随轮次变化的内容（自定义提示、回答格式要求、长期上下文），
+    当前时间等每轮变化的内容放到最后一条用户消息里，便于模型服务商复用前缀缓存
+    """
+    return "\n\n".join(part for part in (system_prompt, knowbase_qa_instruction, static_context) if part)
+
+
+# 稳定前缀布局下使用：回答要求已放到 system 提示中，这里只保留每轮变化的参考资料和问题
+knowbase_context_template = """
+<参考资料>：
+{external}
+</参考资料>
+
+<问题>
+{query}
+</问题>
+"""
+
 knowbase_qa_template = """
 请利用查询到的资料回答问题，回答问题时，不要过度的分点作答。
 
@@ -39,6 +61,15 @@ rewritten_query_prompt_template2 = """
 <问题>{query}</问题>
 """
 
+multi_query_prompt_template = """
+<指令>你是一个用来辅助查询的助手，请根据历史对话以及最新的问题，改写出 {n} 个表述不同但意思相同的查询问题，用于从知识库中匹配参考资料。<指令>
+<禁止>1.绝对不能自己编造无关内容
+2.不得对问题进行回答<禁止>
+<格式要求>每行一个问题，不要编号，不要返回其他任何内容<格式要求>
+<历史信息>{history}</历史信息>
+<问题>{query}</问题>
+"""
+
 entity_extraction_prompt_template = """
 <指令>请对以下文本进行命名实体识别，返回识别出的实体及其类型。<指令>
 <禁止>1.绝对不能自己编造无关内容,若不存在实体，则直接返回空内容，不要包含内容东西
@@ -1,19 +1,39 @@
 
-from src import config
+from src import config, knowledge_base
 from src.models.reranker_model import RerankerWrapper
 from src.utils.logger import LogManager
 from src.models import select_model
 from rag.core.prompts import *
-from src.stores import  KnowledgeBase
+from src.stores.kb_router import AUTO_ROUTE
 from rag.core.operators import HyDEOperator
+from src.utils.cache import LRUCache, make_key, normalize_text
+from rag.core.context_packer import ContextPacker, count_tokens
+from src.utils.metrics import timed, latency_metrics
 import asyncio, inspect
-knowledge_base = KnowledgeBase()
+import os
+import time
+import threading
+from difflib import SequenceMatcher
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 
 _log = LogManager()
 
 def get_kg_agent():
     from agent.kg_agent import KGQueryAgent
     return KGQueryAgent()
+
+
+def is_stable_layout(meta):
+    """是否使用稳定前缀的 prompt 布局（静态内容在前、每轮变化的内容在后）"""
+    return meta.get("prompt_layout", config.get("prompt_layout", "default")) == "stable"
+
+
+def kb_ids(meta):
+    """本次请求要检索的知识库：db_ids（多个，或 "auto" 表示按路由自动挑选）优先，其次 db_id"""
+    db_ids = meta.get("db_ids") or meta.get("db_id") or []
+    return [db_ids] if isinstance(db_ids, str) else list(db_ids)
+
+
 class Retriever:
 
     def __init__(self):
@@ -21,6 +41,28 @@ class Retriever:
         self.kg_agent = get_kg_agent()
         self.default_distance_threshold = config.get("default_distance_threshold", 0.5)
         self.top_k = config.get("default_top_k", 10)
+        # 各检索源并发执行，每个源有独立的超时时间（秒），可通过 meta["timeouts"] 覆盖
+        self.default_source_timeout = config.get("default_source_timeout", 30)
+        self._pool = ThreadPoolExecutor(max_workers=config.get("retrieval_workers", 16),
+                                        thread_name_prefix="retrieval")
+        # 推测检索：改写查询的同时用原始查询检索知识库
+        self.speculative_similarity_threshold = config.get("speculative_similarity_threshold", 0.9)
+        self._search_pool = ThreadPoolExecutor(max_workers=config.get("speculative_workers", 4),
+                                               thread_name_prefix="speculative")
+        self._speculative_lock = threading.Lock()
+        self.speculative_stats = {"total": 0, "kept": 0}
+        self.context_packer = ContextPacker(
+            budget=config.get("context_token_budget", 3000),
+            max_passage_tokens=config.get("context_max_passage_tokens", 400),
+        )
+        # 改写 / HyDE 查询缓存
+        self.rewrite_cache = LRUCache(
+            "rewrite_query",
+            maxsize=config.get("rewrite_cache_size", 2048),
+            ttl=config.get("rewrite_cache_ttl", 24 * 3600),
+            persist_path=os.path.join(config.save_dir, "cache", "rewrite_query.db")
+            if config.get("rewrite_cache_persist", False) else None,
+        )
 
     def _load_models(self):
         if config.enable_reranker:
@@ -30,16 +72,179 @@ class Retriever:
             from api.websearch.websearcher import LiteBaseSearcher, TavilyBasicSearcher
             self.web_searcher = LiteBaseSearcher()
 
-    def retrieval(self, query, history, meta):
+    def retrieval(self, query, history, meta, on_source_done=None):
         refs = {"query": query, "history": history, "meta": meta}
         refs["model_name"] = config.model_name
-        refs["entities"] = self.reco_entities(query, history, refs)
-        refs["knowledge_base"] = self.query_knowledgebase(query, history, refs)
-        refs["graph_base"] = self.query_graph(query, history, refs) #知识库
-        refs["web_search"] = self.query_web(query, history, refs)
+        refs["timeouts"] = []
+        refs["skipped"] = []
+        refs["errors"] = {}
+        refs["latency"] = {"timings": {}, "counts": {}}
+        refs["meta"], refs["degraded"] = self.plan(meta)
+
+        sources = {
+            "entities": self.reco_entities,
+            "knowledge_base": self.query_knowledgebase,
+            "graph_base": self.query_graph, #知识库
+            "web_search": self.query_web,
+        }
+        self._run_sources(sources, query, history, refs, on_source_done)
+        return refs
+
+    def plan(self, meta):
+        """
+        根据 meta["latency_budget_ms"] 和各阶段近期耗时，决定本次检索执行哪些阶段。
+        返回 (调整后的 meta 副本, 被降级的阶段列表)；未设置预算时原样返回。
+
+        各检索源并发执行，知识库内部串行（改写 -> embedding -> Milvus -> 重排序），
+        依次降级：去掉网络搜索 / 图谱 -> 跳过 HyDE -> 关闭改写 -> 减少候选并只重排前几个。
+        """
+        budget = meta.get("latency_budget_ms")
+        if not budget:
+            return meta, []
+
+        meta = dict(meta)
+        degraded = []
+        q = config.get("latency_planner_quantile", 0.9)
+        # 被降级的阶段不再产生新样本，只看最近 max_age 秒的样本：样本过期后该阶段会重新执行并重新评估
+        max_age = config.get("latency_planner_max_age", 300)
+
+        def cost(*stages):
+            return sum(latency_metrics.quantile(stage, q, max_age=max_age) for stage in stages)
+
+        if meta.get("use_web") and cost("web_search") > budget:
+            meta["use_web"] = False
+            degraded.append("web_search")
+
+        if meta.get("use_graph") and cost("graph_base") > budget:
+            meta["use_graph"] = False
+            degraded.append("graph_base")
+
+        if kb_ids(meta):
+            if meta.get("multi_query", config.get("enable_multi_query", False)) and \
+                    cost("multi_query", "embedding", "milvus_search", "rerank") > budget:
+                meta["multi_query"] = False
+                degraded.append("multi_query")
+
+            rewrite_mode = self._rewrite_mode({"meta": meta})
+            if rewrite_mode == "hyde" and cost("rewrite", "embedding", "milvus_search", "rerank") > budget:
+                rewrite_mode = meta["planned_rewrite_mode"] = "on"
+                degraded.append("hyde")
+            if rewrite_mode == "on" and cost("rewrite", "embedding", "milvus_search", "rerank") > budget:
+                meta["planned_rewrite_mode"] = "off"
+                degraded.append("rewrite")
+
+            if cost("embedding", "milvus_search", "rerank") > budget:
+                meta["max_query_count"] = config.get("degraded_max_query_count", 10)
+                meta["rerank_top_n"] = config.get("degraded_rerank_top_n", 5)
+                degraded.append("rerank")
+
+        # 硬性上限：任何检索源都不等待超过预算
+        timeouts = dict(meta.get("timeouts") or {})
+        for name in ("entities", "knowledge_base", "graph_base", "web_search"):
+            timeouts[name] = min(timeouts.get(name, self.default_source_timeout), budget / 1000)
+        meta["timeouts"] = timeouts
+
+        if degraded:
+            _log.info(f"时延预算 {budget}ms，降级阶段: {degraded}")
+        return meta, degraded
+
+    def _run_sources(self, sources, query, history, refs, on_source_done=None):
+        """
+        并发执行各检索源，按完成顺序收集结果：
+        - 每个源从真正开始执行时计算 deadline，在线程池中排队的时间不计入；排队超过同样时长仍未开始的源也按超时处理
+        - 超时的源使用空结果并记录到 refs["timeouts"]
+        - 若 meta["required_sources"] 指定了必需的源，必需源全部完成后不再等待其余源，记录到 refs["skipped"]
+        - 源抛出异常时使用空结果，错误信息记录到 refs["errors"]，不影响其他源
+        - 每个源完成（或超时、跳过、出错）时调用 on_source_done(name, result)，用于流式返回
+
+        每个源使用自己的 latency 字典，只有按时完成的源才并入 refs["latency"]：
+        Python 线程无法中断，超时的源会继续在后台运行直到结束，它之后的写入不会影响已返回的 refs
+        """
+        meta = refs["meta"]
+        timeouts = meta.get("timeouts") or {}
+        # 未知的源名不参与判断；交集为空时等待全部源
+        required = set(meta.get("required_sources") or ()) & set(sources) or set(sources)
+        submitted = time.monotonic()
+        started = {}
+        views = {name: {**refs, "latency": {"timings": {}, "counts": {}}} for name in sources}
+        pending = {self._pool.submit(self._timed_source, name, func, query, history, views[name], started): name
+                   for name, func in sources.items()}
+
+        def timeout_of(name):
+            return timeouts.get(name, self.default_source_timeout)
+
+        def deadline(name):
+            return started.get(name, submitted) + timeout_of(name)
+
+        def finish(name, result):
+            refs[name] = result
+            if on_source_done:
+                on_source_done(name, result)
+
+        while pending:
+            if not required & set(pending.values()):
+                for future, name in pending.items():
+                    future.cancel()
+                    refs["skipped"].append(name)
+                    finish(name, self._placeholder_result(name, query, "生成前未完成，已跳过", skipped=True))
+                break
+
+            next_deadline = min(deadline(name) for name in pending.values())
+            done, _ = wait(pending, timeout=max(0, next_deadline - time.monotonic()), return_when=FIRST_COMPLETED)
+            for future in done:
+                name = pending.pop(future)
+                self._merge_latency(refs, views[name])
+                try:
+                    result = future.result()
+                except Exception as e:
+                    _log.error(f"检索源 {name} 出错: {e}")
+                    refs["errors"][name] = str(e)
+                    result = self._placeholder_result(name, query, f"检索出错: {e}", error=True)
+                finish(name, result)
+
+            now = time.monotonic()
+            for future, name in list(pending.items()):
+                if deadline(name) <= now:
+                    del pending[future]
+                    future.cancel()  # 只对尚未开始的源有效
+                    _log.warning(f"检索源 {name} 超时（{timeout_of(name)}s），"
+                                 f"{'跳过' if name in started else '排队未开始，取消'}")
+                    refs["timeouts"].append(name)
+                    finish(name, self._placeholder_result(name, query, f"检索超时（{timeout_of(name)}s）",
+                                                          timeout=True))
 
         return refs
 
+    def _timed_source(self, name, func, query, history, refs, started):
+        started[name] = time.monotonic()
+        if not self._source_enabled(name, refs["meta"]):
+            # 未启用的源直接返回空结果，不记录耗时，否则近乎 0 的样本会让时延规划低估该源
+            return func(query, history, refs)
+        with timed(refs["latency"], name):
+            return func(query, history, refs)
+
+    @staticmethod
+    def _source_enabled(name, meta):
+        """检索源本次是否真正执行（与各 query_* 方法开头的判断一致）"""
+        if name in ("entities", "graph_base"):
+            return bool(meta.get("use_graph"))
+        if name == "web_search":
+            return bool(meta.get("use_web") and config.enable_web_search)
+        if name == "knowledge_base":
+            return bool(kb_ids(meta) and config.enable_knowledge_base)
+        return True
+
+    @staticmethod
+    def _placeholder_result(name, query, message, **flags):
+        """与各检索源正常返回结构一致的占位结果（超时或跳过时使用）"""
+        if name == "entities":
+            return []
+        if name == "knowledge_base":
+            return {"results": [], "all_results": [], "rw_query": query, "message": message, **flags}
+        if name == "graph_base":
+            return {"answer": None, "subgraph": None, "message": message, **flags}
+        return {"results": [], "message": message, **flags}
+
     def restart(self):
         """所有需要重启的模型"""
         self._load_models()
@@ -49,33 +254,20 @@ class Retriever:
         if not refs or len(refs) == 0:
             return query
 
-        external_parts = []
+        # 稳定前缀布局下，回答要求已放在 system 提示中，这里只拼接参考资料和问题
+        template = knowbase_context_template if is_stable_layout(meta) else knowbase_qa_template
 
-        # 解析知识库的结果
-        kb_res = refs.get("knowledge_base", {}).get("results", [])
-        if kb_res:
-            kb_text = "\n".join(f"{r['id']}: {r['entity']['text']}" for r in kb_res)
-            external_parts.extend(["知识库信息:", kb_text])
-
-        # 解析图数据库的结果
-        db_res = refs.get("graph_base", {}).get("results", {})
-        if db_res.get("nodes") and len(db_res["nodes"]) > 0:
-            db_text = "\n".join(
-                [f"{edge['source_name']}和{edge['target_name']}的关系是{edge['type']}" for edge in
-                 db_res.get("edges", [])]
-            )
-            external_parts.extend(["图数据库信息:", db_text])
-
-        # 解析网络搜索的结果
-        web_res = refs.get("web_search", {}).get("results", [])
-        if web_res:
-            web_text = "\n".join(f"{r['title']}: {r['content']}" for r in web_res)
-            external_parts.extend(["网络搜索信息:", web_text])
+        # 在 token 预算内打包参考资料（去重、按重排序分数排序、裁剪过长段落）
+        reserved = count_tokens(template.format(external="", query=query))
+        external_parts, packing = self.context_packer.pack(query, refs, reserved=reserved,
+                                                           budget=meta.get("context_budget"))
+        refs["context_packing"] = packing
+        _log.debug(f"上下文打包: {packing}")
 
         # 构造查询
         if external_parts and len(external_parts) > 0:
             external = "\n\n".join(external_parts)
-            query = knowbase_qa_template.format(external=external, query=query)
+            query = template.format(external=external, query=query)
 
         return query
 
@@ -106,29 +298,148 @@ class Retriever:
         }
 
         meta = refs["meta"]
-        db_id = meta.get("db_id")
-        if not db_id or not config.enable_knowledge_base:
+        db_ids = kb_ids(meta)
+        if not db_ids or not config.enable_knowledge_base:
             response["message"] = "知识库未启用、或未指定知识库、或知识库不存在"
             return response
 
+        # 多个知识库时走 search_many：查询只编码一次，各 collection 并发检索后统一重排序；
+        # db_ids 为 "auto" 时由质心路由在全部知识库中挑选
+        if db_ids == [AUTO_ROUTE]:
+            target = {"db_ids": None, "route_top_n": meta.get("kb_route_top_n")}
+        else:
+            target = {"db_ids": db_ids} if len(db_ids) > 1 else {"db_id": db_ids[0]}
+        search_kwargs = dict(
+            **target,
+            distance_threshold=meta.get("distanceThreshold", self.default_distance_threshold),
+            rerank=True,
+            top_k=meta.get("topK", self.top_k),
+            max_query_count=meta.get("max_query_count"),
+            rerank_top_n=meta.get("rerank_top_n"),
+            hybrid=meta.get("hybrid_search"),
+            filters=meta.get("kb_filters"),
+            mmr=meta.get("mmr")
+        )
+
+        if meta.get("multi_query", config.get("enable_multi_query", False)) and "db_id" in search_kwargs:
+            try:
+                # 配置的查询改写与多查询生成并发执行，改写结果排在第一位，用于重排序
+                rw_future = self._search_pool.submit(self._timed_rewrite, query, history, refs)
+                with timed(refs["latency"], "multi_query"):
+                    queries = self.generate_queries(query, history, refs)
+                rw_query = rw_future.result()
+                response["rw_query"] = rw_query
+                queries = [rw_query] + [q for q in queries if normalize_text(q) != normalize_text(rw_query)]
+                response["queries"] = queries
+                kb_res = knowledge_base.search_multi(queries, **search_kwargs)
+                response["results"] = kb_res["results"]
+                response["all_results"] = kb_res["all_results"]
+                self._merge_latency(refs, kb_res)
+            except Exception as e:
+                response["message"] = f"检索出错: {e}"
+            return response
+
+        speculative = meta.get("speculative_search", config.get("enable_speculative_search", False))
+        if speculative and self._rewrite_mode(refs) != "off":
+            try:
+                kb_res, rw_query, spec_info = self._speculative_search(query, history, refs, search_kwargs)
+                response["rw_query"] = rw_query
+                response["speculative"] = spec_info
+                response["results"] = kb_res["results"]
+                response["all_results"] = kb_res["all_results"]
+                self._merge_latency(refs, kb_res)
+            except Exception as e:
+                response["message"] = f"检索出错: {e}"
+            return response
+
         # 重写查询（如果有）
-        rw_query = self.rewrite_query(query, history, refs)
+        rw_query = self._timed_rewrite(query, history, refs)
         response["rw_query"] = rw_query
 
         try:
-            kb_res = knowledge_base.search(
-                query=rw_query,
-                db_id=db_id,
-                distance_threshold=meta.get("distanceThreshold", self.default_distance_threshold),
-                rerank=True,
-                top_k=meta.get("topK", self.top_k)
-            )
+            kb_res = self._kb_search(rw_query, search_kwargs)
             response["results"] = kb_res["results"]
             response["all_results"] = kb_res["all_results"]
+            self._merge_latency(refs, kb_res)
         except Exception as e:
             response["message"] = f"检索出错: {e}"
         return response
 
+    def _speculative_search(self, query, history, refs, search_kwargs):
+        """
+        推测检索：在改写查询的同时先用原始查询检索知识库。
+        - 改写结果与原查询几乎一致时，直接沿用推测结果；
+        - 否则再用改写后的查询检索一次，并与推测结果合并。
+        """
+        spec_future = self._search_pool.submit(self._kb_search, query, search_kwargs)
+        rw_query = self._timed_rewrite(query, history, refs)
+        try:
+            spec_res = spec_future.result()
+        except Exception as e:
+            _log.warning(f"推测检索出错，只使用改写后的查询检索: {e}")
+            spec_res = None
+
+        similarity = SequenceMatcher(None, query.strip(), rw_query.strip()).ratio()
+        kept = spec_res is not None and similarity >= self.speculative_similarity_threshold
+        if kept:
+            kb_res = spec_res
+        elif spec_res is None:
+            kb_res = self._kb_search(rw_query, search_kwargs)
+        else:
+            rw_res = self._kb_search(rw_query, search_kwargs)
+            kb_res = self._merge_kb_results(rw_res, spec_res, search_kwargs["top_k"])
+
+        with self._speculative_lock:
+            self.speculative_stats["total"] += 1
+            self.speculative_stats["kept"] += int(kept)
+            keep_rate = self.speculative_stats["kept"] / self.speculative_stats["total"]
+        _log.debug(f"推测检索 {'命中' if kept else '未命中'}，相似度 {similarity:.2f}，累计沿用率 {keep_rate:.2%}")
+
+        spec_info = {"kept": kept, "similarity": similarity, "keep_rate": keep_rate}
+        return kb_res, rw_query, spec_info
+
+    @staticmethod
+    def _kb_search(query, search_kwargs):
+        if "db_ids" in search_kwargs:
+            return knowledge_base.search_many(query=query, **search_kwargs)
+        return knowledge_base.search(query=query, **search_kwargs)
+
+    @staticmethod
+    def _merge_kb_results(primary, secondary, top_k, rrf_k=60):
+        """
+        合并两次知识库检索结果，按文本去重；两次检索的重排序分数分别相对各自的查询，不能直接比较，
+        按倒数排名融合排序（同分时 primary 在前）
+        """
+        def key(r):
+            # 文本保存在本地的知识库中，未通过过滤的候选不带 text，按主键去重
+            return r["entity"].get("text") or (r.get("db_id"), r["id"])
+
+        def merge(a, b):
+            merged = {}
+            for r in a + b:
+                merged.setdefault(key(r), r)
+            return list(merged.values())
+
+        fused = {}
+        for ranked in (primary["results"], secondary["results"]):
+            for rank, r in enumerate(ranked, start=1):
+                item = fused.setdefault(key(r), [r, 0.0])
+                item[1] += 1 / (rrf_k + rank)
+        results = [r for r, _ in sorted(fused.values(), key=lambda x: x[1], reverse=True)]
+
+        return {
+            "results": results[:top_k],
+            "all_results": merge(primary["all_results"], secondary["all_results"]),
+            "latency": primary.get("latency", {}),
+        }
+
+    @staticmethod
+    def _merge_latency(refs, kb_res):
+        """把 KnowledgeBase.search 内部的 embedding / milvus / rerank 耗时与候选数量并入 refs["latency"]"""
+        latency = kb_res.get("latency") or {}
+        refs["latency"]["timings"].update(latency.get("timings", {}))
+        refs["latency"]["counts"].update(latency.get("counts", {}))
+
     def query_web(self, query, history, refs):
         """查询网络：直接同步调用 WebSearcher"""
         if not (refs["meta"].get("use_web") and config.enable_web_search):
@@ -142,45 +453,114 @@ class Retriever:
 
         return {"results": search_results}
 
-    def rewrite_query(self, query, history, refs):
-        """重写查询"""
-        model_provider = config.model_provider
-        model_name = config.model_name
-        model = select_model(model_provider=model_provider, model_name=model_name)
+    def _rewrite_mode(self, refs):
+        if refs["meta"].get("planned_rewrite_mode"):  # 时延预算规划后的改写模式
+            return refs["meta"]["planned_rewrite_mode"]
         if refs["meta"].get("mode") == "search":  # 如果是搜索模式，就使用 meta 的配置，否则就使用全局的配置
-            rewrite_query_span = refs["meta"].get("use_rewrite_query", "off")
-        else:
-            rewrite_query_span = config.use_rewrite_query
+            return refs["meta"].get("use_rewrite_query", "off")
+        return config.use_rewrite_query
+
+    def _timed_rewrite(self, query, history, refs):
+        """只在改写真正执行时记录 rewrite 耗时，off 模式不产生样本，避免拉低规划器看到的改写耗时"""
+        if self._rewrite_mode(refs) == "off":
+            return query
+        with timed(refs["latency"], "rewrite"):
+            return self.rewrite_query(query, history, refs)
 
+    def rewrite_query(self, query, history, refs):
+        """重写查询，结果按（归一化查询、用户历史、模型、改写模式）缓存"""
+        rewrite_query_span = self._rewrite_mode(refs)
         if rewrite_query_span == "off":
-            rewritten_query = query
-        else:
+            return query
 
-            history_query = [entry["content"] for entry in history if entry["role"] == "user"] if history else ""
-            rewritten_query_prompt = rewritten_query_prompt_template.format(history=history_query, query=query)
-            rewritten_query = model.predict(rewritten_query_prompt).content
+        model_provider = config.model_provider
+        model_name = config.model_name
+        history_query = self._user_turns(history)
+
+        cache_key = make_key(normalize_text(query), [normalize_text(q) for q in history_query],
+                             model_provider, model_name, rewrite_query_span)
+        rewritten_query = self.rewrite_cache.get(cache_key)
+        if rewritten_query is not None:
+            _log.debug(f"改写缓存命中: {query} -> {rewritten_query}")
+            return rewritten_query
 
+        model = select_model(model_provider=model_provider, model_name=model_name)
         if rewrite_query_span == "hyde":
             res = HyDEOperator.call(model_callable=model.predict, query=query, context_str=history_query)
             rewritten_query = res.content
+        else:
+            rewritten_query_prompt = rewritten_query_prompt_template.format(history=history_query, query=query)
+            rewritten_query = model.predict(rewritten_query_prompt).content
 
+        self.rewrite_cache.set(cache_key, rewritten_query)
         return rewritten_query
 
-    def reco_entities(self, query, history, refs):
-        """识别句子中的实体"""
-        query = refs.get("rewritten_query", query)
+    def generate_queries(self, query, history, refs):
+        """一次大模型调用生成多个改写查询，原始查询始终排在第一位（用于重排序）"""
+        n = refs["meta"].get("multi_query_count", config.get("multi_query_count", 3))
         model_provider = config.model_provider
         model_name = config.model_name
-        model = select_model(model_provider=model_provider, model_name=model_name)
+        history_query = self._user_turns(history)
+
+        cache_key = make_key(normalize_text(query), [normalize_text(q) for q in history_query],
+                             model_provider, model_name, f"multi:{n}")
+        queries = self.rewrite_cache.get(cache_key)
+        if queries is None:
+            model = select_model(model_provider=model_provider, model_name=model_name)
+            prompt = multi_query_prompt_template.format(n=n, history=history_query, query=query)
+            lines = model.predict(prompt).content.splitlines()
+            queries = [line.strip() for line in lines if line.strip()][:n]
+            self.rewrite_cache.set(cache_key, queries)
+
+        return [query] + [q for q in queries if normalize_text(q) != normalize_text(query)]
+
+    @staticmethod
+    def _user_turns(history):
+        """取出历史中的用户提问，兼容 dict 与 LangChain Message 两种格式"""
+        turns = []
+        for entry in history or []:
+            if isinstance(entry, dict):
+                if entry.get("role") == "user":
+                    turns.append(entry["content"])
+            elif getattr(entry, "type", None) == "human":
+                turns.append(entry.content)
+        return turns
+
+    def reco_entities(self, query, history, refs):
+        """识别句子中的实体：优先使用本地 NER（RoBERTa + 规则匹配 + TF-IDF 对齐），无结果或分数过低时再调用大模型"""
+        query = refs.get("rewritten_query", query)
 
         entities = []
         if refs["meta"].get("use_graph"):
+            entities = self._local_entities(query)
+            if entities:
+                return entities
+
+            model_provider = config.model_provider
+            model_name = config.model_name
+            model = select_model(model_provider=model_provider, model_name=model_name)
             entity_extraction_prompt = keywords_prompt_template.format(text=query)
             entities = model.predict(entity_extraction_prompt).content.split("<->")
             # entities = [entity for entity in entities if all(char.isalnum() or char in "汉字" for char in entity)]
 
         return entities
 
+    def _local_entities(self, query):
+        """本地 NER，只保留 TF-IDF 对齐分数不低于 ner_min_score 的实体"""
+        if not config.get("enable_local_ner", True):
+            return []
+
+        try:
+            ner_result = self.kg_agent.ner.ner(query, with_scores=True)
+        except Exception as e:
+            _log.error(f"本地实体识别失败: {e}")
+            return []
+
+        min_score = config.get("ner_min_score", 0.8)
+        entities = [name for matches in ner_result.values() for name, score in matches if score >= min_score]
+        _log.debug(f"本地实体识别结果: {ner_result}, 采用: {entities}")
+        return entities
+
     def _extract_relationship_info(self, relationship, source_name=None, target_name=None, node_dict=None):
         """
         提取关系信息并返回格式化的节点和边信息
@@ -269,7 +649,10 @@ class Retriever:
 
         return formatted_results
 
-    def __call__(self, query, history, meta):
-        refs = self.retrieval(query, history, meta)
-        query = self.construct_query(query, refs, meta)
+    def __call__(self, query, history, meta, on_source_done=None):
+        start = time.perf_counter()
+        refs = self.retrieval(query, history, meta, on_source_done)
+        with timed(refs["latency"], "construct_query"):
+            query = self.construct_query(query, refs, meta)
+        refs["latency"]["timings"]["total"] = round((time.perf_counter() - start) * 1000, 2)
         return query, refs
@@ -3,11 +3,14 @@
 import os
 import logging
 import traceback
+from types import SimpleNamespace
 from typing import Any, Dict, List, Callable
 
 from pymilvus import connections, Collection
 from configs.settings import CONFIG as config
 from src.models.embedding import get_embedding_model
+from src.stores.chunk_store import ChunkStore
+from src.stores.vector_index import build_search_params, is_quantized, rescore
 
 try:
     from src.models.reranker_model import RerankerWrapper
@@ -39,6 +42,15 @@ class VectorRecaller:
         self.rerank_threshold: float = config.get("default_rerank_threshold", 0.1)
         self.max_query_count: int = config.get("default_max_query_count", 20)
         self.top_k: int = config.get("default_top_k", 10)
+        # 量化索引（IVF_SQ8 / IVF_PQ）过量召回 rescore_factor 倍，再用原始向量重打分
+        self.index_type = self.collection.indexes[0].params.get("index_type") if self.collection.indexes else None
+        self.nprobe: int = config.get("index_nprobe", 8)
+        self.rescore_factor: int = config.get("quantized_rescore_factor", 4)
+
+        # 配置了 recall_text_store（与 MilvusStorage 的 text_store 为同一 ChunkStore 目录）时，
+        # 检索只返回主键、距离与 metadata，文本只为通过过滤的命中从本地读取；否则文本随检索结果一起返回
+        text_store = config.get("recall_text_store")
+        self.text_store = ChunkStore(text_store) if text_store else None
 
         self.embed_model = get_embedding_model(config_obj)
         if self.embed_model is None:
@@ -56,22 +68,30 @@ class VectorRecaller:
             logger.info("Reranker not enabled or not available.")
 
     def search_by_vector(self, vector: List[float], limit: int = 10) -> List[Any]:
-        search_params = {
-            "metric_type": "COSINE",
-            "params": {"nprobe": 8, "ef": 64}
-        }
+        search_params = build_search_params(self.index_type, "COSINE", nprobe=self.nprobe)
+        fields = ["metadata"] if self.text_store is not None else ["text", "metadata"]
+        quantized = is_quantized(self.index_type)
 
         results = self.collection.search(
             data=[vector],
             anns_field="embedding",
             param=search_params,
-            limit=limit,
+            limit=limit * self.rescore_factor if quantized else limit,
             expr="text_length > 50",
-            output_fields=["text", "metadata"]
+            output_fields=fields + ["embedding"] if quantized else fields
         )
 
         hits = results[0] if results else []
-        return hits
+        if not quantized:
+            return hits
+
+        # 量化索引的距离是近似值，用原始向量重新计算后取前 limit 个
+        rescored = rescore(vector, [
+            {"id": hit.id, "distance": hit.distance, "vector": hit.entity.get("embedding"),
+             "entity": SimpleNamespace(**{f: hit.entity.get(f) for f in fields})}
+            for hit in hits
+        ], "COSINE")[:limit]
+        return [SimpleNamespace(**h) for h in rescored]
 
     def search(self, query: str, limit: int = 10) -> List[Any]:
         vectors = self.embed_model.batch_encode([query])
@@ -80,6 +100,12 @@ class VectorRecaller:
             return []
         return self.search_by_vector(vectors[0], limit)
 
+    def fetch_texts(self, hits: List[Any]) -> Dict[Any, str]:
+        """命中的文本：本地 ChunkStore 按主键读取，否则直接取检索结果中的 text 字段"""
+        if self.text_store is not None:
+            return self.text_store.get([hit.id for hit in hits]) if hits else {}
+        return {hit.id: getattr(hit.entity, "text", "") or "" for hit in hits}
+
     def query(self, query: str, **kwargs) -> Dict[str, Any]:
         distance_threshold = kwargs.get("distance_threshold", self.distance_threshold)
         rerank_threshold = kwargs.get("rerank_threshold", self.rerank_threshold)
@@ -89,15 +115,17 @@ class VectorRecaller:
         hits = self.search(query, limit=max_query_count)
 
         filtered_hits = [hit for hit in hits if hit.distance < distance_threshold]
+        # 不重排序时只有前 top_k 个命中会被返回
+        texts = self.fetch_texts(filtered_hits if self.reranker else filtered_hits[:top_k])
 
         results_with_scores = []
         if self.reranker and filtered_hits:
-            texts = [getattr(hit.entity, "text", "") for hit in filtered_hits]
-            rerank_scores = self.reranker.run(query, texts, normalize=False)
+            rerank_scores = self.reranker.run(query, [texts.get(hit.id, "") for hit in filtered_hits],
+                                              normalize=False)
 
             for hit, score in zip(filtered_hits, rerank_scores):
                 result = {
-                    "text": getattr(hit.entity, "text", ""),
+                    "text": texts.get(hit.id, ""),
                     "metadata": getattr(hit.entity, "metadata", {}),
                     "distance": hit.distance,
                     "rerank_score": score
@@ -112,7 +140,7 @@ class VectorRecaller:
         else:
             results_with_scores = [
                 {
-                    "text": getattr(hit.entity, "text", ""),
+                    "text": texts.get(hit.id, ""),
                     "metadata": getattr(hit.entity, "metadata", {}),
                     "distance": hit.distance,
                     "rerank_score": None
@@ -134,6 +162,8 @@ class VectorRecaller:
         return retriever
 
     def close(self) -> None:
+        if self.text_store is not None:
+            self.text_store.close()
         connections.disconnect("default")
         logger.info("Milvus connection closed.")
 
@@ -0,0 +1,178 @@
+"""
+缓存预热：从请求日志中取出近期高频问题，重放 embedding、知识库检索、重排序与查询改写
+"""
+import os
+import json
+import time
+import threading
+from collections import Counter
+from typing import Any, Dict, List, Optional
+
+from src import config
+from src.stores.kb_router import AUTO_ROUTE
+from src.utils.cache import normalize_text
+from src.utils.logger import LogManager
+
+_log = LogManager()
+
+# 影响检索结果、需要随问题一起记录的 meta 字段
+_LOGGED_META_KEYS = ("db_id", "db_ids", "use_graph", "use_web", "mode", "use_rewrite_query")
+
+
+class QueryLog:
+    """
+    以 jsonl 形式记录用户问题，供预热任务统计高频问题
+
+    - record 只把记录放进内存缓冲区，由后台线程每 flush_interval 秒批量写入文件，不在请求路径上做磁盘 IO
+    - 文件超过 max_bytes 时轮转为 query_log.jsonl.1（只保留一个旧文件），统计时两个文件一起读取
+    """
+
+    def __init__(self, path: Optional[str] = None, max_bytes: int = 16 * 2 ** 20,
+                 flush_interval: float = 5) -> None:
+        self.path = path or os.path.join(config.save_dir, "data", "query_log.jsonl")
+        self.max_bytes = max_bytes
+        self.flush_interval = flush_interval
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._buffer: List[str] = []
+        self._thread = None
+
+    def record(self, query: str, meta: Dict[str, Any]) -> None:
+        item = {
+            "ts": time.time(),
+            "query": query,
+            "meta": {k: meta[k] for k in _LOGGED_META_KEYS if k in meta},
+        }
+        with self._lock:
+            self._buffer.append(json.dumps(item, ensure_ascii=False) + "\n")
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._flush_loop, name="query-log", daemon=True)
+                self._thread.start()
+
+    def _flush_loop(self) -> None:
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except OSError as e:
+                _log.error(f"写入请求日志失败: {e}")
+
+    def flush(self) -> None:
+        with self._lock:
+            lines, self._buffer = self._buffer, []
+            if not lines:
+                return
+            if self.max_bytes and os.path.exists(self.path) and os.path.getsize(self.path) >= self.max_bytes:
+                os.replace(self.path, self.path + ".1")
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.writelines(lines)
+
+    def top_queries(self, n: int = 200, days: float = 7) -> List[Dict[str, Any]]:
+        """返回最近 days 天内出现次数最多的 n 个（问题, meta）组合"""
+        self.flush()
+        since = time.time() - days * 86400
+        counter, samples = Counter(), {}
+        for path in (self.path + ".1", self.path):
+            if not os.path.exists(path):
+                continue
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        item = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    if item.get("ts", 0) < since:
+                        continue
+                    key = (normalize_text(item["query"]), json.dumps(item["meta"], sort_keys=True))
+                    counter[key] += 1
+                    samples.setdefault(key, item)
+
+        return [{**samples[key], "count": count} for key, count in counter.most_common(n)]
+
+
+class CacheWarmer:
+    """
+    预热任务：
+    - 启动时执行一次，之后按 interval 秒定期执行
+    - 按 cpu_budget（0~1）控制占用：每处理完一个问题，按它的墙钟耗时补足休眠，预热占用的时间比例不超过 cpu_budget。
+      不用 time.thread_time：embedding / 重排序的 torch 算子线程与 HTTP 重排序服务的耗时都不计入本线程的 CPU 时间
+    """
+
+    def __init__(self, retriever, query_log: QueryLog, top_n: int = 200, days: float = 7,
+                 interval: Optional[float] = 3600, cpu_budget: float = 0.2) -> None:
+        self.retriever = retriever
+        self.query_log = query_log
+        self.top_n = top_n
+        self.days = days
+        self.interval = interval
+        self.cpu_budget = min(max(cpu_budget, 0.01), 1.0)
+        self._stop = threading.Event()
+        self._thread = None
+        self._run_lock = threading.Lock()
+        self.status: Dict[str, Any] = {"state": "idle", "last_run": None}
+
+    def start(self) -> None:
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name="cache-warmer", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def _loop(self) -> None:
+        while not self._stop.is_set():
+            self.run_once()
+            if not self.interval or self._stop.wait(self.interval):
+                break
+
+    def _throttle(self, busy: float) -> None:
+        if self.cpu_budget < 1.0:
+            self._stop.wait(busy * (1.0 / self.cpu_budget - 1.0))
+
+    def warm_query(self, query: str, meta: Dict[str, Any]) -> None:
+        from rag.core.retriever import knowledge_base
+
+        refs = {"meta": meta, "latency": {"timings": {}, "counts": {}}}
+        if self.retriever._rewrite_mode(refs) != "off":
+            query = self.retriever.rewrite_query(query, [], refs)
+
+        if meta.get("db_ids") and config.enable_knowledge_base:
+            db_ids = None if meta["db_ids"] == AUTO_ROUTE else meta["db_ids"]
+            knowledge_base.search_many(query=query, db_ids=db_ids, rerank=True)
+        elif meta.get("db_id") and config.enable_knowledge_base:
+            # 检索会依次经过 embedding、Milvus、重排序，填充沿途配置的缓存
+            knowledge_base.search(query=query, db_id=meta["db_id"], rerank=True)
+        elif knowledge_base.embed_model is not None:
+            knowledge_base.embed_model.batch_encode_queries([query])
+
+    def run_once(self) -> Dict[str, Any]:
+        if not self._run_lock.acquire(blocking=False):
+            return self.status
+
+        try:
+            items = self.query_log.top_queries(self.top_n, self.days)
+            self.status = {"state": "running", "total": len(items), "done": 0, "failed": 0,
+                           "started_at": time.time(), "last_run": self.status.get("last_run")}
+            _log.info(f"缓存预热开始，共 {len(items)} 个高频问题")
+
+            for item in items:
+                if self._stop.is_set():
+                    break
+                start = time.perf_counter()
+                try:
+                    self.warm_query(item["query"], item["meta"])
+                    self.status["done"] += 1
+                except Exception as e:
+                    self.status["failed"] += 1
+                    _log.warning(f"预热失败: {item['query']}: {e}")
+                self._throttle(time.perf_counter() - start)
+
+            finished = time.time()
+            self.status.update(state="finished", finished_at=finished, last_run=finished,
+                               elapsed=round(finished - self.status["started_at"], 2))
+            _log.info(f"缓存预热完成: {self.status}")
+            return self.status
+        finally:
+            self._run_lock.release()
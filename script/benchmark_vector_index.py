@@ -0,0 +1,117 @@
+"""
+向量索引类型对比：内存、检索时延与 recall@k
+
+    python -m script.benchmark_vector_index --uri http://localhost:19530 --n 100000 --dim 1024
+    python -m script.benchmark_vector_index --vectors saves/bench/bge_vectors.npy --index-types IVF_FLAT,IVF_SQ8,IVF_PQ
+
+--vectors 可以传入真实的 embedding（.npy，形状 [n, dim]），否则使用聚类分布的随机向量；
+随机向量的 recall 会明显低于真实数据，比较不同索引类型的相对差异即可。
+量化索引（IVF_SQ8 / IVF_PQ）会额外测一组“过量召回 + 原始向量重打分”的结果。
+"""
+import time
+import argparse
+
+import numpy as np
+from pymilvus import MilvusClient, DataType
+
+from src.stores.vector_index import (
+    build_index_params, build_search_params, estimate_memory, is_quantized, rescore
+)
+
+
+def make_vectors(n: int, dim: int, n_clusters: int = 256, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(n_clusters, dim)).astype(np.float32)
+    vecs = centers[rng.integers(0, n_clusters, size=n)] + 0.5 * rng.normal(size=(n, dim)).astype(np.float32)
+    return vecs / np.linalg.norm(vecs, axis=1, keepdims=True)
+
+
+def ground_truth(data: np.ndarray, queries: np.ndarray, k: int) -> np.ndarray:
+    scores = queries @ data.T
+    return np.argsort(-scores, axis=1)[:, :k]
+
+
+def create_collection(client: MilvusClient, name: str, dim: int, index_type: str, nlist: int) -> None:
+    if client.has_collection(name):
+        client.drop_collection(name)
+    schema = MilvusClient.create_schema(auto_id=False, enable_dynamic_field=False)
+    schema.add_field("id", DataType.INT64, is_primary=True)
+    schema.add_field("vector", DataType.FLOAT_VECTOR, dim=dim)
+    index_params = client.prepare_index_params()
+    index_params.add_index(field_name="vector", **build_index_params(index_type, "COSINE", dim, nlist=nlist))
+    client.create_collection(name, schema=schema, index_params=index_params)
+
+
+def run_queries(client, name, index_type, queries, k, nprobe, rescore_factor=None):
+    latencies, found = [], []
+    search_params = build_search_params(index_type, nprobe=nprobe)
+    for q in queries:
+        start = time.perf_counter()
+        if rescore_factor:
+            hits = client.search(name, [q.tolist()], limit=k * rescore_factor, output_fields=["vector"],
+                                 search_params=search_params)[0]
+            hits = rescore(q, [{"id": h["id"], "distance": h["distance"], "vector": h["entity"]["vector"]}
+                               for h in hits])[:k]
+        else:
+            hits = client.search(name, [q.tolist()], limit=k, search_params=search_params)[0]
+        latencies.append((time.perf_counter() - start) * 1000)
+        found.append([h["id"] for h in hits])
+    return latencies, found
+
+
+def recall_at_k(found, truth) -> float:
+    k = truth.shape[1]
+    return float(np.mean([len(set(f) & set(t.tolist())) / k for f, t in zip(found, truth)]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Milvus 向量索引类型对比")
+    parser.add_argument("--uri", default="http://localhost:19530")
+    parser.add_argument("--vectors", default=None, help="真实 embedding 的 .npy 文件")
+    parser.add_argument("--n", type=int, default=100000)
+    parser.add_argument("--dim", type=int, default=1024)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--nlist", type=int, default=1024)
+    parser.add_argument("--nprobe", type=int, default=16)
+    parser.add_argument("--rescore-factor", type=int, default=4)
+    parser.add_argument("--index-types", default="FLAT,IVF_FLAT,HNSW,IVF_SQ8,IVF_PQ")
+    args = parser.parse_args()
+
+    if args.vectors:
+        vecs = np.load(args.vectors).astype(np.float32)
+        vecs /= np.linalg.norm(vecs, axis=1, keepdims=True)
+    else:
+        vecs = make_vectors(args.n + args.queries, args.dim)
+    data, queries = vecs[:-args.queries], vecs[-args.queries:]
+    n, dim = data.shape
+    truth = ground_truth(data, queries, args.k)
+    print(f"数据: n={n}, dim={dim}, queries={len(queries)}, k={args.k}")
+
+    client = MilvusClient(uri=args.uri)
+    rows = []
+    for index_type in [t.strip().upper() for t in args.index_types.split(",") if t.strip()]:
+        name = f"bench_{index_type.lower()}"
+        create_collection(client, name, dim, index_type, args.nlist)
+        start = time.perf_counter()
+        for i in range(0, n, 5000):
+            client.insert(name, [{"id": j, "vector": data[j].tolist()} for j in range(i, min(i + 5000, n))])
+        client.flush(name)
+        build_s = time.perf_counter() - start
+
+        settings = [(index_type, None)]
+        if is_quantized(index_type):
+            settings.append((f"{index_type}+rescore x{args.rescore_factor}", args.rescore_factor))
+        for label, factor in settings:
+            latencies, found = run_queries(client, name, index_type, queries, args.k, args.nprobe, factor)
+            rows.append((label, estimate_memory(index_type, n, dim) / 2 ** 20, np.percentile(latencies, 50),
+                         np.percentile(latencies, 99), recall_at_k(found, truth), build_s))
+        client.drop_collection(name)
+
+    print(f"\n{'index':<24}{'memory(MB)':>12}{'p50(ms)':>10}{'p99(ms)':>10}{'recall@' + str(args.k):>11}{'insert(s)':>11}")
+    for label, mem, p50, p99, recall, build_s in rows:
+        print(f"{label:<24}{mem:>12.1f}{p50:>10.2f}{p99:>10.2f}{recall:>11.3f}{build_s:>11.1f}")
+
+
+if __name__ == "__main__":
+    main()
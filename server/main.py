@@ -11,6 +11,14 @@ load_dotenv(Path(__file__).parent.parent / ".env")
 app = FastAPI()
 app.include_router(router)
 
+@app.on_event("startup")
+async def start_cache_warmer():
+    from src import config
+    from server.routers.chat_router import cache_warmer
+    if config.get("enable_cache_warmup", False):
+        cache_warmer.start()
+
+
 # CORS 设置
 app.add_middleware(
     CORSMiddleware,
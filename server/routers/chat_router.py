@@ -8,14 +8,27 @@ from fastapi import APIRouter, Body, HTTPException
 from fastapi.responses import StreamingResponse
 from langchain.schema import BaseMessage, HumanMessage, AIMessage, SystemMessage
 
-from src import executor, config, get_retriever
+from src import executor, config, get_retriever, answer_cache, knowledge_base
 from rag.core import HistoryManager
+from rag.core.prompts import get_system_prompt, get_stable_system_prompt
+from rag.core.retriever import is_stable_layout
+from rag.core.warmup import QueryLog, CacheWarmer
 from src.models import select_model
 from src.utils.logger import LogManager
+from src.utils.metrics import latency_metrics, count_metrics
 from src.qa import PokemonKGChatAgent
 retriever = get_retriever()
 logger = LogManager()
 kg_chat_agent = PokemonKGChatAgent()
+query_log = QueryLog(max_bytes=int(config.get("query_log_max_mb", 16) * 2 ** 20))
+cache_warmer = CacheWarmer(
+    retriever,
+    query_log,
+    top_n=config.get("cache_warmup_top_n", 200),
+    days=config.get("cache_warmup_days", 7),
+    interval=config.get("cache_warmup_interval", 3600),
+    cpu_budget=config.get("cache_warmup_cpu_budget", 0.2),
+)
 
 chat = APIRouter(prefix="/chat")
 
@@ -62,7 +75,7 @@ def make_chunk(meta: Dict[str, Any],
 
 
 def need_retrieve(meta: Dict[str, Any]) -> bool:
-    return meta.get("use_web") or meta.get("use_graph") or meta.get("db_id")
+    return meta.get("use_web") or meta.get("use_graph") or meta.get("db_id") or meta.get("db_ids")
 
 # ---------------------------------------------------------
 # Routes
@@ -88,11 +101,37 @@ async def chat_post(
         raise HTTPException(status_code=500, detail="没有可用的模型，请检查模型配置")
 
     meta["server_model_name"] = model.model_name
-    history_manager = HistoryManager(system_prompt=meta.get("system_prompt"))
+    stable_layout = is_stable_layout(meta)
+    if stable_layout:
+        # 稳定前缀：system 提示只放静态内容，时间等每轮变化的内容放到最后一条用户消息
+        system_prompt = get_stable_system_prompt(meta.get("system_prompt"),
+                                                 meta.get("static_context", config.get("static_context")))
+    else:
+        system_prompt = meta.get("system_prompt")
+    history_manager = HistoryManager(system_prompt=system_prompt)
 
     logger.debug(f"Received query: {query} with meta: {meta}")
+    if config.get("enable_query_log", config.get("enable_cache_warmup", False)):
+        query_log.record(query, meta)
 
     # ---------------------------------------------------------------------------
+    async def replay_cached_response(cached):
+        """命中问答缓存时，按正常流程的 chunk 顺序回放缓存的答案"""
+        if need_retrieve(meta):
+            yield make_chunk(meta, status="searching")
+            yield make_chunk(meta, status="generating")
+
+        for delta in cached["chunks"]:
+            yield make_chunk(meta, content=delta, status="loading")
+
+        history_manager.add_user(query)
+        updated_history = history_manager.update_ai("".join(cached["chunks"]))
+        yield make_chunk(meta,
+                         status="finished",
+                         history=convert_messages_to_dicts(updated_history),
+                         refs=cached["refs"],
+                         cached=True)
+
     async def generate_response():
         modified_query = query
         refs = None
@@ -101,12 +140,29 @@ async def chat_post(
         if meta and need_retrieve(meta):
             yield make_chunk(meta, status="searching")
             try:
+                # 检索放到线程池执行，每个检索源完成时立即以 refs_partial 返回给前端
+                loop = asyncio.get_running_loop()
+                partial_queue: asyncio.Queue = asyncio.Queue()
 
-                modified_query, refs = retriever(
-                    modified_query,
-                    history_manager.history.messages,
-                    meta
+                def on_source_done(source, result):
+                    loop.call_soon_threadsafe(partial_queue.put_nowait, (source, result))
+
+                retrieval_task = loop.run_in_executor(
+                    executor,
+                    lambda: retriever(modified_query, history_manager.history.messages, meta,
+                                      on_source_done=on_source_done)
                 )
+                while not (retrieval_task.done() and partial_queue.empty()):
+                    get_partial = asyncio.ensure_future(partial_queue.get())
+                    done, _ = await asyncio.wait({get_partial, retrieval_task},
+                                                 return_when=asyncio.FIRST_COMPLETED)
+                    if get_partial in done:
+                        source, result = get_partial.result()
+                        yield make_chunk(meta, status="refs_partial", source=source, partial_refs=result)
+                    else:
+                        get_partial.cancel()
+
+                modified_query, refs = await retrieval_task
             except Exception as e:
                 logger.error(f"Retriever error: {e}\n{traceback.format_exc()}")
                 yield make_chunk(meta,
@@ -116,6 +172,8 @@ async def chat_post(
             yield make_chunk(meta, status="generating")
 
         # 3. 构造 Prompt ----
+        if stable_layout:
+            modified_query = f"{modified_query}\n\n{get_system_prompt()}"
         messages = history_manager.get_history_with_msg(
             modified_query,
             max_rounds=meta.get("history_round")
@@ -125,6 +183,7 @@ async def chat_post(
 
         content = ""
         reasoning_content = ""
+        chunks = []
         try:
             for delta in model.predict(formatted_messages, stream=True):
                 # 一些模型将「思考过程」放在 reasoning_content
@@ -136,10 +195,15 @@ async def chat_post(
                     continue
 
                 content += delta.content or ""
+                chunks.append(delta.content or "")
                 yield make_chunk(meta, content=delta.content, status="loading")
 
             logger.debug(f"Final response: {content}")
             logger.debug(f"Final reasoning response: {reasoning_content}")
+            usage = getattr(model, "last_usage", None)
+            if usage:
+                logger.info(f"Token usage: prompt={usage['prompt_tokens']}, cached={usage['cached_tokens']}, "
+                            f"completion={usage['completion_tokens']}")
 
             # 4. 更新历史，发送最终块
             updated_history = history_manager.update_ai(content)
@@ -148,17 +212,67 @@ async def chat_post(
             yield make_chunk(meta,
                              status="finished",
                              history=history_serializable,
-                             refs=refs)
+                             refs=refs,
+                             latency=(refs or {}).get("latency"),
+                             usage=usage)
+            if answer_cache.enabled and answer_cache.cacheable(refs):
+                await asyncio.get_running_loop().run_in_executor(
+                    executor, answer_cache.add, query, meta, chunks, refs)
         except Exception as e:
             logger.error(f"Model error: {e}\n{traceback.format_exc()}")
             yield make_chunk(meta,
                              message=f"Model error: {e}",
                              status="error")
 
+    # lookup 需要用 embedding 模型编码问题，放到线程池执行，避免阻塞事件循环
+    cached = None
+    if answer_cache.enabled:
+        cached = await asyncio.get_running_loop().run_in_executor(executor, answer_cache.lookup, query, meta)
+    if cached:
+        return StreamingResponse(replay_cached_response(cached),
+                                 media_type="application/json")
+
     return StreamingResponse(generate_response(),
                              media_type="application/json")
 
 
+@chat.get("/metrics/latency")
+async def get_latency_metrics():
+    """各检索阶段耗时的 p50 / p99（毫秒）"""
+    return latency_metrics.summary()
+
+
+@chat.get("/metrics/counts")
+async def get_count_metrics():
+    """每次请求的计数统计，例如送入 cross-encoder 的候选对数 rerank_pairs"""
+    return count_metrics.summary()
+
+
+@chat.get("/warmup")
+async def get_warmup_status():
+    """缓存预热任务状态"""
+    return cache_warmer.status
+
+
+@chat.post("/warmup")
+async def run_warmup():
+    """立即执行一次缓存预热（后台执行）"""
+    asyncio.get_running_loop().run_in_executor(executor, cache_warmer.run_once)
+    return {"message": "预热已开始"}
+
+
+@chat.get("/cache/stats")
+async def get_answer_cache_stats():
+    """问答缓存、查询向量缓存、重排序分数缓存的命中率等统计"""
+    query_cache = getattr(knowledge_base.embed_model, "query_cache", None)
+    score_cache = getattr(getattr(knowledge_base, "reranker", None), "score_cache", None)
+    return {
+        **answer_cache.stats(),
+        "query_embedding": query_cache.stats() if query_cache is not None else None,
+        "rerank_score": score_cache.stats() if score_cache is not None else None,
+    }
+
+
 @chat.post("/call")
 async def call(query: str = Body(...), meta: Dict[str, Any] = Body({})):
     """同步调用完整模型"""
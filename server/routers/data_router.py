@@ -8,18 +8,14 @@ from fastapi import APIRouter, File, UploadFile, HTTPException, Body, Query
 from fastapi.responses import JSONResponse
 
 from src.utils.logger import LogManager
-from src import config
-from src.stores import KnowledgeBase
+from src import answer_cache, knowledge_base
 from src.utils import hashstr
 
 logger = LogManager()
 data = APIRouter(prefix="/data")
 
-# 单例 或者 在模块顶层初始化一次
-kb = KnowledgeBase(
-    milvus_uri=config.get("milvus_uri"),
-    embedding_config={"enable_knowledge_base": True, **config}
-)
+# 与检索共用进程内唯一的 KnowledgeBase：同一目录上的多个实例各自缓存状态，会互相覆盖写入
+kb = knowledge_base
 
 @data.get("/")
 async def list_databases():
@@ -35,11 +31,12 @@ async def list_databases():
 async def create_database(
     database_name: str = Body(...),
     description: str = Body(...),
-    dimension: Optional[int] = Body(None)
+    dimension: Optional[int] = Body(None),
+    index_type: Optional[str] = Body(None)
 ):
-    """创建一个新的知识库 Collection"""
+    """创建一个新的知识库 Collection，index_type 可选 IVF_SQ8 / IVF_PQ 等量化索引以节省内存"""
     try:
-        info = kb.create_database(database_name, description, dimension)
+        info = kb.create_database(database_name, description, dimension, index_type)
         return JSONResponse(info)
     except Exception as e:
         logger.error(f"create_database failed: {e}\n{traceback.format_exc()}")
@@ -50,6 +47,7 @@ async def delete_database(db_id: str = Query(...)):
     """删除一个 Collection"""
     try:
         kb.delete_database(db_id)
+        answer_cache.invalidate(db_id)
         return {"message": "删除成功"}
     except Exception as e:
         logger.error(f"delete_database failed: {e}\n{traceback.format_exc()}")
@@ -84,6 +82,7 @@ async def ingest_file(
             chunk_overlap=chunk_overlap,
             ocr_det_threshold=ocr_threshold
         )
+        answer_cache.invalidate(db_id)
         return {"file_id": file_id, "status": "success"}
     except Exception as e:
         logger.error(f"ingest_file failed: {e}\n{traceback.format_exc()}")
@@ -98,6 +97,7 @@ async def ingest_directory(
     """把服务器目录下所有支持后缀的文件批量导入"""
     try:
         ids = kb.ingest_directory(db_id, folder, suffixes)
+        answer_cache.invalidate(db_id)
         return {"file_ids": ids, "status": "success"}
     except Exception as e:
         logger.error(f"ingest_directory failed: {e}\n{traceback.format_exc()}")
@@ -109,22 +109,130 @@ async def search_kb(
     db_id: str = Query(...),
     distance_threshold: float = Query(None),
     rerank: bool = Query(True),
-    top_k: int = Query(None)
+    top_k: int = Query(None),
+    file_ids: Optional[List[str]] = Query(None),
+    file_types: Optional[List[str]] = Query(None),
+    created_after: Optional[float] = Query(None),
+    created_before: Optional[float] = Query(None),
+    output_fields: Optional[List[str]] = Query(None)
 ):
-    """向量检索接口"""
+    """
+    向量检索接口
+    - file_ids / file_types / created_after / created_before: 元数据过滤
+    - output_fields: 结果中保留的字段，如 output_fields=file_id；只需要 id 与分数时传 output_fields=
+    """
     try:
         res = kb.search(
             query=query,
             db_id=db_id,
             distance_threshold=distance_threshold,
             rerank=rerank,
-            top_k=top_k
+            top_k=top_k,
+            filters={
+                "file_ids": file_ids,
+                "file_types": file_types,
+                "created_after": created_after,
+                "created_before": created_before,
+            },
+            output_fields=[f for f in output_fields if f] if output_fields is not None else None
         )
         return res
     except Exception as e:
         logger.error(f"search_kb failed: {e}\n{traceback.format_exc()}")
         raise HTTPException(500, str(e))
 
+@data.post("/search/batch")
+async def search_kb_batch(
+    queries: List[str] = Body(...),
+    db_id: str = Body(...),
+    distance_threshold: float = Body(None),
+    rerank: bool = Body(True),
+    top_k: int = Body(None),
+    filters: Optional[Dict[str, Any]] = Body(None),
+    output_fields: Optional[List[str]] = Body(None),
+    mmr: Optional[bool] = Body(None)
+):
+    """批量向量检索接口：一次编码、一次 Milvus 检索、一次批量重排序"""
+    try:
+        res = kb.search_batch(
+            queries=queries,
+            db_id=db_id,
+            distance_threshold=distance_threshold,
+            rerank=rerank,
+            top_k=top_k,
+            filters=filters,
+            output_fields=output_fields,
+            mmr=mmr
+        )
+        return {"results": res}
+    except Exception as e:
+        logger.error(f"search_kb_batch failed: {e}\n{traceback.format_exc()}")
+        raise HTTPException(500, str(e))
+
+@data.post("/bm25/rebuild")
+async def rebuild_lexical_index(db_id: str = Body(..., embed=True)):
+    """从 Milvus 已有分块重建某个知识库的 BM25 关键词索引"""
+    try:
+        count = kb.rebuild_lexical_index(db_id)
+        return {"db_id": db_id, "count": count, "status": "success"}
+    except Exception as e:
+        logger.error(f"rebuild_lexical_index failed: {e}\n{traceback.format_exc()}")
+        raise HTTPException(500, str(e))
+
+@data.get("/route")
+async def route_kb(
+    query: str = Query(...),
+    top_n: int = Query(None),
+    db_ids: Optional[List[str]] = Query(None)
+):
+    """按质心相关度为查询挑选知识库，db_ids 缺省为全部知识库"""
+    try:
+        return {"candidates": kb.route(query, db_ids, top_n)}
+    except Exception as e:
+        logger.error(f"route_kb failed: {e}\n{traceback.format_exc()}")
+        raise HTTPException(500, str(e))
+
+@data.post("/router/rebuild")
+async def rebuild_kb_router(db_id: str = Body(..., embed=True)):
+    """从 Milvus 已有向量重建某个知识库的路由质心"""
+    try:
+        count = kb.rebuild_kb_router(db_id)
+        return {"db_id": db_id, "count": count, "status": "success"}
+    except Exception as e:
+        logger.error(f"rebuild_kb_router failed: {e}\n{traceback.format_exc()}")
+        raise HTTPException(500, str(e))
+
+@data.get("/residency")
+async def residency_stats():
+    """各知识库 collection 的驻留状态、估算内存、加载次数与加载耗时"""
+    try:
+        return kb.residency_stats()
+    except Exception as e:
+        logger.error(f"residency_stats failed: {e}\n{traceback.format_exc()}")
+        raise HTTPException(500, str(e))
+
+@data.post("/residency/release")
+async def release_collection(db_id: str = Body(..., embed=True)):
+    """手动 release 一个 collection，下次检索时自动重新加载"""
+    if kb.residency is None:
+        raise HTTPException(400, "未开启 collection 驻留管理")
+    try:
+        return {"db_id": db_id, "released": kb.residency.release(db_id)}
+    except Exception as e:
+        logger.error(f"release_collection failed: {e}\n{traceback.format_exc()}")
+        raise HTTPException(500, str(e))
+
+@data.post("/residency/preload")
+async def preload_collections(db_ids: List[str] = Body(..., embed=True)):
+    """预加载即将用到的 collection（受内存预算限制）"""
+    if kb.residency is None:
+        raise HTTPException(400, "未开启 collection 驻留管理")
+    try:
+        return {"loaded": kb.residency.preload(db_ids)}
+    except Exception as e:
+        logger.error(f"preload_collections failed: {e}\n{traceback.format_exc()}")
+        raise HTTPException(500, str(e))
+
 @data.post("/upload")
 async def upload_file(
     file: UploadFile = File(...),
@@ -153,9 +261,8 @@ async def delete_document(
 ):
     """如果需要删某个文件对应的向量，顺便从 sqlite 里删记录"""
     try:
-        # 如果你的 KB 里还没写 delete_file，可以自行实现：
-        kb.client.delete(collection_name=db_id, filter=f"file_id=='{file_id}'")
-        kb.db_manager.delete_file(file_id)
+        kb.delete_document(db_id, file_id)
+        answer_cache.invalidate(db_id)
         return {"message": "删除成功"}
     except Exception as e:
         logger.error(f"delete_document failed: {e}\n{traceback.format_exc()}")
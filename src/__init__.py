@@ -8,9 +8,16 @@ executor = ThreadPoolExecutor()
 from src.config import Config
 config = Config()
 
-from src.stores import KnowledgeBase
+from src.stores import KnowledgeBase, SemanticAnswerCache
 knowledge_base = KnowledgeBase()
 
+answer_cache = SemanticAnswerCache(
+    knowledge_base.embed_model if config.get("enable_answer_cache", False) else None,
+    threshold=config.get("answer_cache_threshold", 0.95),
+    maxsize=config.get("answer_cache_size", 1000),
+    ttl=config.get("answer_cache_ttl", 24 * 3600),
+)
+
 def get_retriever():
     from rag.core.retriever import Retriever
     return Retriever()
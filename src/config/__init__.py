@@ -67,6 +67,9 @@ class Config(SimpleConfig):
         self.add_item("model_local_paths", default={}, des="本地模型路径")
         self.add_item("use_rewrite_query", default="off", des="重写查询", choices=["off", "on", "hyde"])
         self.add_item("device", default="cuda", des="运行本地模型的设备", choices=["cpu", "cuda"])
+        # 向量库
+        self.add_item("vector_backend", default="milvus", des="向量库后端（embedded 为进程内存储，向量以 float16 内存映射文件保存）", choices=["milvus", "embedded"])
+        self.add_item("embedded_vector_dir", default=None, des="进程内向量库目录，缺省为 saves/vector_store")
         ### <<< 默认配置结束
 
         self.load()
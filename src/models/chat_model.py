@@ -4,7 +4,7 @@
 import os
 from typing import List, Dict, Union, Generator, Any
 
-from openai import OpenAI
+from openai import OpenAI, BadRequestError
 from src.utils import logger
 from configs.settings import MODEL_API_KEY, MODEL_API_BASE, MODEL_NAME
 
@@ -16,12 +16,21 @@ class OpenAIBase:
     OpenAI 模型调用基础类，统一封装 openai.ChatAPI的调用。
     """
 
+    # 不支持 stream_options 的 (base_url, model_name)：select_model 每次请求都会新建实例，能力记录在类上，
+    # 同一个服务商只会失败一次
+    _no_stream_usage = set()
+
     def __init__(self, api_key: str = MODEL_API_KEY,
                  base_url: str = MODEL_API_BASE,
-                 model_name: str = MODEL_NAME) -> None:
+                 model_name: str = MODEL_NAME,
+                 stream_usage: bool = True) -> None:
         self.api_key = api_key
         self.base_url = base_url
         self.model_name = model_name
+        # 最近一次调用服务商返回的 token 用量（含前缀缓存命中的 cached_tokens）
+        self.last_usage = None
+        # 流式调用时是否请求 stream_options.include_usage；服务商不支持时自动关闭（见 _no_stream_usage）
+        self.stream_usage = stream_usage and (base_url, model_name) not in self._no_stream_usage
         # 创建OpenAI客户端实例
         self.client = OpenAI(api_key=api_key, base_url=base_url)
         _log.debug(f"Models: {self.get_models()}")
@@ -43,18 +52,41 @@ class OpenAIBase:
         :return: 模型返回的结果或生成器
         """
         messages = self._prepare_messages(message)
+        self.last_usage = None
         if stream:
             return self._stream_response(messages)
         else:
             return self._get_response(messages)
 
     def _stream_response(self, messages: List[Dict[str, str]]) -> Generator[Any, None, None]:
-        response = self.client.chat.completions.create(
-            model=self.model_name,
-            messages=messages,
-            stream=True
-        )
+        response = None
+        if self.stream_usage:
+            try:
+                response = self.client.chat.completions.create(
+                    model=self.model_name,
+                    messages=messages,
+                    stream=True,
+                    stream_options={"include_usage": True}
+                )
+            except BadRequestError as e:
+                # 只有与 stream_options 相关的 400 才回退，上下文超长、消息格式错误等直接抛出
+                if "stream_options" not in str(e) and "include_usage" not in str(e):
+                    raise
+                _log.warning(f"{self.model_name} 不支持 stream_options，之后的流式调用不再请求 token 用量: {e}")
+                self._no_stream_usage.add((self.base_url, self.model_name))
+                self.stream_usage = False
+        if response is None:
+            response = self.client.chat.completions.create(
+                model=self.model_name,
+                messages=messages,
+                stream=True
+            )
         for chunk in response:
+            if getattr(chunk, "usage", None):
+                self.last_usage = self._parse_usage(chunk.usage)
+            # 开启 include_usage 后，最后一个 chunk 只有 usage，没有 choices
+            if not chunk.choices:
+                continue
             yield chunk.choices[0].delta
 
     def _get_response(self, messages: List[Dict[str, str]]) -> Any:
@@ -63,8 +95,19 @@ class OpenAIBase:
             messages=messages,
             stream=False
         )
+        if getattr(response, "usage", None):
+            self.last_usage = self._parse_usage(response.usage)
         return response.choices[0].message
 
+    @staticmethod
+    def _parse_usage(usage: Any) -> Dict[str, int]:
+        details = getattr(usage, "prompt_tokens_details", None)
+        return {
+            "prompt_tokens": usage.prompt_tokens,
+            "completion_tokens": usage.completion_tokens,
+            "cached_tokens": (getattr(details, "cached_tokens", None) or 0) if details else 0,
+        }
+
     def get_models(self) -> List[Any]:
         try:
             return self.client.models.list()
@@ -94,6 +137,7 @@ class DashScope(OpenAIBase):
 
     def __init__(self, model_name: str = "qwen-max-latest") -> None:
         self.model_name = model_name
+        self.last_usage = None
         self.api_key = os.getenv("DASHSCOPE_API_KEY")
         _log.info(f"DashScope model: {self.model_name},using API key.")
 
@@ -7,10 +7,11 @@ import os
 import json
 import hashlib
 import requests
-from typing import List, Dict, Union, Generator, Any
+from typing import List, Dict, Union, Generator, Any, Optional
 
 from FlagEmbedding import FlagModel
 from src.utils import logger
+from src.utils.cache import LRUCache, make_key, normalize_text, shared_cache
 from configs.settings import *
 from configs.settings import EMBED_MODEL_INFO, MODEL_EMBEDDING_PATH
 
@@ -25,6 +26,9 @@ def hashstr(data: Union[str, List[str]]) -> str:
 
 class BaseEmbeddingModel:
     embed_state: Dict[str, Any] = {}
+    # 查询向量缓存，由 attach_query_cache 挂载；model_id 参与缓存键，切换模型后不会命中旧向量
+    query_cache: Optional[LRUCache] = None
+    model_id: str = ""
 
     def get_dimension(self) -> Union[int, None]:
         if hasattr(self, "dimension"):
@@ -66,6 +70,29 @@ class BaseEmbeddingModel:
 
         return data
 
+    def batch_encode_queries(self, queries: List[str]) -> List[Any]:
+        """
+        编码检索查询：先按（归一化文本, 模型标识）查缓存，只对未命中的查询调用 batch_encode。
+        文档入库仍直接使用 batch_encode，不占用缓存。
+        """
+        if self.query_cache is None:
+            return self.batch_encode(queries)
+
+        keys = [make_key(normalize_text(q), self.model_id) for q in queries]
+        vectors = [self.query_cache.get(k) for k in keys]
+        missing = {}
+        for i, vec in enumerate(vectors):
+            if vec is None:
+                missing.setdefault(keys[i], []).append(i)
+
+        if missing:
+            first = [idx[0] for idx in missing.values()]
+            for key, vec in zip(missing, self.batch_encode([queries[i] for i in first])):
+                self.query_cache.set(key, vec)
+                for i in missing[key]:
+                    vectors[i] = vec
+        return vectors
+
 
 class LocalEmbeddingModel(FlagModel, BaseEmbeddingModel):
     def __init__(self, config, **kwargs):
@@ -168,6 +195,18 @@ class OtherEmbedding(BaseEmbeddingModel):
         raise NotImplementedError("OtherEmbedding is not implemented yet.")
 
 
+def attach_query_cache(model: BaseEmbeddingModel, model_id: str, maxsize: int = 4096,
+                       ttl: Optional[float] = None, persist_path: Optional[str] = None) -> BaseEmbeddingModel:
+    """
+    给 embedding 模型挂载查询向量缓存（LRU，可选 sqlite 磁盘层）；
+    同一磁盘文件在进程内共享一个缓存，缓存键包含 model_id，不同模型不会互相命中
+    """
+    model.model_id = model_id
+    model.query_cache = shared_cache("query_embedding", maxsize=maxsize, ttl=ttl, persist_path=persist_path)
+    _log.info(f"Query embedding cache enabled for `{model_id}` (maxsize={maxsize})")
+    return model
+
+
 def get_embedding_model(config) -> Union[BaseEmbeddingModel, None]:
     if isinstance(config, dict):
         class ConfigObject:
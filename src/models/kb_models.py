@@ -3,9 +3,15 @@ from sqlalchemy.orm import relationship
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.sql import func
 import time
+from datetime import timezone
 
 Base = declarative_base()
 
+
+def utc_timestamp(dt):
+    """created_at 由 sqlite 的 CURRENT_TIMESTAMP 生成，是不带时区的 UTC 时间，转为 unix 时间戳时按 UTC 解释"""
+    return dt.replace(tzinfo=timezone.utc).timestamp() if dt else None
+
 class KnowledgeDatabase(Base):
     """知识库模型"""
     __tablename__ = 'knowledge_databases'
@@ -68,7 +74,7 @@ class KnowledgeFile(Base):
             "path": self.path,
             "type": self.file_type,
             "status": self.status,
-            "created_at": self.created_at.timestamp() if self.created_at else time.time()
+            "created_at": utc_timestamp(self.created_at) if self.created_at else time.time()
         }
 
         # 添加节点信息
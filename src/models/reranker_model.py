@@ -4,13 +4,17 @@ warnings.filterwarnings("ignore", category=FutureWarning)
 
 import os
 import json
+import hashlib
 import requests
 import numpy as np
 import logging
 import torch
-from typing import List, Tuple, Union
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Tuple, Union
 from transformers import AutoTokenizer, AutoModelForSequenceClassification
 
+from src.utils.cache import LRUCache, make_key, normalize_text, shared_cache
+
 try:
     from FlagEmbedding import FlagReranker  # 可选依赖
 except ImportError:
@@ -83,11 +87,12 @@ class SiliconFlowReranker:
 
 
 class RerankerWrapper:
-    def __init__(self, reranker_key, model_name, local_path=None, device="cpu"):
+    def __init__(self, reranker_key, model_name, local_path=None, device="cpu", max_concurrency=8):
+        """max_concurrency: SiliconFlow 接口一次只支持一个 query，多查询重排序时最多并发的请求数"""
         self.device = device
         self.reranker_key = reranker_key
         provider, short_name = reranker_key.split("/", 1)
-        if not os.path.isdir(local_path):
+        if provider == "local" and not (local_path and os.path.isdir(local_path)):
             raise ValueError(f"local_path = {local_path} 不存在!")
 
         # 自动选择后端并初始化reranker属性
@@ -99,16 +104,78 @@ class RerankerWrapper:
             self.reranker = SiliconFlowReranker(model_name)
         else:
             raise ValueError(f"Invalid reranker provider: {provider}")
+        self._http_pool = ThreadPoolExecutor(max_workers=max_concurrency) \
+            if isinstance(self.reranker, SiliconFlowReranker) else None
+
+        # (query, chunk) 分数缓存，由 enable_score_cache 开启
+        self.score_cache: Optional[LRUCache] = None
+
+    def enable_score_cache(self, maxsize: int = 20000, ttl: Optional[float] = None,
+                           persist_path: Optional[str] = None) -> None:
+        """缓存未归一化的原始分数，键为 归一化 query + chunk 内容哈希 + reranker 标识"""
+        self.score_cache = shared_cache("rerank_score", maxsize=maxsize, ttl=ttl, persist_path=persist_path)
+
+    def _cache_key(self, query: str, doc: str) -> str:
+        return make_key(normalize_text(query), hashlib.md5(doc.encode("utf-8")).hexdigest(), self.reranker_key)
+
+    def _score(self, query: str, docs: List[str], normalize=True) -> List[float]:
+        if isinstance(self.reranker, SiliconFlowReranker):
+            return self.reranker.compute_score((query, docs), normalize=normalize)
+        pairs = [(query, doc) for doc in docs]
+        scores = self.reranker.compute_score(pairs, normalize=normalize)
+        return scores if isinstance(scores, list) else [scores]  # FlagReranker 只有一对时返回单个分数
+
+    def _score_batch(self, queries: List[str], docs_list: List[List[str]], normalize=True) -> List[List[float]]:
+        if isinstance(self.reranker, SiliconFlowReranker):
+            # 每个查询一次 HTTP 请求，通过有界线程池并发发出，结果按查询顺序返回
+            futures = [self._http_pool.submit(self._score, q, docs, normalize) if docs else None
+                       for q, docs in zip(queries, docs_list)]
+            return [future.result() if future else [] for future in futures]
+
+        pairs = [(q, doc) for q, docs in zip(queries, docs_list) for doc in docs]
+        scores = self.reranker.compute_score(pairs, normalize=normalize) if pairs else []
+        if not isinstance(scores, list):
+            scores = [scores]
+        out, offset = [], 0
+        for docs in docs_list:
+            out.append(scores[offset:offset + len(docs)])
+            offset += len(docs)
+        return out
 
     def run(self, query: str, docs: List[str], normalize=True):
         """
         调用不同后端的 reranker 来计算分数
         """
-        if isinstance(self.reranker, SiliconFlowReranker):
-            return self.reranker.compute_score((query, docs), normalize=normalize)
-        else:
-            pairs = [(query, doc) for doc in docs]
-            return self.reranker.compute_score(pairs, normalize=normalize)
+        return self.run_batch([query], [docs], normalize=normalize)[0]
+
+    def compute_score(self, sentence_pairs: Tuple[str, List[str]], normalize=False):
+        """与 SiliconFlowReranker 相同的调用方式：sentence_pairs = (query, docs)"""
+        query, docs = sentence_pairs
+        return self.run(query, docs, normalize=normalize)
+
+    def run_batch(self, queries: List[str], docs_list: List[List[str]], normalize=True) -> List[List[float]]:
+        """
+        多个查询的重排序：本地模型把所有 (query, doc) 拼成一批计算；
+        SiliconFlow 接口一次只支持一个 query，每个查询一个请求，最多 max_concurrency 个并发。
+        开启分数缓存时只计算未命中的 (query, doc)，命中的原始分数直接合并回来
+        """
+        if self.score_cache is None:
+            return self._score_batch(queries, docs_list, normalize)
+
+        keys_list = [[self._cache_key(q, doc) for doc in docs] for q, docs in zip(queries, docs_list)]
+        scores_list = [[self.score_cache.get(k) for k in keys] for keys in keys_list]
+        missing_list = [[i for i, sc in enumerate(scores) if sc is None] for scores in scores_list]
+
+        if any(missing_list):
+            fresh_list = self._score_batch(
+                queries, [[docs[i] for i in missing] for docs, missing in zip(docs_list, missing_list)],
+                normalize=False)
+            for scores, keys, missing, fresh in zip(scores_list, keys_list, missing_list, fresh_list):
+                for i, sc in zip(missing, fresh):
+                    scores[i] = float(sc)
+                    self.score_cache.set(keys[i], scores[i])
+
+        return [[float(sigmoid(sc)) for sc in scores] if normalize else scores for scores in scores_list]
 
 
 if __name__ == '__main__':
@@ -145,10 +145,11 @@ class tfidf_alignment:
                 self.tag_2_tfidf_model[ty] = tfidf_model
                 self.tag_2_embs[ty] = embs  # 保持稀疏格式
 
-    def align(self, ent_list):
+    def align(self, ent_list, with_scores=False):
         """
         ent_list 为 [(start_idx, end_idx, cls, ent), ...]
         返回一个 dict：{cls: best_matched_entity_name}
+        with_scores=True 时返回 {cls: [(entity_name, score), ...]}
         """
         new_result = {}
         for s, e, cls, ent in ent_list:
@@ -167,11 +168,14 @@ class tfidf_alignment:
             if max_score >= 0.7:
                 if cls not in new_result:
                     new_result[cls] = []
-                new_result[cls].append(self.tag_2_entity[cls][max_idx])
+                new_result[cls].append((self.tag_2_entity[cls][max_idx], float(max_score)))
 
-        # 去重
+        # 去重（同名实体保留最高分）
         for cls in new_result:
-            new_result[cls] = list(set(new_result[cls]))
+            best = {}
+            for name, score in new_result[cls]:
+                best[name] = max(score, best.get(name, 0.0))
+            new_result[cls] = list(best.items()) if with_scores else list(best)
 
         return new_result
 
@@ -251,7 +255,7 @@ def merge(model_result_word, rule_result):
     return check_result
 
 
-def get_ner_result(model, tokenizer, sen, rule, tfidf_r, device, idx2tag):
+def get_ner_result(model, tokenizer, sen, rule, tfidf_r, device, idx2tag, with_scores=False):
     sen_to = tokenizer.encode(sen, add_special_tokens=True, return_tensors='pt').to(device)
 
     pre = model(sen_to).tolist()
@@ -265,7 +269,7 @@ def get_ner_result(model, tokenizer, sen, rule, tfidf_r, device, idx2tag):
     rule_result = rule.find(sen)  # [(start,end,cls,word), ...]
 
     merge_result = merge(model_result_word, rule_result)
-    tfidf_result = tfidf_r.align(merge_result)
+    tfidf_result = tfidf_r.align(merge_result, with_scores=with_scores)
 
     # print('模型结果',model_result_word)
     # print('规则结果',rule_result)
@@ -1,2 +1,2 @@
 from .knowledgebase import  KnowledgeBase
-
+from .answer_cache import SemanticAnswerCache
@@ -0,0 +1,131 @@
+import time
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from src.stores.kb_router import AUTO_ROUTE
+from src.utils.cache import make_key
+from src.utils.logger import LogManager
+
+logger = LogManager()
+
+
+class SemanticAnswerCache:
+    """
+    基于向量相似度的问答缓存
+
+    - 用知识库的 embedding 模型编码问题，余弦相似度超过阈值即命中
+    - 只有 db_id(s) / use_graph / use_web / system_prompt / kb_filters / 生成模型 / 时延预算 / 改写与多查询开关
+      完全一致的条目才会参与比较
+    - 检索出错、超时、跳过或被时延规划降级的回答不写入缓存（见 cacheable）
+    - 知识库有新的导入或删除时，清除检索过该知识库的条目
+    """
+
+    def __init__(self, embed_model, threshold: float = 0.95, maxsize: int = 1000,
+                 ttl: Optional[float] = None) -> None:
+        self.embed_model = embed_model
+        self.threshold = threshold
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.embed_model is not None
+
+    @staticmethod
+    def scope(meta: Dict[str, Any]) -> str:
+        """影响答案的检索开关与生成模型，只有相同 scope 的问题才能共用答案"""
+        return make_key(meta.get("db_id"), meta.get("db_ids"), bool(meta.get("use_graph")),
+                        bool(meta.get("use_web")), meta.get("system_prompt"), meta.get("kb_filters"),
+                        meta.get("server_model_name"), meta.get("latency_budget_ms"),
+                        meta.get("use_rewrite_query"), meta.get("multi_query"))
+
+    @staticmethod
+    def cacheable(refs: Optional[Dict[str, Any]]) -> bool:
+        """只缓存检索完整完成的回答：检索抛错（refs 为 None）、有源超时 / 出错 / 被跳过、或阶段被降级时不缓存"""
+        return refs is not None and not any(refs.get(k) for k in ("timeouts", "errors", "skipped", "degraded"))
+
+    def _encode(self, query: str) -> np.ndarray:
+        vec = np.asarray(self.embed_model.batch_encode_queries([query])[0], dtype=np.float32)
+        return vec / (np.linalg.norm(vec) or 1.0)
+
+    def lookup(self, query: str, meta: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """返回命中的缓存条目（含 chunks / refs），未命中返回 None"""
+        if not self.enabled:
+            return None
+
+        vec = self._encode(query)
+        scope = self.scope(meta)
+        now = time.time()
+        with self._lock:
+            expired = [k for k, e in self._entries.items() if self.ttl and e["created"] + self.ttl < now]
+            for k in expired:
+                del self._entries[k]
+
+            keys = [k for k, e in self._entries.items() if e["scope"] == scope]
+            if keys:
+                matrix = np.stack([self._entries[k]["vector"] for k in keys])
+                sims = matrix @ vec
+                best = int(np.argmax(sims))
+                if sims[best] >= self.threshold:
+                    self.hits += 1
+                    self._entries.move_to_end(keys[best])
+                    entry = self._entries[keys[best]]
+                    logger.debug(f"问答缓存命中: {query} ~ {entry['query']} ({sims[best]:.3f})")
+                    return entry
+            self.misses += 1
+        return None
+
+    def add(self, query: str, meta: Dict[str, Any], chunks: List[str], refs: Optional[Dict[str, Any]] = None) -> None:
+        if not self.enabled or not chunks:
+            return
+
+        db_ids = meta.get("db_ids") or []
+        db_ids = {db_ids} if isinstance(db_ids, str) else set(db_ids)
+        if meta.get("db_id"):
+            db_ids.add(meta["db_id"])
+        entry = {
+            "query": query,
+            "vector": self._encode(query),
+            "scope": self.scope(meta),
+            "db_ids": db_ids,
+            "chunks": chunks,
+            "refs": refs,
+            "created": time.time(),
+        }
+        with self._lock:
+            self._entries[make_key(entry["scope"], query)] = entry
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, db_id: str) -> int:
+        """清除与某个知识库相关的缓存条目（自动路由的条目可能检索过任意知识库，一并清除），返回清除数量"""
+        with self._lock:
+            keys = [k for k, e in self._entries.items() if db_id in e["db_ids"] or AUTO_ROUTE in e["db_ids"]]
+            for k in keys:
+                del self._entries[k]
+        if keys:
+            logger.info(f"知识库 {db_id} 已更新，清除 {len(keys)} 条问答缓存")
+        return len(keys)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "threshold": self.threshold,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
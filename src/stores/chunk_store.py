@@ -0,0 +1,158 @@
+import os
+import mmap
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterator, List
+
+from src.utils.logger import LogManager
+
+logger = LogManager()
+
+
+class ChunkStore:
+    """
+    单个知识库分块文本的本地存储，检索时 Milvus 只返回主键与距离，文本从这里按需读取
+
+    - chunks.bin：分块文本（utf-8）只追加写入，读取时通过 mmap 按偏移量切片
+    - chunks.idx：sqlite 偏移量索引 chunks(id, file_id, offset, length)，id 与 Milvus 主键一致
+    - 删除文件只删除索引，失效数据超过一半时自动压缩：压缩结果写入新一代的 chunks.<generation>.bin，
+      generation 记录在 chunks.idx 中，与偏移量在同一事务内更新
+    - 同一目录可以被多个 ChunkStore 同时打开：读写都在 sqlite 事务内进行，发现 generation 变化时
+      重新映射数据文件并重新打开写入句柄，不会按新偏移量读旧文件，也不会追加到已被替换的文件
+    """
+
+    def __init__(self, folder: str, compact_ratio: float = 0.5) -> None:
+        os.makedirs(folder, exist_ok=True)
+        self.folder = folder
+        self.compact_ratio = compact_ratio
+        self._lock = threading.Lock()
+        # 手动管理事务：读取时持有 sqlite 共享锁，保证读到的偏移量与 generation 一致
+        self._db = sqlite3.connect(os.path.join(folder, "chunks.idx"), check_same_thread=False,
+                                   isolation_level=None, timeout=30)
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS chunks (id INTEGER PRIMARY KEY, file_id TEXT, offset INTEGER, length INTEGER);
+            CREATE INDEX IF NOT EXISTS idx_chunks_file ON chunks (file_id);
+            CREATE TABLE IF NOT EXISTS store_meta (key TEXT PRIMARY KEY, value INTEGER);
+            INSERT OR IGNORE INTO store_meta VALUES ('generation', 0);
+        """)
+        self._generation = None
+        self._writer = None
+        self._reader = None
+        self._mmap = None
+        self._mapped = None  # 当前 mmap 对应的 generation
+
+    def _data_path(self, generation: int) -> str:
+        return os.path.join(self.folder, "chunks.bin" if generation == 0 else f"chunks.{generation}.bin")
+
+    def _current_generation(self) -> int:
+        return self._db.execute("SELECT value FROM store_meta WHERE key = 'generation'").fetchone()[0]
+
+    @contextmanager
+    def _transaction(self, write: bool = False) -> Iterator[int]:
+        """开启事务并返回当前 generation；写事务立即获取 sqlite 写锁，串行化多个实例的追加与压缩"""
+        self._db.execute("BEGIN IMMEDIATE" if write else "BEGIN")
+        try:
+            yield self._current_generation()
+        except BaseException:
+            self._db.execute("ROLLBACK")
+            raise
+        self._db.execute("COMMIT")
+
+    def put(self, ids: List[int], file_id: str, texts: List[str]) -> None:
+        with self._lock, self._transaction(write=True) as generation:
+            if self._generation != generation or self._writer is None:
+                self._reopen_writer(generation)
+            offset = self._writer.seek(0, os.SEEK_END)
+            rows = []
+            for doc_id, text in zip(ids, texts):
+                data = (text or "").encode("utf-8")
+                self._writer.write(data)
+                rows.append((doc_id, file_id, offset, len(data)))
+                offset += len(data)
+            self._writer.flush()
+            self._db.executemany("INSERT OR REPLACE INTO chunks VALUES (?, ?, ?, ?)", rows)
+
+    def get(self, ids: List[int]) -> Dict[int, str]:
+        """按主键读取文本，不存在的 id 不出现在结果中"""
+        ids = list(dict.fromkeys(ids))
+        if not ids:
+            return {}
+        with self._lock, self._transaction() as generation:
+            rows = []
+            for i in range(0, len(ids), 500):  # sqlite 单条语句的参数数量有限
+                batch = ids[i:i + 500]
+                rows += self._db.execute(
+                    f"SELECT id, offset, length FROM chunks WHERE id IN ({', '.join('?' * len(batch))})",
+                    batch).fetchall()
+            if rows and (self._mapped != generation or self._mmap is None
+                         or max(o + n for _, o, n in rows) > len(self._mmap)):
+                self._remap(generation)
+            return {doc_id: self._mmap[o:o + n].decode("utf-8") if n else "" for doc_id, o, n in rows}
+
+    def delete_file(self, file_id: str) -> None:
+        with self._lock:
+            stale = None
+            with self._transaction(write=True) as generation:
+                self._db.execute("DELETE FROM chunks WHERE file_id = ?", (file_id,))
+                live = self._db.execute("SELECT COALESCE(SUM(length), 0) FROM chunks").fetchone()[0]
+                path = self._data_path(generation)
+                size = os.path.getsize(path) if os.path.exists(path) else 0
+                if size and live < size * self.compact_ratio:
+                    stale = self._compact(generation)
+            # 提交之后新的读取都会使用新一代文件；仍持有旧文件 mmap 的实例不受删除影响
+            if stale:
+                os.remove(stale)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+
+    def close(self) -> None:
+        with self._lock:
+            self._unmap()
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+            self._db.close()
+
+    def _reopen_writer(self, generation: int) -> None:
+        if self._writer is not None:
+            self._writer.close()
+        self._writer = open(self._data_path(generation), "ab")
+        self._generation = generation
+
+    def _remap(self, generation: int) -> None:
+        self._unmap()
+        path = self._data_path(generation)
+        if os.path.exists(path) and os.path.getsize(path):
+            self._reader = open(path, "rb")
+            self._mmap = mmap.mmap(self._reader.fileno(), 0, access=mmap.ACCESS_READ)
+            self._mapped = generation
+
+    def _unmap(self) -> None:
+        if self._mmap is not None:
+            self._mmap.close()
+            self._reader.close()
+        self._mmap, self._reader, self._mapped = None, None, None
+
+    def _compact(self, generation: int) -> str:
+        """
+        把仍然有效的分块按顺序写入下一代数据文件，并在当前写事务内更新偏移量与 generation，
+        返回事务提交后可以删除的旧文件路径；其他实例下次读取时会按新 generation 重新映射
+        """
+        rows = self._db.execute("SELECT id, offset, length FROM chunks ORDER BY offset").fetchall()
+        old_path, new_path = self._data_path(generation), self._data_path(generation + 1)
+        updates, offset = [], 0
+        with open(old_path, "rb") as src, open(new_path, "wb") as dst:
+            for doc_id, o, n in rows:
+                src.seek(o)
+                dst.write(src.read(n))
+                updates.append((offset, doc_id))
+                offset += n
+        self._db.executemany("UPDATE chunks SET offset = ? WHERE id = ?", updates)
+        self._db.execute("UPDATE store_meta SET value = ? WHERE key = 'generation'", (generation + 1,))
+        self._unmap()
+        self._reopen_writer(generation + 1)
+        logger.info(f"分块文本已压缩: {self.folder}，保留 {len(rows)} 个分块")
+        return old_path
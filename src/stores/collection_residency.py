@@ -0,0 +1,325 @@
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+from src.utils.logger import LogManager
+from src.utils.metrics import latency_metrics
+
+logger = LogManager()
+
+# 进程内按状态文件共享的驻留管理器，见 shared_residency
+_shared: Dict[str, "CollectionResidency"] = {}
+_shared_lock = threading.Lock()
+
+
+class CollectionResidency:
+    """
+    Milvus collection 驻留管理：只让常用的知识库留在 Milvus 内存中
+
+    - 每次检索前通过 use() 登记使用；未加载的 collection 在此时透明地重新加载，加载耗时记入 collection_load
+    - 空闲超过 idle_ttl 秒的 collection 会被 release；加载后估算内存超过 memory_budget 时，
+      按最近最少使用的顺序 release 其他 collection（正在检索的 collection 不会被 release）
+    - 每个 collection 维护按 half_life 衰减的使用热度，后台任务定期预加载最热的 preload_n 个；
+      热度保存在 state_path 中，重启后仍然有效
+    """
+
+    def __init__(
+        self,
+        client,
+        estimate_memory: Callable[[str], int],
+        idle_ttl: Optional[float] = 1800,
+        memory_budget: Optional[int] = None,
+        preload_n: int = 0,
+        interval: float = 60,
+        half_life: float = 86400,
+        state_path: Optional[str] = None,
+        prefix: str = "kb_"
+    ) -> None:
+        self.client = client
+        self.estimate_memory = estimate_memory
+        self.idle_ttl = idle_ttl
+        self.memory_budget = memory_budget
+        self.preload_n = preload_n
+        self.interval = interval
+        self.half_life = half_life
+        self.state_path = state_path
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self._name_locks: Dict[str, threading.Lock] = {}
+        self._entries: Dict[str, Dict[str, Any]] = {}
+        self._stop = threading.Event()
+        self._thread = None
+        self._load_state()
+
+    # -- 使用登记 ---------------------------------------------------------
+    @contextmanager
+    def use(self, name: str) -> Iterator[float]:
+        """
+        登记一次使用并保证 collection 已加载，返回本次加载耗时（毫秒，已驻留时为 0）；
+        with 块内 collection 不会被 release
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._entry(name)
+            entry["inflight"] += 1
+            entry["last_used"] = now
+            entry["uses"] += 1
+            entry["hot"] = self._hotness(entry, now) + 1.0
+            entry["hot_ts"] = now
+        try:
+            yield self.ensure_loaded(name)
+        finally:
+            with self._lock:
+                entry["inflight"] -= 1
+
+    def ensure_loaded(self, name: str) -> float:
+        """未加载时加载 collection，返回加载耗时（毫秒）"""
+        with self._name_lock(name):
+            with self._lock:
+                if self._entry(name)["loaded"]:
+                    return 0.0
+            start = time.perf_counter()
+            self.client.load_collection(name)
+            ms = (time.perf_counter() - start) * 1000
+            memory = self._estimate(name)
+            with self._lock:
+                entry = self._entry(name)
+                entry.update(loaded=True, loaded_at=time.time(), memory=memory, last_load_ms=round(ms, 2))
+                entry["loads"] += 1
+            latency_metrics.observe("collection_load", ms)
+            logger.info(f"Collection {name} 已加载，耗时 {ms:.0f}ms")
+        self._enforce_budget(exclude=name)
+        return ms
+
+    def reload(self, name: str) -> float:
+        """collection 在驻留管理之外被 release 时（其他进程、手动操作），丢弃缓存的加载状态并重新加载"""
+        with self._lock:
+            self._entry(name)["loaded"] = False
+        logger.warning(f"Collection {name} 未加载，重新加载")
+        return self.ensure_loaded(name)
+
+    @staticmethod
+    def is_not_loaded_error(e: Exception) -> bool:
+        """Milvus 对未加载的 collection 检索时返回 code 101 / collection not loaded"""
+        return getattr(e, "code", None) == 101 or "not loaded" in str(e).lower()
+
+    def release(self, name: str, reason: str = "manual") -> bool:
+        """release 一个 collection；正在检索中的 collection 不会被 release，返回是否 release 成功"""
+        with self._name_lock(name):
+            with self._lock:
+                entry = self._entry(name)
+                if not entry["loaded"] or entry["inflight"] > 0:
+                    return False
+                entry["loaded"] = False
+                entry["releases"] += 1
+            try:
+                self.client.release_collection(name)
+            except Exception as e:
+                logger.error(f"release collection {name} 失败: {e}")
+                with self._lock:
+                    entry["loaded"] = True
+                return False
+        logger.info(f"Collection {name} 已 release（{reason}）")
+        return True
+
+    def register(self, name: str, loaded: bool = True) -> None:
+        """新建的 collection 创建后即处于加载状态"""
+        with self._lock:
+            entry = self._entry(name)
+            entry["loaded"] = loaded
+            entry["last_used"] = time.time()
+        if loaded:
+            self._enforce_budget(exclude=name)
+
+    def forget(self, name: str) -> None:
+        with self._lock:
+            self._entries.pop(name, None)
+            self._name_locks.pop(name, None)
+
+    # -- 淘汰与预加载 -----------------------------------------------------
+    def sync(self) -> None:
+        """从 Milvus 读取各 collection 当前的加载状态，并去掉已经不存在的 collection"""
+        names = [name for name in self.client.list_collections() if name.startswith(self.prefix)]
+        with self._lock:
+            for name in set(self._entries) - set(names):
+                if self._entries[name]["inflight"] == 0:
+                    del self._entries[name]
+        for name in names:
+            state = self.client.get_load_state(name).get("state")
+            loaded = getattr(state, "name", str(state)) == "Loaded"
+            memory = self._estimate(name) if loaded else None
+            with self._lock:
+                entry = self._entry(name)
+                entry["loaded"] = loaded
+                if loaded:
+                    entry["memory"] = memory
+                    entry["last_used"] = entry["last_used"] or time.time()
+
+    def release_idle(self) -> List[str]:
+        """release 空闲超过 idle_ttl 的 collection，返回被 release 的名称"""
+        if not self.idle_ttl:
+            return []
+        now = time.time()
+        with self._lock:
+            idle = [name for name, e in self._entries.items()
+                    if e["loaded"] and e["inflight"] == 0 and now - (e["last_used"] or 0) > self.idle_ttl]
+        return [name for name in idle if self.release(name, reason="idle")]
+
+    def hot_collections(self, n: int) -> List[str]:
+        """按衰减后的使用热度返回最热的 n 个 collection"""
+        now = time.time()
+        with self._lock:
+            ranked = sorted(self._entries, key=lambda name: self._hotness(self._entries[name], now), reverse=True)
+            return [name for name in ranked if self._entries[name]["hot"] > 0][:n]
+
+    def preload(self, names: List[str]) -> List[str]:
+        """加载预计很快会用到的 collection（不超过内存预算），返回实际加载的名称"""
+        loaded = []
+        for name in names:
+            with self._lock:
+                entry = self._entry(name)
+                if entry["loaded"]:
+                    continue
+                # 刷新使用时间，否则预加载的 collection 会在下一轮被当作空闲 collection release
+                entry["last_used"] = time.time()
+            if self.memory_budget and self.resident_memory() + (self._estimate(name) or 0) > self.memory_budget:
+                continue
+            try:
+                self.ensure_loaded(name)
+                loaded.append(name)
+            except Exception as e:
+                logger.error(f"预加载 collection {name} 失败: {e}")
+        return loaded
+
+    def resident_memory(self) -> int:
+        with self._lock:
+            return sum(e["memory"] or 0 for e in self._entries.values() if e["loaded"])
+
+    def _enforce_budget(self, exclude: Optional[str] = None) -> None:
+        if not self.memory_budget:
+            return
+        while self.resident_memory() > self.memory_budget:
+            with self._lock:
+                victims = sorted(
+                    (name for name, e in self._entries.items()
+                     if e["loaded"] and e["inflight"] == 0 and name != exclude),
+                    key=lambda name: self._entries[name]["last_used"] or 0)
+            if not any(self.release(name, reason="memory budget") for name in victims[:1]):
+                break
+
+    # -- 后台任务 ---------------------------------------------------------
+    def start(self) -> None:
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name="collection-residency", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def _loop(self) -> None:
+        try:
+            self.sync()
+        except Exception as e:
+            logger.error(f"读取 collection 加载状态失败: {e}")
+        while not self._stop.is_set():
+            try:
+                self.release_idle()
+                if self.preload_n:
+                    self.preload(self.hot_collections(self.preload_n))
+                self._save_state()
+            except Exception as e:
+                logger.error(f"collection 驻留管理任务出错: {e}")
+            if self._stop.wait(self.interval):
+                break
+
+    # -- 统计 -------------------------------------------------------------
+    def stats(self) -> Dict[str, Any]:
+        now = time.time()
+        with self._lock:
+            collections = {
+                name: {
+                    "loaded": e["loaded"],
+                    "inflight": e["inflight"],
+                    "idle_seconds": round(now - e["last_used"], 1) if e["last_used"] else None,
+                    "uses": e["uses"],
+                    "hotness": round(self._hotness(e, now), 3),
+                    "memory": e["memory"],
+                    "loads": e["loads"],
+                    "releases": e["releases"],
+                    "last_load_ms": e["last_load_ms"],
+                }
+                for name, e in self._entries.items()
+            }
+        return {
+            "resident": sorted(name for name, c in collections.items() if c["loaded"]),
+            "resident_memory": sum(c["memory"] or 0 for c in collections.values() if c["loaded"]),
+            "memory_budget": self.memory_budget,
+            "idle_ttl": self.idle_ttl,
+            "load_ms": latency_metrics.summary().get("collection_load"),
+            "collections": collections,
+        }
+
+    # -- 内部工具 ---------------------------------------------------------
+    def _entry(self, name: str) -> Dict[str, Any]:
+        """调用方需持有 self._lock"""
+        if name not in self._entries:
+            self._entries[name] = {
+                "loaded": False, "inflight": 0, "last_used": None, "uses": 0, "hot": 0.0, "hot_ts": 0.0,
+                "memory": None, "loads": 0, "releases": 0, "loaded_at": None, "last_load_ms": None,
+            }
+        return self._entries[name]
+
+    def _name_lock(self, name: str) -> threading.Lock:
+        with self._lock:
+            return self._name_locks.setdefault(name, threading.Lock())
+
+    def _hotness(self, entry: Dict[str, Any], now: float) -> float:
+        return entry["hot"] * 0.5 ** ((now - entry["hot_ts"]) / self.half_life)
+
+    def _estimate(self, name: str) -> Optional[int]:
+        try:
+            return self.estimate_memory(name)
+        except Exception as e:
+            logger.error(f"估算 collection {name} 内存失败: {e}")
+            return None
+
+    def _load_state(self) -> None:
+        if not (self.state_path and os.path.exists(self.state_path)):
+            return
+        try:
+            with open(self.state_path, "r", encoding="utf-8") as f:
+                state = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            logger.error(f"读取 collection 热度失败: {e}")
+            return
+        for name, item in state.items():
+            self._entry(name).update(hot=item.get("hot", 0.0), hot_ts=item.get("hot_ts", 0.0))
+
+    def _save_state(self) -> None:
+        if not self.state_path:
+            return
+        with self._lock:
+            state = {name: {"hot": e["hot"], "hot_ts": e["hot_ts"]} for name, e in self._entries.items() if e["hot"]}
+        os.makedirs(os.path.dirname(self.state_path), exist_ok=True)
+        tmp = self.state_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(state, f)
+        os.replace(tmp, self.state_path)
+
+
+def shared_residency(state_path: str, factory: Callable[[], CollectionResidency]) -> CollectionResidency:
+    """
+    同一进程内每个状态文件只创建并启动一个驻留管理器：多个管理器各自记录 inflight，
+    会 release 其他管理器正在检索的 collection，并互相覆盖状态文件
+    """
+    key = os.path.abspath(state_path)
+    with _shared_lock:
+        if key not in _shared:
+            _shared[key] = factory()
+            _shared[key].start()
+        return _shared[key]
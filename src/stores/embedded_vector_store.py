@@ -0,0 +1,519 @@
+"""
+进程内向量存储：Milvus 的轻量替代，适合中小规模知识库与无 Docker 的本地调试
+
+- 每个 collection 一个目录：vectors.f16（float16 内存映射）+ rows.db（主键与字段）+ meta.json
+- 默认精确检索；行数超过 ann_threshold 后自动构建 IVF 索引做近似检索
+- 接口与 KnowledgeBase 使用到的 MilvusClient 方法保持一致
+- 同一目录可被多个客户端（多个 KnowledgeBase 实例或多个进程）同时打开：写操作持有目录下 .lock 的独占文件锁，
+  每次读写前按 meta.json 中的 version 同步行状态与容量，不会读到过期的 size 或覆盖其他客户端写入的行
+"""
+import os
+import re
+import ast
+import json
+import shutil
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows 没有 fcntl，此时只保证同一客户端内的一致性
+    fcntl = None
+
+from src.utils.logger import LogManager
+
+logger = LogManager()
+
+_COND_RE = re.compile(r"^\s*(\w+)\s*(==|!=|\s+in\s+)\s*(.+?)\s*$", re.I)
+
+
+class Hit:
+    """与 pymilvus 检索结果相同的访问方式：hit.id / hit.distance / hit.entity，也支持 hit['id']"""
+    __slots__ = ("id", "distance", "entity")
+
+    def __init__(self, id: int, distance: float, entity: Dict[str, Any]) -> None:
+        self.id = id
+        self.distance = distance
+        self.entity = entity
+
+    def __getitem__(self, key: str) -> Any:
+        return getattr(self, key)
+
+    def get(self, key: str, default: Any = None) -> Any:
+        return getattr(self, key, default)
+
+    def __repr__(self) -> str:
+        return f"Hit(id={self.id}, distance={self.distance:.4f}, entity={self.entity})"
+
+
+def parse_filter(expr: str):
+    """
+    解析 Milvus 风格的简单过滤表达式，返回 (sql, params)：
+    支持 field == value / field != value / field in [..]，多个条件用 and 连接
+    """
+    if not expr or not expr.strip():
+        return "", []
+
+    clauses, params = [], []
+    for part in re.split(r"\s+and\s+", expr.strip(), flags=re.I):
+        m = _COND_RE.match(part)
+        if not m:
+            raise ValueError(f"不支持的过滤表达式: {part}")
+        field, op, raw = m.group(1), m.group(2).strip().lower(), m.group(3)
+        column = "id" if field == "id" else f"json_extract(data, '$.{field}')"
+        value = ast.literal_eval(raw)
+        if op == "in":
+            values = list(value)
+            clauses.append(f"{column} IN ({', '.join('?' * len(values))})" if values else "0")
+            params.extend(values)
+        else:
+            clauses.append(f"{column} {'=' if op == '==' else '!='} ?")
+            params.append(value)
+    return " AND ".join(clauses), params
+
+
+class _IVFIndex:
+    """倒排文件索引：k-means 聚类中心 + 每个簇的行号列表，检索时只扫描最近的 nprobe 个簇"""
+
+    def __init__(self, nlist: int, nprobe: int, metric: str) -> None:
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.metric = metric
+        self.centroids: Optional[np.ndarray] = None
+        self.lists: List[np.ndarray] = []
+
+    def _scores(self, vecs: np.ndarray, queries: np.ndarray) -> np.ndarray:
+        """分数越大越相近"""
+        if self.metric == "L2":
+            return -(np.sum(queries ** 2, axis=1)[:, None] - 2 * queries @ vecs.T + np.sum(vecs ** 2, axis=1)[None, :])
+        return queries @ vecs.T
+
+    def build(self, vecs: np.ndarray, rows: np.ndarray, iters: int = 10, seed: int = 0) -> None:
+        rng = np.random.default_rng(seed)
+        nlist = min(self.nlist, len(rows))
+        sample = vecs[rng.choice(len(rows), size=min(len(rows), nlist * 256), replace=False)]
+        centroids = sample[rng.choice(len(sample), size=nlist, replace=False)].copy()
+        for _ in range(iters):
+            assign = np.argmax(self._scores(centroids, sample), axis=1)
+            for c in range(nlist):
+                members = sample[assign == c]
+                if len(members):
+                    centroids[c] = members.mean(axis=0)
+            if self.metric == "COSINE":
+                centroids /= np.linalg.norm(centroids, axis=1, keepdims=True) + 1e-12
+        self.centroids = centroids
+        self.lists = [np.empty(0, dtype=np.int64) for _ in range(nlist)]
+        self.add(vecs, rows)
+
+    def add(self, vecs: np.ndarray, rows: np.ndarray) -> None:
+        assign = np.argmax(self._scores(self.centroids, vecs), axis=1)
+        for c in np.unique(assign):
+            self.lists[c] = np.concatenate([self.lists[c], rows[assign == c]])
+
+    def candidates(self, query: np.ndarray) -> np.ndarray:
+        scores = self._scores(self.centroids, query[None, :])[0]
+        probe = np.argsort(-scores)[:self.nprobe]
+        return np.concatenate([self.lists[c] for c in probe])
+
+
+class EmbeddedCollection:
+    _GROW = 1024
+
+    def __init__(self, path: str, dimension: Optional[int] = None, metric_type: str = "COSINE",
+                 ann_threshold: int = 50000, nprobe: int = 16) -> None:
+        self.path = path
+        self.ann_threshold = ann_threshold
+        self.nprobe = nprobe
+        self._lock = threading.RLock()
+        self._meta_path = os.path.join(path, "meta.json")
+        os.makedirs(path, exist_ok=True)
+        self._lock_file = open(os.path.join(path, ".lock"), "a+")
+        self._db = sqlite3.connect(os.path.join(path, "rows.db"), check_same_thread=False)
+        self.lock_inode = os.fstat(self._lock_file.fileno()).st_ino
+
+        self.meta: Optional[Dict[str, Any]] = None
+        self._meta_stamp = None
+        self.vectors: Optional[np.memmap] = None
+        self.alive = np.zeros(0, dtype=bool)
+        self.row_ids = np.zeros(0, dtype=np.int64)
+        self._ivf: Optional[_IVFIndex] = None
+        self._ivf_size = 0
+        with self._lock, self._file_lock(exclusive=True):
+            self._db.execute("CREATE TABLE IF NOT EXISTS rows (id INTEGER PRIMARY KEY, row INTEGER, data TEXT)")
+            self._db.commit()
+            if not os.path.exists(self._meta_path):
+                self.meta = {"dimension": dimension, "metric_type": metric_type.upper(),
+                             "size": 0, "capacity": 0, "version": 0}
+                self._save_meta()
+            self._refresh()
+
+    @property
+    def dimension(self) -> int:
+        return self.meta["dimension"]
+
+    @property
+    def metric(self) -> str:
+        return self.meta["metric_type"]
+
+    @contextmanager
+    def _file_lock(self, exclusive: bool = False) -> Iterator[None]:
+        """跨客户端 / 跨进程的目录锁：写操作独占，读操作共享；调用方需先持有 self._lock，且不能嵌套"""
+        if fcntl is None:
+            yield
+            return
+        fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        try:
+            yield
+        finally:
+            fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_UN)
+
+    def _save_meta(self) -> None:
+        """写入后 version 加一，其他客户端据此重新同步；先写临时文件再替换，读方不会读到半个文件"""
+        self.meta["version"] = self.meta.get("version", 0) + 1
+        tmp = self._meta_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.meta, f)
+        os.replace(tmp, self._meta_path)
+        self._meta_stamp = self._stamp()
+
+    def _stamp(self):
+        st = os.stat(self._meta_path)
+        return st.st_ino, st.st_mtime_ns, st.st_size
+
+    def _refresh(self) -> None:
+        """
+        同步其他客户端的写入（调用方需持有文件锁）：meta.json 未变化时只有一次 stat；
+        version 变化时重新读取行状态，容量变化时重新映射向量文件，新追加的行并入已有的 IVF 索引
+        """
+        stamp = self._stamp()
+        if stamp == self._meta_stamp:
+            return
+        with open(self._meta_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        old = self.meta
+        self.meta, self._meta_stamp = meta, stamp
+        if old is not None and old.get("version") == meta.get("version") and self.vectors is not None:
+            return
+
+        if old is None or old["capacity"] != meta["capacity"] or self.vectors is None:
+            if self.vectors is not None:
+                del self.vectors
+                self.vectors = None
+            self._open_vectors()
+        self.alive = np.zeros(meta["capacity"], dtype=bool)
+        self.row_ids = np.zeros(meta["capacity"], dtype=np.int64)
+        for pk, row in self._db.execute("SELECT id, row FROM rows"):
+            self.alive[row] = True
+            self.row_ids[row] = pk
+        if self._ivf is not None and old is not None and meta["size"] > old["size"]:
+            rows = np.arange(old["size"], meta["size"])
+            rows = rows[self.alive[rows]]
+            if len(rows):
+                self._ivf.add(self._prepare(self.vectors[rows].astype(np.float32)), rows)
+
+    def _open_vectors(self) -> None:
+        if self.meta["capacity"]:
+            self.vectors = np.memmap(os.path.join(self.path, "vectors.f16"), dtype=np.float16, mode="r+",
+                                     shape=(self.meta["capacity"], self.dimension))
+
+    def _reserve(self, n: int) -> None:
+        need = self.meta["size"] + n
+        if need <= self.meta["capacity"]:
+            return
+        capacity = max(need, self.meta["capacity"] * 2, self._GROW)
+        if self.vectors is not None:
+            self.vectors.flush()
+            del self.vectors
+            self.vectors = None
+        with open(os.path.join(self.path, "vectors.f16"), "ab") as f:
+            f.truncate(capacity * self.dimension * 2)
+        self.alive = np.concatenate([self.alive, np.zeros(capacity - len(self.alive), dtype=bool)])
+        self.row_ids = np.concatenate([self.row_ids, np.zeros(capacity - len(self.row_ids), dtype=np.int64)])
+        self.meta["capacity"] = capacity
+        self._open_vectors()
+
+    def _prepare(self, vecs: np.ndarray) -> np.ndarray:
+        vecs = np.asarray(vecs, dtype=np.float32)
+        if self.metric == "COSINE":
+            vecs = vecs / (np.linalg.norm(vecs, axis=1, keepdims=True) + 1e-12)
+        return vecs
+
+    def row_count(self) -> int:
+        with self._lock, self._file_lock():
+            self._refresh()
+            return int(self.alive.sum())
+
+    def insert(self, data: List[Dict[str, Any]]) -> Dict[str, Any]:
+        if not data:
+            return {"insert_count": 0, "ids": []}
+        vecs = self._prepare([d["vector"] for d in data])
+        if vecs.shape[1] != self.dimension:
+            raise ValueError(f"向量维度 {vecs.shape[1]} 与集合维度 {self.dimension} 不一致")
+
+        with self._lock, self._file_lock(exclusive=True):
+            self._refresh()
+            ids = [int(d["id"]) for d in data]
+            self._delete_ids(ids)  # 与 Milvus upsert 语义一致，重复主键以新数据为准
+            self._reserve(len(data))
+            start = self.meta["size"]
+            rows = np.arange(start, start + len(data))
+            self.vectors[start:start + len(data)] = vecs.astype(np.float16)
+            self.vectors.flush()
+            self.alive[rows] = True
+            self.row_ids[rows] = ids
+            self._db.executemany(
+                "INSERT OR REPLACE INTO rows (id, row, data) VALUES (?, ?, ?)",
+                [(pk, int(row), json.dumps({k: v for k, v in d.items() if k not in ("id", "vector")},
+                                           ensure_ascii=False, default=str))
+                 for pk, row, d in zip(ids, rows, data)])
+            self._db.commit()
+            self.meta["size"] = start + len(data)
+            self._save_meta()
+            if self._ivf is not None:
+                self._ivf.add(vecs, rows)
+        return {"insert_count": len(ids), "ids": ids}
+
+    def _delete_ids(self, ids: List[int]) -> int:
+        if not ids:
+            return 0
+        marks = ", ".join("?" * len(ids))
+        rows = [r for (r,) in self._db.execute(f"SELECT row FROM rows WHERE id IN ({marks})", ids)]
+        self.alive[rows] = False
+        self._db.execute(f"DELETE FROM rows WHERE id IN ({marks})", ids)
+        self._db.commit()
+        return len(rows)
+
+    def delete(self, ids: Optional[List[int]] = None, filter: str = "") -> Dict[str, Any]:
+        with self._lock, self._file_lock(exclusive=True):
+            self._refresh()
+            if ids is None:
+                where, params = parse_filter(filter)
+                ids = [pk for (pk,) in self._db.execute(f"SELECT id FROM rows WHERE {where or '1'}", params)]
+            count = self._delete_ids([int(i) for i in ids])
+            if count:
+                self._save_meta()
+            return {"delete_count": count}
+
+    def query(self, filter: str = "", output_fields: Optional[List[str]] = None,
+              limit: Optional[int] = None, offset: int = 0, ids: Optional[List[int]] = None,
+              after_id: Optional[int] = None) -> List[Dict[str, Any]]:
+        """after_id 不为空时按主键顺序返回主键大于 after_id 的行（query_iterator 按主键翻页）"""
+        where, params = parse_filter(filter)
+        if ids is not None:
+            id_clause = f"id IN ({', '.join('?' * len(ids))})" if ids else "0"
+            where = f"{where} AND {id_clause}" if where else id_clause
+            params = params + list(ids)
+        if after_id is not None:
+            where = f"{where} AND id > ?" if where else "id > ?"
+            params = params + [int(after_id)]
+        sql = f"SELECT id, row, data FROM rows WHERE {where or '1'} ORDER BY {'id' if after_id is not None else 'row'}"
+        if limit is not None:
+            sql += f" LIMIT {int(limit)} OFFSET {int(offset)}"
+        with self._lock, self._file_lock():
+            self._refresh()
+            rows = self._db.execute(sql, params).fetchall()
+            return [{"id": pk, **self._project(json.loads(data), output_fields, row)} for pk, row, data in rows]
+
+    def _project(self, data: Dict[str, Any], output_fields: Optional[List[str]], row: int) -> Dict[str, Any]:
+        """按 output_fields 取字段；vector 不在 JSON 中，要求返回时从 memmap 读取"""
+        if not output_fields or "*" in output_fields:
+            return data
+        out = {k: data.get(k) for k in output_fields if k not in ("id", "vector")}
+        if "vector" in output_fields:
+            out["vector"] = self.vectors[row].astype(np.float32).tolist()
+        return out
+
+    def _maybe_build_ivf(self, n_alive: int) -> None:
+        if n_alive < self.ann_threshold:
+            self._ivf = None
+            return
+        if self._ivf is not None and n_alive < self._ivf_size * 2:
+            return
+        rows = np.nonzero(self.alive[:self.meta["size"]])[0]
+        nlist = int(4 * np.sqrt(len(rows)))
+        logger.info(f"向量集合 {os.path.basename(self.path)} 构建 IVF 索引: rows={len(rows)}, nlist={nlist}")
+        ivf = _IVFIndex(nlist, self.nprobe, self.metric)
+        ivf.build(self.vectors[rows].astype(np.float32), rows)
+        self._ivf, self._ivf_size = ivf, len(rows)
+
+    def _score(self, vecs: np.ndarray, query: np.ndarray) -> np.ndarray:
+        """返回 Milvus 语义下的 distance：COSINE/IP 为相似度（越大越近），L2 为平方欧氏距离（越小越近）"""
+        if self.metric == "L2":
+            return np.sum((vecs - query) ** 2, axis=1)
+        return vecs @ query
+
+    def search(self, data: List[Any], limit: int = 10, output_fields: Optional[List[str]] = None,
+               filter: str = "") -> List[List[Hit]]:
+        queries = self._prepare(data)
+        with self._lock, self._file_lock():
+            self._refresh()
+            size = self.meta["size"]
+            if size == 0:
+                return [[] for _ in range(len(queries))]
+            mask = self.alive[:size].copy()
+            if filter:
+                where, params = parse_filter(filter)
+                allowed = np.zeros(size, dtype=bool)
+                allowed[[r for (r,) in self._db.execute(f"SELECT row FROM rows WHERE {where}", params)]] = True
+                mask &= allowed
+            self._maybe_build_ivf(int(self.alive.sum()))
+
+            ascending = self.metric == "L2"
+            out = []
+            for q in queries:
+                if self._ivf is not None:
+                    cand = self._ivf.candidates(q)
+                    cand = cand[mask[cand]]
+                    if len(cand) < limit:  # 过滤条件太严时退回精确检索
+                        cand = np.nonzero(mask)[0]
+                else:
+                    cand = np.nonzero(mask)[0]
+                if len(cand) == 0:
+                    out.append([])
+                    continue
+                scores = self._score(self.vectors[cand].astype(np.float32), q)
+                k = min(limit, len(cand))
+                top = np.argpartition(scores if ascending else -scores, k - 1)[:k]
+                top = top[np.argsort(scores[top] if ascending else -scores[top])]
+                out.append([(int(self.row_ids[cand[i]]), float(scores[i]), int(cand[i])) for i in top])
+
+            pks = {pk for hits in out for pk, _, _ in hits}
+            payload = {}
+            if pks:
+                marks = ", ".join("?" * len(pks))
+                payload = {pk: json.loads(d) for pk, d in
+                           self._db.execute(f"SELECT id, data FROM rows WHERE id IN ({marks})", list(pks))}
+            return [[Hit(pk, dist, self._project(payload[pk], output_fields, row)) for pk, dist, row in hits]
+                    for hits in out]
+
+    def close(self) -> None:
+        with self._lock:
+            if self.vectors is not None:
+                self.vectors.flush()
+            self._db.close()
+            self._lock_file.close()
+
+
+class EmbeddedQueryIterator:
+    """与 pymilvus QueryIterator 相同的用法：反复调用 next() 直到返回空列表，按主键顺序翻页"""
+
+    def __init__(self, collection: EmbeddedCollection, batch_size: int, filter: str,
+                 output_fields: Optional[List[str]]) -> None:
+        self.collection = collection
+        self.batch_size = batch_size
+        self.filter = filter
+        self.output_fields = output_fields
+        self._last_id: Optional[int] = None
+        self._done = False
+
+    def next(self) -> List[Dict[str, Any]]:
+        if self._done:
+            return []
+        page = self.collection.query(self.filter, self.output_fields, limit=self.batch_size,
+                                     after_id=self._last_id if self._last_id is not None else -2 ** 63)
+        if len(page) < self.batch_size:
+            self._done = True
+        if page:
+            self._last_id = page[-1]["id"]
+        return page
+
+    def close(self) -> None:
+        self._done = True
+
+
+class EmbeddedVectorClient:
+    """
+    与 MilvusClient 接口一致的进程内向量库，通过 config.vector_backend = "embedded" 启用
+    """
+
+    def __init__(self, root: str, metric_type: str = "COSINE", ann_threshold: int = 50000, nprobe: int = 16) -> None:
+        self.root = root
+        self.metric_type = metric_type
+        self.ann_threshold = ann_threshold
+        self.nprobe = nprobe
+        os.makedirs(root, exist_ok=True)
+        self._collections: Dict[str, EmbeddedCollection] = {}
+        self._lock = threading.Lock()
+        logger.info(f"使用进程内向量库: {root}")
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.root, name)
+
+    def _get(self, name: str) -> EmbeddedCollection:
+        """每次都检查目录：其他客户端删除或重建了同名 collection 时丢弃缓存的句柄"""
+        with self._lock:
+            coll = self._collections.get(name)
+            if not self.has_collection(name):
+                if coll is not None:
+                    self._collections.pop(name).close()
+                raise ValueError(f"collection {name} 不存在")
+            try:
+                inode = os.stat(os.path.join(self._path(name), ".lock")).st_ino
+            except FileNotFoundError:
+                inode = None
+            if coll is not None and coll.lock_inode != inode:
+                self._collections.pop(name).close()
+                coll = None
+            if coll is None:
+                coll = self._collections[name] = EmbeddedCollection(
+                    self._path(name), ann_threshold=self.ann_threshold, nprobe=self.nprobe)
+            return coll
+
+    def list_collections(self) -> List[str]:
+        return sorted(d for d in os.listdir(self.root) if os.path.exists(os.path.join(self.root, d, "meta.json")))
+
+    def has_collection(self, collection_name: str) -> bool:
+        return os.path.exists(os.path.join(self._path(collection_name), "meta.json"))
+
+    def create_collection(self, collection_name: str, dimension: int, metric_type: Optional[str] = None,
+                          **kwargs) -> None:
+        if self.has_collection(collection_name):
+            raise ValueError(f"collection {collection_name} 已存在")
+        with self._lock:
+            self._collections[collection_name] = EmbeddedCollection(
+                self._path(collection_name), dimension, metric_type or self.metric_type,
+                ann_threshold=self.ann_threshold, nprobe=self.nprobe)
+
+    def drop_collection(self, collection_name: str) -> None:
+        with self._lock:
+            coll = self._collections.pop(collection_name, None)
+            if coll is not None:
+                coll.close()
+        shutil.rmtree(self._path(collection_name), ignore_errors=True)
+
+    def describe_collection(self, collection_name: str) -> Dict[str, Any]:
+        coll = self._get(collection_name)
+        return {
+            "collection_name": collection_name,
+            "dimension": coll.dimension,
+            "metric_type": coll.metric,
+            "index_type": "IVF_FLAT" if coll._ivf is not None else "FLAT",
+            "backend": "embedded",
+        }
+
+    def get_collection_stats(self, collection_name: str) -> Dict[str, Any]:
+        return {"row_count": self._get(collection_name).row_count()}
+
+    def insert(self, collection_name: str, data: List[Dict[str, Any]], **kwargs) -> Dict[str, Any]:
+        return self._get(collection_name).insert(data)
+
+    def delete(self, collection_name: str, ids: Optional[List[int]] = None, filter: str = "",
+               **kwargs) -> Dict[str, Any]:
+        return self._get(collection_name).delete(ids=ids, filter=filter)
+
+    def query(self, collection_name: str, filter: str = "", output_fields: Optional[List[str]] = None,
+              limit: Optional[int] = None, offset: int = 0, ids: Optional[List[int]] = None,
+              **kwargs) -> List[Dict[str, Any]]:
+        return self._get(collection_name).query(filter, output_fields, limit, offset, ids)
+
+    def query_iterator(self, collection_name: str, batch_size: int = 1000, filter: str = "",
+                       output_fields: Optional[List[str]] = None, **kwargs) -> EmbeddedQueryIterator:
+        return EmbeddedQueryIterator(self._get(collection_name), batch_size, filter, output_fields)
+
+    def search(self, collection_name: str, data: List[Any], limit: int = 10, output_fields: Optional[List[str]] = None,
+               filter: str = "", **kwargs) -> List[List[Hit]]:
+        return self._get(collection_name).search(data, limit, output_fields, filter)
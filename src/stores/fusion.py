@@ -0,0 +1,40 @@
+"""
+检索结果的分数融合：多路命中列表的倒数排名融合（RRF），以及不同来源分数的 min-max 归一化
+"""
+from typing import Any, Dict, List, Optional
+
+from src.stores.vector_index import higher_is_closer
+
+
+def minmax(values: List[Optional[float]]) -> List[float]:
+    """min-max 归一化到 [0, 1]，None 记为 0；所有已知值相同时都记为 1"""
+    known = [v for v in values if v is not None]
+    if not known:
+        return [0.0] * len(values)
+    lo, hi = min(known), max(known)
+    return [((v - lo) / (hi - lo) if hi > lo else 1.0) if v is not None else 0.0 for v in values]
+
+
+def reciprocal_rank_fusion(
+    ranked_lists: List[List[Dict[str, Any]]],
+    k: int = 60,
+    weights: Optional[List[float]] = None,
+    metric_type: str = "COSINE"
+) -> List[Dict[str, Any]]:
+    """
+    倒数排名融合：score(d) = Σ w_i / (k + rank_i(d))，按 id 去重，结果写入 rrf_score 并按其降序返回。
+    weights 缺省时各列表权重均为 1；BM25 命中没有 distance，同一 id 保留向量结果中按 metric_type 最近的 distance
+    （COSINE / IP 取最大值，L2 取最小值）。
+    """
+    weights = weights or [1.0] * len(ranked_lists)
+    best = max if higher_is_closer(metric_type) else min
+    fused: Dict[Any, Dict[str, Any]] = {}
+    for ranked, w in zip(ranked_lists, weights):
+        for rank, r in enumerate(ranked, start=1):
+            item = fused.setdefault(r['id'], {**r, 'rrf_score': 0.0})
+            item['rrf_score'] += w / (k + rank)
+            for key, value in r.items():
+                item.setdefault(key, value)
+            if r.get('distance') is not None:
+                item['distance'] = r['distance'] if item.get('distance') is None else best(item['distance'], r['distance'])
+    return sorted(fused.values(), key=lambda x: x['rrf_score'], reverse=True)
@@ -6,7 +6,7 @@ from contextlib import contextmanager
 from sqlalchemy.orm.attributes import instance_state
 
 from configs.settings import *
-from src.models.kb_models import Base, KnowledgeDatabase, KnowledgeFile, KnowledgeNode
+from src.models.kb_models import Base, KnowledgeDatabase, KnowledgeFile, KnowledgeNode, utc_timestamp
 from src.utils.logger import LogManager
 logger=LogManager()
 class KBDBManager:
@@ -75,6 +75,11 @@ class KBDBManager:
             # 转换为字典并返回，避免后续延迟加载
             return [self._to_dict_safely(db) for db in databases]
 
+    def get_database_ids(self):
+        """只查询全部知识库的 db_id，不加载文件列表"""
+        with self.get_session() as session:
+            return [db_id for (db_id,) in session.query(KnowledgeDatabase.db_id).all()]
+
     def get_database_by_id(self, db_id):
         """根据ID获取知识库"""
         with self.get_session() as session:
@@ -149,7 +154,7 @@ class KBDBManager:
                 "path": path,
                 "type": file_type,
                 "status": status,
-                "created_at": file.created_at.timestamp() if file.created_at else None,
+                "created_at": utc_timestamp(file.created_at),
                 "nodes": []
             }
 
@@ -179,6 +184,13 @@ class KBDBManager:
             ).filter_by(database_id=db_id).all()
             return [self._to_dict_safely(file) for file in files]
 
+    def get_file_summaries(self, db_id):
+        """只查询 file_id、filename、created_at 三列（不加载知识块），用于检索时按文件类型与导入时间过滤"""
+        with self.get_session() as session:
+            rows = session.query(KnowledgeFile.file_id, KnowledgeFile.filename, KnowledgeFile.created_at) \
+                .filter_by(database_id=db_id).all()
+            return [(file_id, filename, utc_timestamp(created_at)) for file_id, filename, created_at in rows]
+
     def get_file_by_id(self, file_id):
         """根据ID获取文件"""
         with self.get_session() as session:
@@ -0,0 +1,124 @@
+import sqlite3
+import threading
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from src.utils.logger import LogManager
+
+logger = LogManager()
+
+# meta.db_ids 取该值时，由路由在全部知识库中挑选要检索的库
+AUTO_ROUTE = "auto"
+
+
+def _normalize(vecs: np.ndarray) -> np.ndarray:
+    return vecs / (np.linalg.norm(vecs, axis=-1, keepdims=True) + 1e-12)
+
+
+class CentroidRouter:
+    """
+    知识库路由：为每个知识库维护少量质心向量作为摘要，检索前据此挑选最相关的几个知识库
+
+    - 质心在导入时增量更新（在线 k-means）：前 n_centroids 条向量直接作为初始质心，
+      之后每条向量归入最近的质心，质心按累计条数做滑动平均
+    - 知识库与查询的相关度 = 查询与该库各质心余弦相似度的最大值
+    - 质心保存在 sqlite 中：centroids(db_id, idx, count, vector)；其他连接（其他进程）提交修改后，
+      PRAGMA data_version 会变化，读取前据此重新加载质心
+    """
+
+    def __init__(self, path: str, n_centroids: int = 8) -> None:
+        self.path = path
+        self.n_centroids = n_centroids
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("CREATE TABLE IF NOT EXISTS centroids "
+                         "(db_id TEXT, idx INTEGER, count INTEGER, vector BLOB, PRIMARY KEY (db_id, idx))")
+        self._db.commit()
+        # db_id -> (质心矩阵 [k, dim]，每个质心累计的向量条数 [k])
+        self._summaries: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+        self._data_version = None
+        with self._lock:
+            self._sync()
+
+    def _sync(self) -> None:
+        """其他连接提交过修改时重新加载全部质心，调用方需持有 self._lock"""
+        version = self._db.execute("PRAGMA data_version").fetchone()[0]
+        if version == self._data_version:
+            return
+        summaries = {}
+        for db_id, idx, count, blob in self._db.execute("SELECT * FROM centroids ORDER BY db_id, idx"):
+            vec = np.frombuffer(blob, dtype=np.float32)
+            centroids, counts = summaries.get(db_id, (np.empty((0, len(vec)), np.float32), np.empty(0)))
+            summaries[db_id] = (np.vstack([centroids, vec]), np.append(counts, count))
+        self._summaries, self._data_version = summaries, version
+
+    def update(self, db_id: str, vectors: List[List[float]]) -> None:
+        """把新导入的向量并入 db_id 的质心"""
+        vecs = _normalize(np.asarray(vectors, dtype=np.float32))
+        if not len(vecs):
+            return
+        with self._lock:
+            # 先取得写锁再同步，避免覆盖其他连接刚写入的质心
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                self._sync()
+                empty = (np.empty((0, vecs.shape[1]), np.float32), np.empty(0))
+                centroids, counts = self._summaries.get(db_id, empty)
+                centroids, counts = centroids.copy(), counts.astype(np.int64)
+                start = 0
+                if len(centroids) < self.n_centroids:
+                    start = self.n_centroids - len(centroids)
+                    centroids = np.vstack([centroids, vecs[:start]])
+                    counts = np.append(counts, np.ones(len(vecs[:start]), dtype=np.int64))
+                for v in vecs[start:]:
+                    i = int(np.argmax(centroids @ v))
+                    counts[i] += 1
+                    centroids[i] += (v - centroids[i]) / counts[i]
+                self._summaries[db_id] = (centroids, counts)
+                self._db.execute("DELETE FROM centroids WHERE db_id = ?", (db_id,))
+                self._db.executemany("INSERT INTO centroids VALUES (?, ?, ?, ?)", [
+                    (db_id, i, int(n), c.astype(np.float32).tobytes())
+                    for i, (c, n) in enumerate(zip(centroids, counts))
+                ])
+                self._db.commit()
+            except BaseException:
+                self._db.rollback()
+                raise
+
+    def drop(self, db_id: str) -> None:
+        with self._lock:
+            self._sync()
+            self._summaries.pop(db_id, None)
+            self._db.execute("DELETE FROM centroids WHERE db_id = ?", (db_id,))
+            self._db.commit()
+
+    def has(self, db_id: str) -> bool:
+        with self._lock:
+            self._sync()
+            return db_id in self._summaries
+
+    def scores(self, query_vector: List[float], db_ids: List[str]) -> Dict[str, Optional[float]]:
+        """查询与每个知识库的相关度；没有质心（尚未导入或未重建）的知识库为 None"""
+        q = _normalize(np.asarray(query_vector, dtype=np.float32))
+        out: Dict[str, Optional[float]] = {}
+        with self._lock:
+            self._sync()
+            for db_id in db_ids:
+                summary = self._summaries.get(db_id)
+                out[db_id] = float(np.max(_normalize(summary[0]) @ q)) if summary is not None else None
+        return out
+
+    def route(self, query_vector: List[float], db_ids: List[str], top_n: int) -> List[Tuple[str, Optional[float]]]:
+        """
+        返回最相关的 top_n 个知识库及其相关度（按相关度降序）；
+        没有质心的知识库无法判断相关度，总是保留，避免新库或旧库被漏掉
+        """
+        scores = self.scores(query_vector, db_ids)
+        known = sorted(((db_id, s) for db_id, s in scores.items() if s is not None),
+                       key=lambda x: x[1], reverse=True)
+        return known[:top_n] + [(db_id, s) for db_id, s in scores.items() if s is None]
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
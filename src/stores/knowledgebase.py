@@ -1,8 +1,11 @@
 import os
+import json
 import shutil
 import time
 import traceback
 import random
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from typing import List, Optional, Dict, Any
 
 from pymilvus import MilvusClient, MilvusException
@@ -11,8 +14,26 @@ from src import config
 from src.utils import  hashstr
 from rag.core.indexing import  chunk_file
 from src.stores.kb_db_manager import kb_db_manager
+from src.stores.lexical_index import BM25Index
+from src.stores.kb_router import CentroidRouter
+from src.stores.chunk_store import ChunkStore
+from src.stores.collection_residency import CollectionResidency, shared_residency
+from src.stores.fusion import minmax, reciprocal_rank_fusion
+from src.stores.vector_index import (
+    build_index_params, build_search_params, estimate_memory, is_quantized, rescore, mmr_select, within_threshold
+)
 from src.utils.logger import LogManager
+from src.utils.metrics import timed, count_metrics
 logger= LogManager()
+
+
+def file_filter_expr(file_ids: Optional[set]) -> str:
+    """file_id 集合转成 Milvus 过滤表达式；空集合用一个不存在的 file_id，保证结果为空"""
+    if file_ids is None:
+        return ""
+    return f"file_id in {json.dumps(sorted(file_ids) or [''], ensure_ascii=False)}"
+
+
 # 知识库管理
 class KnowledgeBase:
     """
@@ -37,15 +58,48 @@ class KnowledgeBase:
         self.db_manager = kb_db_manager
 
         # 检索参数
+        # 向量命中的阈值，按 metric_type 解释：COSINE / IP 为最低相似度，L2 为最大距离
         self.default_distance_threshold = config.get("default_distance_threshold", 0.5)
         self.default_rerank_threshold = config.get("default_rerank_threshold", 0.1)
         self.default_max_query_count = config.get("default_max_query_count", 20)
         self.top_k = config.get("default_top_k", 10)
+        self.default_output_fields = ['text', 'file_id']
+        # 混合检索：BM25 与向量命中按加权 RRF 融合
+        self.enable_hybrid_search = config.get("enable_hybrid_search", False)
+        self.hybrid_vector_weight = config.get("hybrid_vector_weight", 1.0)
+        self.hybrid_bm25_weight = config.get("hybrid_bm25_weight", 1.0)
+        self.lexical_dir = os.path.join(os.path.dirname(self.db_manager.db_path), "bm25")
+        self._lexical_indexes: Dict[str, BM25Index] = {}
+        # 量化索引（IVF_SQ8 / IVF_PQ）检索时过量召回的倍数，召回后用原始向量重打分
+        self.rescore_factor = config.get("quantized_rescore_factor", 4)
+        self.index_nprobe = config.get("index_nprobe", 16)
+        # 向量相似度度量，建表、检索、重打分和一阶段分数都按它解释 distance（L2 越小越近，COSINE / IP 越大越近）
+        self.metric_type = config.get("metric_type", "COSINE").upper()
+        self._db_metadata: Dict[str, Dict[str, Any]] = {}
+        # 级联重排序：先用向量/关键词分数判断需要送入 cross-encoder 的候选数量
+        self.enable_cascade_rerank = config.get("enable_cascade_rerank", False)
+        self.cascade_min_candidates = config.get("cascade_min_candidates", 5)
+        self.cascade_gap_ratio = config.get("cascade_gap_ratio", 0.25)
+        self.cascade_lexical_weight = config.get("cascade_lexical_weight", 0.3)
+        # MMR 多样性选择：重排序之前去掉内容几乎相同的候选，只保留 mmr_top_n 个
+        self.enable_mmr = config.get("enable_mmr", False)
+        self.mmr_lambda = config.get("mmr_lambda", 0.7)
+        self.mmr_top_n = config.get("mmr_top_n", 10)
+        # 新建知识库的分块文本保存在本地（知识库目录下的 chunks.bin），Milvus 只保存向量与元数据
+        self.enable_local_text_store = config.get("enable_local_text_store", False)
+        self._chunk_stores: Dict[str, ChunkStore] = {}
+        # 跨知识库检索时并发查询各 collection 的线程池
+        self._search_pool = ThreadPoolExecutor(max_workers=config.get("kb_search_workers", 8))
+        # 知识库路由：每个库维护少量质心，跨库检索时只查询最相关的 kb_route_top_n 个库
+        self.kb_route_top_n = config.get("kb_route_top_n", 3)
+        self.kb_router = CentroidRouter(os.path.join(os.path.dirname(self.db_manager.db_path), "kb_router.db"),
+                                        n_centroids=config.get("kb_router_centroids", 8))
         self.conf=0
         # 初始化模型与服务
         self._check_migration()
         self._load_embedding_model(embedding_config)
         self._connect_milvus(milvus_uri)
+        self.residency = self._init_residency()
 
     # -- 数据迁移 -----------------------------------------------------------
     def _check_migration(self):
@@ -69,14 +123,45 @@ class KnowledgeBase:
         # conf ="local/bge-large-zh-v1.5" or embedding_config or config
         self.conf = "local/bge-large-zh-v1.5"
         self.embed_model = get_embedding_model(self.conf)
+        # 查询向量缓存默认只有内存层；embedding_cache_persist 开启磁盘层（同样最多 maxsize 条），
+        # 缓存在进程内按文件共享（见 shared_cache），多个 KnowledgeBase 实例共用同一份
+        if self.embed_model is not None and config.get("enable_embedding_cache", True):
+            from src.models.embedding import attach_query_cache
+            attach_query_cache(
+                self.embed_model,
+                model_id=config.get("embed_model", self.conf),
+                maxsize=config.get("embedding_cache_size", 4096),
+                ttl=config.get("embedding_cache_ttl", None),
+                persist_path=os.path.join(config.save_dir, "cache", "query_embedding.db")
+                if config.get("embedding_cache_persist", False) else None,
+            )
         if config.enable_reranker:
             from src.models.reranker_model import  RerankerWrapper
-            self.reranker = RerankerWrapper("siliconflow/bge-reranker-v2-m3", model_name="BAAI/bge-reranker-v2-m3")
+            self.reranker = RerankerWrapper("siliconflow/bge-reranker-v2-m3", model_name="BAAI/bge-reranker-v2-m3",
+                                            max_concurrency=config.get("rerank_concurrency", 8))
+            if config.get("enable_rerank_cache", True):
+                self.reranker.enable_score_cache(
+                    maxsize=config.get("rerank_cache_size", 20000),
+                    ttl=config.get("rerank_cache_ttl", None),
+                    persist_path=os.path.join(config.save_dir, "cache", "rerank_score.db")
+                    if config.get("rerank_cache_persist", False) else None,
+                )
         else:
             self.reranker = None
 
     # -- Milvus 连接 --------------------------------------------------------
     def _connect_milvus(self, uri: Optional[str]):
+        # 进程内向量库：不依赖 Milvus 服务，适合中小规模知识库与本地调试
+        self.vector_backend = config.get("vector_backend", "milvus")
+        if self.vector_backend == "embedded":
+            from src.stores.embedded_vector_store import EmbeddedVectorClient
+            self.client = EmbeddedVectorClient(
+                config.get("embedded_vector_dir", None) or os.path.join(config.save_dir, "vector_store"),
+                ann_threshold=config.get("embedded_ann_threshold", 50000),
+                nprobe=config.get("embedded_ann_nprobe", 16),
+            )
+            return
+
         try:
             # 优先使用函数参数 -> 再看环境变量 -> 再看 config 默认值
             target = uri or os.getenv("MILVUS_URI") or config.get("milvus_uri", "http://localhost:19530")
@@ -92,25 +177,102 @@ class KnowledgeBase:
             logger.error(f"连接 Milvus 失败: {e}")
             raise
 
+    # -- Collection 驻留管理 ----------------------------------------------
+    def _init_residency(self) -> Optional[CollectionResidency]:
+        """只在 Milvus 后端且开启 enable_collection_residency 时启用，内置向量库没有加载/释放的概念"""
+        if self.vector_backend != "milvus" or not config.get("enable_collection_residency", False):
+            return None
+        budget_mb = config.get("collection_memory_budget_mb", None)
+        state_path = os.path.join(os.path.dirname(self.db_manager.db_path), "collection_residency.json")
+        return shared_residency(state_path, lambda: CollectionResidency(
+            self.client,
+            self._estimate_collection_memory,
+            idle_ttl=config.get("collection_idle_ttl", 1800),
+            memory_budget=int(budget_mb * 2 ** 20) if budget_mb else None,
+            preload_n=config.get("collection_preload_n", 3),
+            interval=config.get("collection_residency_interval", 60),
+            state_path=state_path,
+        ))
+
+    def _estimate_collection_memory(self, db_id: str) -> int:
+        """按行数、向量维度与索引类型估算 collection 加载后占用的内存（字节）"""
+        rows = int(self.client.get_collection_stats(db_id).get("row_count", 0))
+        dim = (self.db_manager.get_database_by_id(db_id) or {}).get("dimension") or 1024
+        return estimate_memory(self._index_type(db_id) or "AUTOINDEX", rows, dim)
+
+    @contextmanager
+    def _using(self, db_id: str, latency: Optional[Dict[str, Any]] = None):
+        """访问 collection 前登记使用；开启驻留管理时，已 release 的 collection 在这里透明地重新加载"""
+        if self.residency is None:
+            yield
+            return
+        with self.residency.use(db_id) as load_ms:
+            if load_ms and latency is not None:
+                latency.setdefault("timings", {})["collection_load"] = round(load_ms, 2)
+            yield
+
+    def _search_loaded(self, db_id: str, **kwargs):
+        """collection 在驻留管理之外被 release 时，Milvus 返回未加载错误：重新加载后重试一次"""
+        try:
+            return self.client.search(db_id, **kwargs)
+        except Exception as e:
+            if self.residency is None or not CollectionResidency.is_not_loaded_error(e):
+                raise
+            self.residency.reload(db_id)
+            return self.client.search(db_id, **kwargs)
+
+    def residency_stats(self) -> Dict[str, Any]:
+        if self.residency is None:
+            return {"enabled": False}
+        return {"enabled": True, **self.residency.stats()}
+
     # -- 知识库管理 --------------------------------------------------------
-    def create_database(self, name: str, description: str, dimension: Optional[int] = None) -> Dict[str, Any]:
+    def create_database(
+        self,
+        name: str,
+        description: str,
+        dimension: Optional[int] = None,
+        index_type: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """
+        index_type: 向量索引类型，缺省为 Milvus AUTOINDEX；
+        IVF_SQ8 / IVF_PQ 为量化索引，内存约为原来的 1/4、1/32，检索时自动过量召回并用原始向量重打分
+        """
         dim = dimension or self.embed_model.get_dimension()
         db_id = f"kb_{hashstr(name)}"
+        index_type = index_type or config.get("default_index_type", None)
+        metadata = {}
+        if index_type:
+            metadata["index_type"] = index_type
+        if self.enable_local_text_store:
+            metadata["text_store"] = "local"
         info = self.db_manager.create_database(
             db_id=db_id,
             name=name,
             description=description,
             embed_model=self.conf,
-            dimension=dim
+            dimension=dim,
+            metadata=metadata or None
         )
         self._ensure_directories(db_id)
-        self.add_collection(db_id, dim)
+        self.add_collection(db_id, dim, index_type)
+        self._db_metadata[db_id] = metadata
+        if self.residency is not None:
+            self.residency.register(db_id)
         return info
 
     def delete_database(self, db_id: str) -> None:
         if self.client.has_collection(db_id):
             self.client.drop_collection(db_id)
         self.db_manager.delete_database(db_id)
+        if self.residency is not None:
+            self.residency.forget(db_id)
+        self._drop_lexical_index(db_id)
+        self.kb_router.drop(db_id)
+        store = self._chunk_stores.pop(db_id, None)
+        if store is not None:
+            store.close()
+        self._db_metadata.pop(db_id, None)
         folder = os.path.join(self.work_dir, db_id)
         if os.path.isdir(folder): shutil.rmtree(folder)
 
@@ -157,7 +319,7 @@ class KnowledgeBase:
             logger.error(f"分块失败: {e}")
             raise
 
-        chunks = [d.dict() for d in docs]
+        chunks = [{'text': d.page_content, **d.metadata, 'file_type': ext} for d in docs]
 
         # 数据库记录
         self.db_manager.add_file(
@@ -204,11 +366,131 @@ class KnowledgeBase:
         os.makedirs(upload, exist_ok=True)
         return base, upload
 
+    def delete_document(self, db_id: str, file_id: str) -> None:
+        """删除某个文件的向量、关键词索引与数据库记录"""
+        with self._using(db_id):
+            self.client.delete(collection_name=db_id, filter=f"file_id=='{file_id}'")
+        self.lexical_index(db_id).delete_file(file_id)
+        if self._local_text(db_id):
+            self.chunk_store(db_id).delete_file(file_id)
+        self.db_manager.delete_file(file_id)
+
+    # -- BM25 关键词索引 ---------------------------------------------------
+    def lexical_index(self, db_id: str) -> BM25Index:
+        """每个知识库一个 BM25 索引文件，与 knowledge.db 放在同一目录下"""
+        if db_id not in self._lexical_indexes:
+            os.makedirs(self.lexical_dir, exist_ok=True)
+            self._lexical_indexes[db_id] = BM25Index(os.path.join(self.lexical_dir, f"{db_id}.db"))
+        return self._lexical_indexes[db_id]
+
+    def _drop_lexical_index(self, db_id: str) -> None:
+        index = self._lexical_indexes.pop(db_id, None)
+        if index is not None:
+            index.close()
+        path = os.path.join(self.lexical_dir, f"{db_id}.db")
+        if os.path.exists(path):
+            os.remove(path)
+
+    def _iter_rows(self, db_id: str, output_fields: List[str], batch_size: int = 1000):
+        """
+        按批遍历 collection 的全部行：Milvus 的 offset + limit 不能超过 16384，
+        大库必须用 query_iterator 按主键翻页
+        """
+        with self._using(db_id):
+            iterator = self.client.query_iterator(db_id, batch_size=batch_size, filter="",
+                                                  output_fields=output_fields)
+            try:
+                while True:
+                    rows = iterator.next()
+                    if not rows:
+                        break
+                    yield rows
+            finally:
+                iterator.close()
+
+    def rebuild_lexical_index(self, db_id: str, batch_size: int = 1000) -> int:
+        """从已有的分块重建 BM25 索引（用于开启混合检索之前导入的知识库），返回文档数"""
+        index = self.lexical_index(db_id)
+        index.clear()
+        local_text = self._local_text(db_id)
+        fields = ['file_id'] if local_text else ['text', 'file_id']
+        total = 0
+        for rows in self._iter_rows(db_id, fields, batch_size):
+            if local_text:
+                texts = self.chunk_store(db_id).get([r['id'] for r in rows])
+                for row in rows:
+                    row['text'] = texts.get(row['id'], "")
+            by_file: Dict[str, List[Dict[str, Any]]] = {}
+            for row in rows:
+                by_file.setdefault(row.get('file_id'), []).append(row)
+            for file_id, items in by_file.items():
+                index.add([r['id'] for r in items], file_id, [r['text'] for r in items])
+            total += len(rows)
+        logger.info(f"知识库 {db_id} 的 BM25 索引已重建，共 {total} 个分块")
+        return total
+
+    # -- 知识库路由 -------------------------------------------------------
+    def rebuild_kb_router(self, db_id: str, batch_size: int = 1000) -> int:
+        """用 Milvus 中已有的向量重建某个知识库的质心（用于开启路由之前导入的知识库），返回向量数"""
+        self.kb_router.drop(db_id)
+        total = 0
+        for rows in self._iter_rows(db_id, ['vector'], batch_size):
+            self.kb_router.update(db_id, [r['vector'] for r in rows])
+            total += len(rows)
+        logger.info(f"知识库 {db_id} 的路由质心已重建，共 {total} 条向量")
+        return total
+
+    def route(
+        self,
+        query: str,
+        db_ids: Optional[List[str]] = None,
+        top_n: Optional[int] = None,
+        vectors: Optional[List[Any]] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        按质心相关度为查询挑选知识库，db_ids 缺省为全部知识库；
+        返回 [{'db_id', 'score'}]，score 为 None 表示该库还没有质心（总是保留）
+        """
+        db_ids = db_ids or self.db_manager.get_database_ids()
+        if vectors is None:
+            vectors = self.embed_model.batch_encode_queries([query])
+        picked = self.kb_router.route(vectors[0], db_ids, top_n or self.kb_route_top_n)
+        return [{'db_id': db_id, 'score': score} for db_id, score in picked]
+
     # -- Milvus Collection 操作 -------------------------------------------
-    def add_collection(self, name: str, dimension: int) -> None:
+    def add_collection(self, name: str, dimension: int, index_type: Optional[str] = None) -> None:
         if self.client.has_collection(name):
             self.client.drop_collection(name)
-        self.client.create_collection(name, dimension=dimension)
+        self.client.create_collection(name, dimension=dimension, metric_type=self.metric_type)
+        if index_type and index_type.upper() != "AUTOINDEX" and self.vector_backend == "milvus":
+            # 快速建表默认是 AUTOINDEX，替换为指定的索引类型
+            params = build_index_params(index_type, self.metric_type, dimension, nlist=config.get("index_nlist", 128))
+            index_params = self.client.prepare_index_params()
+            index_params.add_index(field_name="vector", **params)
+            self.client.release_collection(name)
+            self.client.drop_index(name, "vector")
+            self.client.create_index(name, index_params)
+            self.client.load_collection(name)
+            logger.info(f"Collection {name} 使用索引 {params}")
+
+    def _metadata(self, db_id: str) -> Dict[str, Any]:
+        if db_id not in self._db_metadata:
+            info = self.db_manager.get_database_by_id(db_id) or {}
+            self._db_metadata[db_id] = info.get("metadata") or {}
+        return self._db_metadata[db_id]
+
+    def _index_type(self, db_id: str) -> Optional[str]:
+        return self._metadata(db_id).get("index_type")
+
+    def _local_text(self, db_id: str) -> bool:
+        """分块文本是否保存在本地 ChunkStore（而不是 Milvus 的 text 字段）"""
+        return self._metadata(db_id).get("text_store") == "local"
+
+    def chunk_store(self, db_id: str) -> ChunkStore:
+        if db_id not in self._chunk_stores:
+            base, _ = self._ensure_directories(db_id)
+            self._chunk_stores[db_id] = ChunkStore(os.path.join(base, "chunks"))
+        return self._chunk_stores[db_id]
 
     def get_collection_info(self, name: str) -> Dict[str, Any]:
         try:
@@ -229,6 +511,7 @@ class KnowledgeBase:
             raise ValueError("Collection不存在")
 
         vecs = self.embed_model.batch_encode(docs)
+        local_text = self._local_text(collection_name)
         entities = []
         for idx, v in enumerate(vecs):
             meta = chunk_infos[idx]
@@ -238,7 +521,15 @@ class KnowledgeBase:
                 'vector': v,
                 **meta
             })
-        return self.client.insert(collection_name=collection_name, data=entities)
+            if local_text:
+                entities[-1].pop('text', None)
+        if local_text:
+            # 先写本地文本再写 Milvus，保证检索到的主键都能读到文本
+            self.chunk_store(collection_name).put([e['id'] for e in entities], file_id, docs)
+        res = self.client.insert(collection_name=collection_name, data=entities)
+        self.lexical_index(collection_name).add([e['id'] for e in entities], file_id, docs)
+        self.kb_router.update(collection_name, vecs)
+        return res
 
     # -- 检索 --------------------------------------------------------------
     def search(
@@ -247,32 +538,536 @@ class KnowledgeBase:
         db_id: str,
         distance_threshold: Optional[float] = None,
         rerank: bool = True,
-        top_k: Optional[int] = None
+        top_k: Optional[int] = None,
+        max_query_count: Optional[int] = None,
+        rerank_top_n: Optional[int] = None,
+        hybrid: Optional[bool] = None,
+        filters: Optional[Dict[str, Any]] = None,
+        output_fields: Optional[List[str]] = None,
+        mmr: Optional[bool] = None
     ) -> Dict[str, List[Dict[str, Any]]]:
+        """
+        向量检索 + 可选重排序
+        - max_query_count: 覆盖 Milvus 返回的候选数量
+        - rerank_top_n: 只对向量排序前 n 个候选做重排序（时延预算紧张时使用）
+        - hybrid: 是否与 BM25 命中融合，缺省取 enable_hybrid_search 配置
+        - filters: 元数据过滤，见 resolve_filters
+        - output_fields: 结果 entity 中保留的字段，缺省为 text、file_id；传 [] 只返回 id 与分数
+        - mmr: 重排序之前是否做 MMR 多样性选择，缺省取 enable_mmr 配置
+        文本保存在本地 ChunkStore 的知识库只为 results 与重排序候选读取文本，all_results 中的其他候选不带 text
+        """
         dt = distance_threshold or self.default_distance_threshold
         tk = top_k or self.top_k
+        latency = {"timings": {}, "counts": {}}
+        file_ids = self.resolve_filters(db_id, filters)
+        expr = file_filter_expr(file_ids)
+        mmr = self.enable_mmr if mmr is None else mmr
+        fields = self._fetch_fields(output_fields, rerank, mmr)
 
-        vector = self.embed_model.batch_encode([query])[0]
-        hits = self.client.search(db_id, [vector], limit=self.default_max_query_count,
-                                   output_fields=['text','file_id'])[0]
-        results = [ {'entity': h.entity, 'distance': h.distance} for h in hits ]
+        results = self._vector_search(db_id, [query], latency, max_query_count, expr, fields)[0]
 
         # 阈值过滤
-        filtered = [r for r in results if r['distance'] < dt]
+        filtered = self._threshold(results, dt)
+        latency["counts"]["candidates"] = len(results)
+        latency["counts"]["after_threshold"] = len(filtered)
+
+        # 可选混合检索
+        if self._use_hybrid(hybrid):
+            bm25_hits = self._lexical_search(db_id, [query], latency, max_query_count, file_ids)[0]
+            filtered = reciprocal_rank_fusion(
+                [filtered, bm25_hits], weights=[self.hybrid_vector_weight, self.hybrid_bm25_weight],
+                metric_type=self.metric_type)
+            latency["counts"]["after_fusion"] = len(filtered)
+
+        if mmr:
+            filtered = self._diversify(filtered, latency)
+        self._drop_vectors(results + filtered)
 
         # 可选重排序
-        if rerank and self.reranker and filtered:
-            texts = [r['entity'].text for r in filtered]
-            scores = self.reranker.compute_score([query,texts], normalize=False)
-            for r,s in zip(filtered, scores): r['rerank_score']=s
-            filtered = [r for r in filtered if r.get('rerank_score',0)>self.default_rerank_threshold]
-            filtered.sort(key=lambda x: x['rerank_score'], reverse=True)
+        if rerank:
+            filtered = self._rerank(query, filtered, latency, rerank_top_n, db_id)
+
+        return {
+            'results': self._project(self._hydrate(filtered[:tk], output_fields, db_id), output_fields),
+            'all_results': self._project(results, output_fields),
+            'latency': latency
+        }
+
+    def search_multi(
+        self,
+        queries: List[str],
+        db_id: str,
+        distance_threshold: Optional[float] = None,
+        rerank: bool = True,
+        top_k: Optional[int] = None,
+        max_query_count: Optional[int] = None,
+        rerank_top_n: Optional[int] = None,
+        rrf_k: int = 60,
+        hybrid: Optional[bool] = None,
+        filters: Optional[Dict[str, Any]] = None,
+        output_fields: Optional[List[str]] = None,
+        mmr: Optional[bool] = None
+    ) -> Dict[str, List[Dict[str, Any]]]:
+        """
+        多查询检索：所有改写查询一次 batch_encode、一次多向量 Milvus 检索，
+        各自的命中列表用倒数排名融合（RRF）合并后，再用第一个查询重排序（检索流程中为改写后的查询）
+        """
+        dt = distance_threshold or self.default_distance_threshold
+        tk = top_k or self.top_k
+        latency = {"timings": {}, "counts": {}}
+        file_ids = self.resolve_filters(db_id, filters)
+        expr = file_filter_expr(file_ids)
+        mmr = self.enable_mmr if mmr is None else mmr
+        fields = self._fetch_fields(output_fields, rerank, mmr)
+
+        results_list = self._vector_search(db_id, queries, latency, max_query_count, expr, fields)
+        ranked_lists = [self._threshold(results, dt) for results in results_list]
+        weights = [self.hybrid_vector_weight] * len(ranked_lists)
+        if self._use_hybrid(hybrid):
+            bm25_lists = self._lexical_search(db_id, queries, latency, max_query_count, file_ids)
+            ranked_lists += bm25_lists
+            weights += [self.hybrid_bm25_weight] * len(bm25_lists)
+        fused = reciprocal_rank_fusion(ranked_lists, k=rrf_k, weights=weights, metric_type=self.metric_type)
+        # 与 search 一致：all_results 是未经阈值过滤的全部候选，多个查询命中同一分块时只保留第一次出现的
+        seen, all_results = set(), []
+        for results in results_list:
+            for r in results:
+                if r['id'] not in seen:
+                    seen.add(r['id'])
+                    all_results.append(r)
+        latency["counts"]["candidates"] = len(all_results)
+        latency["counts"]["after_threshold"] = len(fused)
+
+        if mmr:
+            fused = self._diversify(fused, latency)
+        self._drop_vectors(fused + all_results)
+
+        if rerank:
+            fused = self._rerank(queries[0], fused, latency, rerank_top_n, db_id)
 
         return {
-            'results': filtered[:tk],
-            'all_results': results
+            'results': self._project(self._hydrate(fused[:tk], output_fields, db_id), output_fields),
+            'all_results': self._project(all_results, output_fields),
+            'latency': latency
         }
 
+    def search_batch(
+        self,
+        queries: List[str],
+        db_id: str,
+        distance_threshold: Optional[float] = None,
+        rerank: bool = True,
+        top_k: Optional[int] = None,
+        max_query_count: Optional[int] = None,
+        filters: Optional[Dict[str, Any]] = None,
+        output_fields: Optional[List[str]] = None,
+        mmr: Optional[bool] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        批量检索：一次 batch_encode、一次多向量 Milvus 检索、跨查询批量重排序，
+        每个查询返回与 search 相同结构的结果；latency 中的计数为整批之和
+        """
+        dt = distance_threshold or self.default_distance_threshold
+        tk = top_k or self.top_k
+        latency = {"timings": {}, "counts": {}}
+        file_ids = self.resolve_filters(db_id, filters)
+        expr = file_filter_expr(file_ids)
+        mmr = self.enable_mmr if mmr is None else mmr
+        fields = self._fetch_fields(output_fields, rerank, mmr)
+
+        results_list = self._vector_search(db_id, queries, latency, max_query_count, expr, fields)
+        filtered_list = [self._threshold(results, dt) for results in results_list]
+        latency["counts"]["candidates"] = sum(len(results) for results in results_list)
+        latency["counts"]["after_threshold"] = sum(len(filtered) for filtered in filtered_list)
+        if mmr:
+            with timed(latency, "mmr"):
+                filtered_list = [self._mmr_pick(filtered) for filtered in filtered_list]
+            latency["counts"]["after_mmr"] = sum(len(filtered) for filtered in filtered_list)
+        self._drop_vectors([r for results in results_list for r in results])
+
+        if rerank and self.reranker and any(filtered_list):
+            heads, tails = [], []
+            for filtered in filtered_list:
+                ranked, n = self._cascade(filtered) if self.enable_cascade_rerank else (filtered, len(filtered))
+                heads.append(ranked[:n])
+                tails.append(ranked[n:])
+            self._hydrate([r for head in heads for r in head], None, db_id)
+            with timed(latency, "rerank"):
+                scores_list = self.reranker.run_batch(
+                    queries, [[r['entity']['text'] for r in head] for head in heads], normalize=False)
+            for i, (head, tail, scores) in enumerate(zip(heads, tails, scores_list)):
+                filtered_list[i] = self._apply_rerank_scores(head, tail, scores)
+                count_metrics.observe("rerank_pairs", len(scores))
+            latency["counts"]["reranked"] = sum(len(head) for head in heads)
+            latency["counts"]["after_rerank"] = sum(len(filtered) for filtered in filtered_list)
+
+        # 同一批次共用一份耗时统计
+        return [
+            {'results': self._project(self._hydrate(filtered[:tk], output_fields, db_id), output_fields),
+             'all_results': self._project(results, output_fields),
+             'latency': latency}
+            for filtered, results in zip(filtered_list, results_list)
+        ]
+
+    def search_many(
+        self,
+        query: str,
+        db_ids: Optional[List[str]] = None,
+        distance_threshold: Optional[float] = None,
+        rerank: bool = True,
+        top_k: Optional[int] = None,
+        max_query_count: Optional[int] = None,
+        rerank_top_n: Optional[int] = None,
+        hybrid: Optional[bool] = None,
+        filters: Optional[Dict[str, Any]] = None,
+        output_fields: Optional[List[str]] = None,
+        route_top_n: Optional[int] = None,
+        mmr: Optional[bool] = None
+    ) -> Dict[str, Any]:
+        """
+        跨多个知识库检索：
+        - 查询只编码一次，各 collection 并发检索，总耗时取决于最慢的一个
+        - 各知识库的候选分数分别归一化到 [0, 1]（norm_score）后合并，结果带上 db_id
+        - 合并后的候选统一重排序一次
+        - db_ids 缺省时在全部知识库中按质心路由，只检索最相关的 route_top_n 个（缺省 kb_route_top_n）；
+          显式传入 route_top_n 时在 db_ids 中路由，选中的库记录在 latency["routed"] 中
+        单个知识库出错不影响其他知识库，错误记录在 latency["errors"] 中
+        """
+        dt = distance_threshold or self.default_distance_threshold
+        tk = top_k or self.top_k
+        latency = {"timings": {}, "counts": {}, "collections": {}, "errors": {}}
+        mmr = self.enable_mmr if mmr is None else mmr
+        fields = self._fetch_fields(output_fields, rerank, mmr)
+
+        with timed(latency, "embedding"):
+            vectors = self.embed_model.batch_encode_queries([query])
+
+        if db_ids is None or route_top_n:
+            with timed(latency, "kb_route"):
+                latency["routed"] = self.route(query, db_ids, route_top_n, vectors=vectors)
+            db_ids = [r['db_id'] for r in latency["routed"]]
+
+        def search_one(db_id):
+            sub = {"timings": {}, "counts": {}}
+            file_ids = self.resolve_filters(db_id, filters)
+            with timed(sub, "total"):
+                results = self._vector_search(db_id, [query], sub, max_query_count,
+                                              file_filter_expr(file_ids), fields, vectors=vectors)[0]
+                filtered = self._threshold(results, dt)
+                if self._use_hybrid(hybrid):
+                    bm25_hits = self._lexical_search(db_id, [query], sub, max_query_count, file_ids)[0]
+                    filtered = reciprocal_rank_fusion(
+                        [filtered, bm25_hits], weights=[self.hybrid_vector_weight, self.hybrid_bm25_weight],
+                        metric_type=self.metric_type)
+            return results, filtered, sub
+
+        all_results, merged = [], []
+        with timed(latency, "multi_kb_search"):
+            futures = {db_id: self._search_pool.submit(search_one, db_id) for db_id in db_ids}
+            for db_id, future in futures.items():
+                try:
+                    results, filtered, sub = future.result()
+                except Exception as e:
+                    logger.error(f"知识库 {db_id} 检索失败: {e}")
+                    latency["errors"][db_id] = str(e)
+                    continue
+                latency["collections"][db_id] = sub
+                for r in results + filtered:
+                    r['db_id'] = db_id
+                all_results.extend(results)
+                merged.extend(filtered)
+
+        # 各知识库使用同一个 embedding 模型，向量分数可以直接比较：在合并后的全部候选上归一化，
+        # 而不是每个库各自归一化（否则只有一条弱命中的库也会得到 1.0）
+        for r, score in zip(merged, self._similarity_scores(merged) if merged else []):
+            r['norm_score'] = score
+        merged.sort(key=lambda r: r['norm_score'], reverse=True)
+        latency["counts"]["candidates"] = len(all_results)
+        latency["counts"]["after_threshold"] = len(merged)
+
+        # 同一文档导入到多个知识库时，MMR 也会去掉跨库的重复分块
+        if mmr:
+            merged = self._diversify(merged, latency)
+        self._drop_vectors(all_results + merged)
+
+        if rerank:
+            merged = self._rerank(query, merged, latency, rerank_top_n)
+
+        return {
+            'results': self._project(self._hydrate(merged[:tk], output_fields), output_fields),
+            'all_results': self._project(all_results, output_fields),
+            'latency': latency
+        }
+
+    def _vector_search(
+        self,
+        db_id: str,
+        queries: List[str],
+        latency: Dict[str, Any],
+        max_query_count: Optional[int] = None,
+        expr: str = "",
+        fields: Optional[List[str]] = None,
+        vectors: Optional[List[Any]] = None
+    ) -> List[List[Dict[str, Any]]]:
+        """
+        所有查询一次 batch_encode、一次多向量 Milvus 检索，返回每个查询的候选列表；
+        传入 vectors 时跳过编码（跨知识库检索时查询只编码一次）
+        """
+        limit = max_query_count or self.default_max_query_count
+        fields = self.default_output_fields if fields is None else fields
+        if self._local_text(db_id):
+            # 文本在本地 ChunkStore 中，Milvus 只返回主键、距离与其他字段，文本由 _hydrate 按需读取
+            fields = [f for f in fields if f != 'text']
+        index_type = self._index_type(db_id) if self.vector_backend == "milvus" else None
+        if vectors is None:
+            with timed(latency, "embedding"):
+                vectors = self.embed_model.batch_encode_queries(queries)
+
+        with self._using(db_id, latency):
+            if is_quantized(index_type):
+                # 量化索引的距离是近似值：多召回 rescore_factor 倍，再用原始向量重打分取前 limit 个
+                with timed(latency, "milvus_search"):
+                    hits_list = self._search_loaded(
+                        db_id, data=vectors, limit=limit * self.rescore_factor,
+                        output_fields=list(dict.fromkeys(fields + ['vector'])), filter=expr,
+                        search_params=build_search_params(index_type, self.metric_type, nprobe=self.index_nprobe))
+                with timed(latency, "rescore"):
+                    results_list = [
+                        rescore(vec, [
+                            {'id': h.id, 'entity': {f: h.entity.get(f) for f in fields},
+                             'distance': h.distance, 'vector': h.entity.get('vector')}
+                            for h in hits
+                        ], self.metric_type)[:limit]
+                        for vec, hits in zip(vectors, hits_list)
+                    ]
+                latency["counts"]["rescored"] = sum(len(hits) for hits in hits_list)
+            else:
+                with timed(latency, "milvus_search"):
+                    hits_list = self._search_loaded(
+                        db_id, data=vectors, limit=limit, output_fields=fields, filter=expr)
+                results_list = [
+                    [{'id': h.id, 'entity': {f: h.entity.get(f) for f in fields}, 'distance': h.distance}
+                     for h in hits]
+                    for hits in hits_list
+                ]
+
+        if 'vector' in fields:
+            # 向量只在检索流程内部使用（MMR），不放在 entity 中返回
+            for results in results_list:
+                for r in results:
+                    r['vector'] = r['entity'].pop('vector')
+        return results_list
+
+    def resolve_filters(self, db_id: str, filters: Optional[Dict[str, Any]]) -> Optional[set]:
+        """
+        把元数据过滤条件解析为允许的 file_id 集合，None 表示不过滤：
+        - file_ids: 只在这些文件中检索
+        - file_types: 文件类型（后缀），如 ["pdf", "md"]
+        - created_after / created_before: 文件导入时间范围（unix 时间戳）
+        文件类型与导入时间按 sqlite 中的文件记录解析，对开启过滤之前导入的数据同样有效
+        """
+        if not filters:
+            return None
+
+        file_ids = filters.get("file_ids")
+        file_ids = set([file_ids] if isinstance(file_ids, str) else file_ids) if file_ids else None
+
+        file_types = filters.get("file_types")
+        after, before = filters.get("created_after"), filters.get("created_before")
+        if file_types or after is not None or before is not None:
+            types = {t.lower().lstrip('.') for t in ([file_types] if isinstance(file_types, str) else file_types or [])}
+            # 文件类型按文件名后缀判断（与 ingest_file 记录的 file_type 一致），created_at 为 UTC 时间戳
+            matched = {
+                file_id for file_id, filename, created_at in self.db_manager.get_file_summaries(db_id)
+                if (not types or filename.split('.')[-1].lower() in types)
+                and (after is None or (created_at is not None and created_at >= after))
+                and (before is None or (created_at is not None and created_at <= before))
+            }
+            file_ids = matched if file_ids is None else file_ids & matched
+        return file_ids
+
+    def _fetch_fields(self, output_fields: Optional[List[str]], rerank: bool, mmr: bool = False) -> List[str]:
+        """向量库需要返回的字段：调用方要求的字段，重排序时再加上 text，MMR 时再加上 vector"""
+        fields = list(self.default_output_fields if output_fields is None else output_fields)
+        if rerank and self.reranker and 'text' not in fields:
+            fields.append('text')
+        if mmr and 'vector' not in fields:
+            fields.append('vector')
+        return fields
+
+    def _diversify(self, candidates: List[Dict[str, Any]], latency: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """
+        MMR 多样性选择：相关度用一阶段分数（见 _first_stage_scores），相似度用候选向量的余弦相似度，
+        保留 mmr_top_n 个候选，内容几乎相同的分块只留一个，减少送入 cross-encoder 的候选
+        """
+        if len(candidates) <= self.mmr_top_n:
+            return candidates
+        with timed(latency, "mmr"):
+            picked = self._mmr_pick(candidates)
+        latency["counts"]["after_mmr"] = len(picked)
+        return picked
+
+    def _mmr_pick(self, candidates: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        if len(candidates) <= self.mmr_top_n:
+            return candidates
+        picked = mmr_select([r.get('vector') for r in candidates], self._first_stage_scores(candidates),
+                            self.mmr_top_n, self.mmr_lambda)
+        return [candidates[i] for i in picked]
+
+    def _hydrate(
+        self,
+        candidates: List[Dict[str, Any]],
+        output_fields: Optional[List[str]] = None,
+        db_id: Optional[str] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        为缺少 text 的候选从本地 ChunkStore 读取文本（output_fields 不需要 text 时跳过）；
+        只对通过阈值、重排序等过滤后真正用到的候选调用，未用到的候选不会读取文本
+        """
+        if output_fields is not None and 'text' not in output_fields:
+            return candidates
+        missing: Dict[str, List[Dict[str, Any]]] = {}
+        for r in candidates:
+            if 'text' not in r['entity']:
+                missing.setdefault(r.get('db_id') or db_id, []).append(r)
+        for kb_id, items in missing.items():
+            if kb_id and self._local_text(kb_id):
+                texts = self.chunk_store(kb_id).get([r['id'] for r in items])
+                for r in items:
+                    r['entity']['text'] = texts.get(r['id'], "")
+        return candidates
+
+    @staticmethod
+    def _drop_vectors(results: List[Dict[str, Any]]) -> None:
+        for r in results:
+            r.pop('vector', None)
+
+    def _project(self, results: List[Dict[str, Any]], output_fields: Optional[List[str]]) -> List[Dict[str, Any]]:
+        """只保留调用方需要的字段"""
+        if output_fields is None:
+            return results
+        for r in results:
+            r['entity'] = {k: v for k, v in r['entity'].items() if k in output_fields}
+        return results
+
+    def _use_hybrid(self, hybrid: Optional[bool]) -> bool:
+        return self.enable_hybrid_search if hybrid is None else hybrid
+
+    def _lexical_search(
+        self,
+        db_id: str,
+        queries: List[str],
+        latency: Dict[str, Any],
+        limit: Optional[int] = None,
+        file_ids: Optional[set] = None
+    ) -> List[List[Dict[str, Any]]]:
+        """每个查询的 BM25 命中列表，file_ids 不为空时只检索这些文件"""
+        index = self.lexical_index(db_id)
+        with timed(latency, "bm25_search"):
+            hits_list = [index.search(q, limit or self.default_max_query_count, file_ids) for q in queries]
+        latency["counts"]["bm25_candidates"] = sum(len(hits) for hits in hits_list)
+        return hits_list
+
+    def _rerank(
+        self,
+        query: str,
+        candidates: List[Dict[str, Any]],
+        latency: Dict[str, Any],
+        top_n: Optional[int] = None,
+        db_id: Optional[str] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        重排序；指定 top_n 时只重排前 top_n 个候选，其余候选见 _apply_rerank_scores。
+        未指定 top_n 且开启级联重排序时，由 _cascade 决定重排的候选数量
+        """
+        if not (self.reranker and candidates):
+            return candidates
+
+        if not top_n and self.enable_cascade_rerank:
+            candidates, top_n = self._cascade(candidates)
+            latency["counts"]["cascade_cut"] = top_n
+
+        head, tail = (candidates[:top_n], candidates[top_n:]) if top_n else (candidates, [])
+        self._hydrate(head, None, db_id)
+        with timed(latency, "rerank"):
+            texts = [r['entity']['text'] for r in head]
+            scores = self.reranker.compute_score([query,texts], normalize=False)
+        ranked = self._apply_rerank_scores(head, tail, scores)
+        latency["counts"]["reranked"] = len(texts)
+        latency["counts"]["after_rerank"] = len(ranked)
+        count_metrics.observe("rerank_pairs", len(texts))
+        return ranked
+
+    def _apply_rerank_scores(
+        self,
+        head: List[Dict[str, Any]],
+        tail: List[Dict[str, Any]],
+        scores: List[float]
+    ) -> List[Dict[str, Any]]:
+        """
+        写入重排序分数并按 default_rerank_threshold 过滤 head；tail 没有经过重排序，
+        只有 head 全部通过阈值时才接在后面：排在前面的候选被拒绝时，排在更后面的候选更不可能相关
+        """
+        for r, s in zip(head, scores):
+            r['rerank_score'] = s
+        kept = [r for r in head if r['rerank_score'] > self.default_rerank_threshold]
+        kept.sort(key=lambda x: x['rerank_score'], reverse=True)
+        return kept + tail if len(kept) == len(head) else kept
+
+    def _cascade(self, candidates: List[Dict[str, Any]]) -> (List[Dict[str, Any]], int):
+        """
+        级联重排序的第一阶段：不调用 cross-encoder，只用已有分数决定需要重排的候选数量
+
+        - 一阶段分数见 _first_stage_scores
+        - 按一阶段分数排序后，从第 cascade_min_candidates 个开始找第一个明显的断层
+          （相邻分数差 >= cascade_gap_ratio * 全体分数跨度），断层之前的候选才送去重排序
+        返回 (按一阶段分数排序的候选, 需要重排的数量)
+        """
+        n = len(candidates)
+        if n <= self.cascade_min_candidates:
+            return candidates, n
+
+        score = self._first_stage_scores(candidates)
+        order = sorted(range(n), key=lambda i: score[i], reverse=True)
+        ranked = [candidates[i] for i in order]
+        ordered = [score[i] for i in order]
+        spread = ordered[0] - ordered[-1]
+        if spread <= 0:
+            return ranked, n
+        for m in range(self.cascade_min_candidates, n):
+            if ordered[m - 1] - ordered[m] >= self.cascade_gap_ratio * spread:
+                return ranked, m
+        return ranked, n
+
+    def _threshold(self, results: List[Dict[str, Any]], dt: float) -> List[Dict[str, Any]]:
+        """按 metric_type 过滤向量命中：COSINE / IP 保留 distance >= dt，L2 保留 distance < dt"""
+        return [r for r in results if within_threshold(r['distance'], dt, self.metric_type)]
+
+    def _first_stage_scores(self, candidates: List[Dict[str, Any]]) -> List[float]:
+        """
+        不调用 cross-encoder 的一阶段分数，越大越相关：
+        跨知识库合并结果用 norm_score；融合结果用 rrf_score；
+        否则用向量分数，有 BM25 分数时按 cascade_lexical_weight 加权
+        """
+        if all(r.get('norm_score') is not None for r in candidates):
+            return [r['norm_score'] for r in candidates]
+        if all(r.get('rrf_score') is not None for r in candidates):
+            return minmax([r['rrf_score'] for r in candidates])
+        return self._similarity_scores(candidates)
+
+    def _similarity_scores(self, candidates: List[Dict[str, Any]]) -> List[float]:
+        """向量分数（按 metric_type 转为越大越近）在候选间 min-max 归一化，有 BM25 分数时按 cascade_lexical_weight 加权"""
+        vec = [r.get('distance') for r in candidates]
+        if self.metric_type == "L2":
+            vec = [-v if v is not None else None for v in vec]
+        score = minmax(vec)
+        lexical = [r.get('bm25_score') for r in candidates]
+        if self.cascade_lexical_weight and any(v is not None for v in lexical):
+            score = [s + self.cascade_lexical_weight * l for s, l in zip(score, minmax(lexical))]
+        return score
+
     def restart(self):
         self._load_embedding_model(None)
         self._connect_milvus(None)
+        if self.residency is not None:
+            self.residency.client = self.client
@@ -0,0 +1,114 @@
+import math
+import sqlite3
+import threading
+from typing import Any, Dict, List, Optional
+
+from src.models import rag_tokenizer
+from src.utils.logger import LogManager
+
+logger = LogManager()
+
+
+def tokenize(text: str) -> List[str]:
+    """用 RagTokenizer 分词，去掉纯标点/空白的 token"""
+    return [tk for tk in rag_tokenizer.tokenize(text or "").split() if any(ch.isalnum() for ch in tk)]
+
+
+class BM25Index:
+    """
+    单个知识库的 BM25 关键词索引，倒排表保存在 sqlite 中
+
+    - docs(id, file_id, text, length)：id 与 Milvus 中的主键一致，便于与向量结果融合
+    - postings(term, doc_id, tf)：倒排表
+    """
+
+    def __init__(self, path: str, k1: float = 1.5, b: float = 0.75) -> None:
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS docs (id INTEGER PRIMARY KEY, file_id TEXT, text TEXT, length INTEGER);
+            CREATE TABLE IF NOT EXISTS postings (term TEXT, doc_id INTEGER, tf INTEGER, PRIMARY KEY (term, doc_id));
+            CREATE INDEX IF NOT EXISTS idx_docs_file ON docs (file_id);
+            CREATE INDEX IF NOT EXISTS idx_postings_doc ON postings (doc_id);
+        """)
+        self._db.commit()
+
+    def add(self, ids: List[int], file_id: str, texts: List[str]) -> None:
+        docs, postings = [], []
+        for doc_id, text in zip(ids, texts):
+            tokens = tokenize(text)
+            docs.append((doc_id, file_id, text, len(tokens)))
+            tf: Dict[str, int] = {}
+            for tk in tokens:
+                tf[tk] = tf.get(tk, 0) + 1
+            postings.extend((term, doc_id, n) for term, n in tf.items())
+
+        with self._lock:
+            self._db.executemany("INSERT OR REPLACE INTO docs VALUES (?, ?, ?, ?)", docs)
+            self._db.executemany("INSERT OR REPLACE INTO postings VALUES (?, ?, ?)", postings)
+            self._db.commit()
+
+    def delete_file(self, file_id: str) -> None:
+        with self._lock:
+            self._db.execute("DELETE FROM postings WHERE doc_id IN (SELECT id FROM docs WHERE file_id = ?)", (file_id,))
+            self._db.execute("DELETE FROM docs WHERE file_id = ?", (file_id,))
+            self._db.commit()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._db.execute("DELETE FROM postings")
+            self._db.execute("DELETE FROM docs")
+            self._db.commit()
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM docs").fetchone()[0]
+
+    def search(self, query: str, limit: int = 20, file_ids: Optional[set] = None) -> List[Dict[str, Any]]:
+        """
+        返回按 BM25 分数降序的命中，结构与向量检索结果一致：
+        {'id', 'entity': {'text', 'file_id'}, 'distance': None, 'bm25_score'}
+        file_ids 不为空时只在这些文件的分块中检索
+        """
+        terms = set(tokenize(query))
+        if not terms:
+            return []
+
+        with self._lock:
+            n_docs, avgdl = self._db.execute("SELECT COUNT(*), AVG(length) FROM docs").fetchone()
+            if not n_docs:
+                return []
+            avgdl = avgdl or 1.0
+
+            scores: Dict[int, float] = {}
+            for term in terms:
+                rows = self._db.execute(
+                    "SELECT p.doc_id, p.tf, d.length, d.file_id FROM postings p JOIN docs d ON d.id = p.doc_id "
+                    "WHERE p.term = ?", (term,)).fetchall()
+                if not rows:
+                    continue
+                idf = math.log(1 + (n_docs - len(rows) + 0.5) / (len(rows) + 0.5))
+                for doc_id, tf, length, file_id in rows:
+                    if file_ids is not None and file_id not in file_ids:
+                        continue
+                    denom = tf + self.k1 * (1 - self.b + self.b * length / avgdl)
+                    scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (self.k1 + 1) / denom
+
+            top = sorted(scores.items(), key=lambda x: x[1], reverse=True)[:limit]
+            results = []
+            for doc_id, score in top:
+                file_id, text = self._db.execute("SELECT file_id, text FROM docs WHERE id = ?", (doc_id,)).fetchone()
+                results.append({
+                    'id': doc_id,
+                    'entity': {'text': text, 'file_id': file_id},
+                    'distance': None,
+                    'bm25_score': score,
+                })
+        return results
@@ -0,0 +1,128 @@
+"""
+Milvus 向量索引类型的参数预设、量化索引检索后的全精度重打分，以及基于向量的 MMR 多样性选择
+"""
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+# 每种索引类型每条向量大约占用的内存（字节），用于容量估算；dim 为向量维度
+INDEX_TYPES = {
+    "AUTOINDEX": lambda dim: dim * 4,
+    "FLAT": lambda dim: dim * 4,
+    "IVF_FLAT": lambda dim: dim * 4,
+    "HNSW": lambda dim: dim * 4 + 16 * 2 * 8,
+    "IVF_SQ8": lambda dim: dim,
+    "IVF_PQ": lambda dim: pq_m(dim),
+}
+
+# 量化索引：索引里保存的是压缩后的向量，需要过量召回后用原始向量重打分
+QUANTIZED_INDEX_TYPES = ("IVF_SQ8", "IVF_PQ")
+
+
+def pq_m(dim: int) -> int:
+    """PQ 子空间个数：优先每 8 维一个子空间（nbits=8 时每个子空间 1 字节），且必须整除 dim"""
+    for m in (dim // 8, dim // 4, dim // 2):
+        if m and dim % m == 0:
+            return m
+    return 1
+
+
+def is_quantized(index_type: Optional[str]) -> bool:
+    return (index_type or "").upper() in QUANTIZED_INDEX_TYPES
+
+
+def build_index_params(index_type: str, metric_type: str = "COSINE", dim: Optional[int] = None,
+                       nlist: int = 128) -> Dict[str, Any]:
+    """返回 create_index 使用的 index_params"""
+    index_type = index_type.upper()
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"不支持的索引类型: {index_type}，可选 {list(INDEX_TYPES)}")
+
+    params: Dict[str, Any] = {}
+    if index_type.startswith("IVF"):
+        params["nlist"] = nlist
+    if index_type == "IVF_PQ":
+        if not dim:
+            raise ValueError("IVF_PQ 需要指定向量维度")
+        params.update(m=pq_m(dim), nbits=8)
+    if index_type == "HNSW":
+        params.update(M=16, efConstruction=200)
+    return {"index_type": index_type, "metric_type": metric_type, "params": params}
+
+
+def build_search_params(index_type: Optional[str], metric_type: str = "COSINE",
+                        nprobe: int = 16, ef: int = 64) -> Dict[str, Any]:
+    """返回 search 使用的 search_params"""
+    index_type = (index_type or "AUTOINDEX").upper()
+    params: Dict[str, Any] = {}
+    if index_type.startswith("IVF"):
+        params["nprobe"] = nprobe
+    elif index_type == "HNSW":
+        params["ef"] = ef
+    return {"metric_type": metric_type, "params": params}
+
+
+def estimate_memory(index_type: str, count: int, dim: int) -> int:
+    """估算索引占用的内存（字节）"""
+    return INDEX_TYPES[index_type.upper()](dim) * count
+
+
+def higher_is_closer(metric_type: str = "COSINE") -> bool:
+    """COSINE / IP 的 distance 是相似度，越大越近；L2 是距离，越小越近"""
+    return metric_type.upper() != "L2"
+
+
+def within_threshold(distance: float, threshold: float, metric_type: str = "COSINE") -> bool:
+    """按度量判断命中是否通过阈值：COSINE / IP 要求 distance >= threshold，L2 要求 distance < threshold"""
+    return distance >= threshold if higher_is_closer(metric_type) else distance < threshold
+
+
+def rescore(query: List[float], hits: List[Dict[str, Any]], metric_type: str = "COSINE",
+            vector_key: str = "vector") -> List[Dict[str, Any]]:
+    """
+    用原始向量重新计算量化索引召回结果的 distance 并重新排序（与 Milvus 语义一致：
+    COSINE / IP 越大越近，L2 越小越近）。hits 中的 vector 字段会被移除。
+    """
+    if not hits:
+        return hits
+    vecs = np.asarray([h.pop(vector_key) for h in hits], dtype=np.float32)
+    q = np.asarray(query, dtype=np.float32)
+    if metric_type == "L2":
+        scores = np.sum((vecs - q) ** 2, axis=1)
+    elif metric_type == "COSINE":
+        scores = vecs @ q / ((np.linalg.norm(vecs, axis=1) * np.linalg.norm(q)) + 1e-12)
+    else:
+        scores = vecs @ q
+    for h, s in zip(hits, scores):
+        h["distance"] = float(s)
+    return sorted(hits, key=lambda h: h["distance"], reverse=higher_is_closer(metric_type))
+
+
+def mmr_select(vectors: List[Optional[List[float]]], relevance: List[float], k: int,
+               lambda_mult: float = 0.7) -> List[int]:
+    """
+    最大边际相关性（MMR）选择，返回选中候选的下标（按选中顺序）：
+    每一步选 lambda_mult * relevance - (1 - lambda_mult) * 与已选候选的最大余弦相似度 最大的候选。
+    相似度矩阵一次算出，每步只做一次向量化的 max 更新；没有向量的候选（如 BM25 命中）视为与其他候选不相似。
+    """
+    n = len(relevance)
+    k = min(k, n)
+    if k <= 0:
+        return []
+    dim = next((len(v) for v in vectors if v is not None), 0)
+    vecs = np.asarray([v if v is not None else np.zeros(dim) for v in vectors], dtype=np.float32)
+    if dim:
+        vecs /= np.linalg.norm(vecs, axis=1, keepdims=True) + 1e-12
+    sim = vecs @ vecs.T if dim else np.zeros((n, n), dtype=np.float32)
+
+    rel = lambda_mult * np.asarray(relevance, dtype=np.float32)
+    max_sim = np.zeros(n, dtype=np.float32)
+    available = np.ones(n, dtype=bool)
+    selected = []
+    for _ in range(k):
+        score = np.where(available, rel - (1 - lambda_mult) * max_sim, -np.inf)
+        i = int(np.argmax(score))
+        selected.append(i)
+        available[i] = False
+        np.maximum(max_sim, sim[:, i], out=max_sim)
+    return selected
@@ -0,0 +1,168 @@
+import os
+import json
+import time
+import pickle
+import sqlite3
+import hashlib
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+from src.utils.logger import LogManager
+
+logger = LogManager()
+
+_MISSING = object()
+
+_shared: Dict[str, "LRUCache"] = {}
+_shared_lock = threading.Lock()
+
+
+def normalize_text(text: str) -> str:
+    """缓存键使用的文本归一化：全角转半角、去首尾空白、合并空白、英文小写"""
+    text = unicodedata.normalize("NFKC", text or "")
+    return " ".join(text.split()).lower()
+
+
+def make_key(*parts: Any) -> str:
+    """把任意可 JSON 序列化的部分拼成稳定的缓存键"""
+    raw = json.dumps(parts, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.md5(raw.encode("utf-8")).hexdigest()
+
+
+class LRUCache:
+    """
+    线程安全的 LRU + TTL 缓存
+
+    - maxsize: 内存中最多保留的条目数，超出时淘汰最久未使用的条目
+    - ttl: 条目存活时间（秒），None 表示永不过期
+    - persist_path: 可选的 sqlite 文件路径，作为内存层之下的磁盘层，重启后仍可命中；
+      磁盘层同样最多保留 maxsize 条（按最近访问时间淘汰），每次写入时清理过期条目
+    """
+
+    def __init__(self, name: str, maxsize: int = 1024, ttl: Optional[float] = None,
+                 persist_path: Optional[str] = None) -> None:
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+
+        self._db = None
+        if persist_path:
+            os.makedirs(os.path.dirname(persist_path) or ".", exist_ok=True)
+            self._db = sqlite3.connect(persist_path, check_same_thread=False)
+            self._db.execute("CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value BLOB, expires REAL)")
+            columns = [row[1] for row in self._db.execute("PRAGMA table_info(cache)")]
+            if "accessed" not in columns:  # 旧版本创建的表没有访问时间
+                self._db.execute("ALTER TABLE cache ADD COLUMN accessed REAL DEFAULT 0")
+            self._db.execute("CREATE INDEX IF NOT EXISTS idx_cache_accessed ON cache (accessed)")
+            self._db.execute("CREATE INDEX IF NOT EXISTS idx_cache_expires ON cache (expires)")
+            self._db.commit()
+            logger.info(f"缓存 {name} 使用磁盘层: {persist_path}")
+
+    def _expired(self, expires: Optional[float]) -> bool:
+        return expires is not None and expires < time.time()
+
+    def _disk_get(self, key: str):
+        row = self._db.execute("SELECT value, expires FROM cache WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return _MISSING, None
+        if self._expired(row[1]):
+            self._db.execute("DELETE FROM cache WHERE key = ?", (key,))
+            self._db.commit()
+            return _MISSING, None
+        self._db.execute("UPDATE cache SET accessed = ? WHERE key = ?", (time.time(), key))
+        self._db.commit()
+        return pickle.loads(row[0]), row[1]
+
+    def _disk_trim(self) -> None:
+        """删除磁盘层的过期条目，并按最近访问时间只保留 maxsize 条"""
+        self._db.execute("DELETE FROM cache WHERE expires IS NOT NULL AND expires < ?", (time.time(),))
+        self._db.execute("DELETE FROM cache WHERE key IN "
+                         "(SELECT key FROM cache ORDER BY accessed DESC LIMIT -1 OFFSET ?)", (self.maxsize,))
+
+    def _put(self, key: str, value: Any, expires: Optional[float]) -> None:
+        self._data[key] = (value, expires)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def get(self, key: str, default: Any = None) -> Any:
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None:
+                value, expires = item
+                if not self._expired(expires):
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+
+            if self._db is not None:
+                value, expires = self._disk_get(key)
+                if value is not _MISSING:
+                    self._put(key, value, expires)
+                    self.hits += 1
+                    self.disk_hits += 1
+                    return value
+
+            self.misses += 1
+            return default
+
+    def set(self, key: str, value: Any) -> None:
+        expires = time.time() + self.ttl if self.ttl else None
+        with self._lock:
+            self._put(key, value, expires)
+            if self._db is not None:
+                self._db.execute("INSERT OR REPLACE INTO cache (key, value, expires, accessed) VALUES (?, ?, ?, ?)",
+                                 (key, pickle.dumps(value), expires, time.time()))
+                self._disk_trim()
+                self._db.commit()
+
+    def pop(self, key: str) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+            if self._db is not None:
+                self._db.execute("DELETE FROM cache WHERE key = ?", (key,))
+                self._db.commit()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM cache")
+                self._db.commit()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "name": self.name,
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "disk_hits": self.disk_hits,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+
+def shared_cache(name: str, maxsize: int = 1024, ttl: Optional[float] = None,
+                 persist_path: Optional[str] = None) -> LRUCache:
+    """
+    同一进程内按磁盘文件（没有磁盘层时按 name）共享一个 LRUCache：多个实例各自维护内存层时，
+    同一个 sqlite 文件会被多个连接写入，内存中也会重复保存同样的条目。
+    maxsize / ttl 以第一次创建时的参数为准
+    """
+    key = os.path.abspath(persist_path) if persist_path else name
+    with _shared_lock:
+        if key not in _shared:
+            _shared[key] = LRUCache(name, maxsize=maxsize, ttl=ttl, persist_path=persist_path)
+        return _shared[key]
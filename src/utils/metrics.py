@@ -0,0 +1,86 @@
+import time
+import threading
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, List, Optional
+
+from src.utils.logger import LogManager
+
+logger = LogManager()
+
+
+class LatencyMetrics:
+    """
+    各阶段耗时的滑动窗口统计，提供均值 / p50 / p99，
+    并把每个观测值转发给注册的 sink（例如 Prometheus、StatsD 的上报函数）；
+    每个样本带有观测时间，quantile 可以只看最近 max_age 秒内的样本
+    """
+
+    def __init__(self, window: int = 2000) -> None:
+        self.window = window
+        self._samples: Dict[str, deque] = defaultdict(lambda: deque(maxlen=self.window))
+        self._sinks: List[Callable[[str, float], None]] = []
+        self._lock = threading.Lock()
+
+    def add_sink(self, sink: Callable[[str, float], None]) -> None:
+        """注册一个 sink，签名为 sink(stage, milliseconds)"""
+        self._sinks.append(sink)
+
+    def observe(self, stage: str, ms: float) -> None:
+        with self._lock:
+            self._samples[stage].append((time.monotonic(), ms))
+        for sink in self._sinks:
+            try:
+                sink(stage, ms)
+            except Exception as e:
+                logger.error(f"metrics sink 上报失败: {e}")
+
+    @staticmethod
+    def _percentile(values: List[float], q: float) -> float:
+        values = sorted(values)
+        idx = min(int(round(q * (len(values) - 1))), len(values) - 1)
+        return values[idx]
+
+    def quantile(self, stage: str, q: float, default: float = 0.0, max_age: Optional[float] = None) -> float:
+        """某阶段近期耗时的分位数（毫秒），没有样本时返回 default"""
+        values = self.recent(stage, max_age)
+        return self._percentile(values, q) if values else default
+
+    def recent(self, stage: str, max_age: Optional[float] = None) -> List[float]:
+        """窗口内的样本；指定 max_age 时只返回最近 max_age 秒内观测到的样本"""
+        since = time.monotonic() - max_age if max_age else None
+        with self._lock:
+            return [ms for ts, ms in self._samples.get(stage, ()) if since is None or ts >= since]
+
+    def summary(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            samples = {k: [ms for _, ms in v] for k, v in self._samples.items() if v}
+        return {
+            stage: {
+                "count": len(values),
+                "mean": round(sum(values) / len(values), 2),
+                "p50": round(self._percentile(values, 0.5), 2),
+                "p99": round(self._percentile(values, 0.99), 2),
+            }
+            for stage, values in samples.items()
+        }
+
+
+latency_metrics = LatencyMetrics()
+# 每次请求的计数（例如 rerank_pairs），单位不是毫秒，单独统计以免混进耗时分位数与延迟规划
+count_metrics = LatencyMetrics()
+
+
+@contextmanager
+def timed(latency: Dict[str, Any], stage: str):
+    """
+    记录一个阶段的耗时（毫秒）到 latency["timings"][stage]，同时上报 latency_metrics。
+    latency 是普通 dict，可以直接放进 refs 里随响应返回。
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        ms = (time.perf_counter() - start) * 1000
+        latency.setdefault("timings", {})[stage] = round(ms, 2)
+        latency_metrics.observe(stage, ms)
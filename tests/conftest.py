@@ -0,0 +1,17 @@
+"""
+单元测试只导入 src、rag 下的独立模块：src/__init__.py 与 src/stores/__init__.py 在导入时会读取配置、
+加载 embedding 模型并连接 Milvus，rag/core/__init__.py 会导入图谱与 Milvus 依赖，
+这里把这些包注册为不执行 __init__ 的普通包
+"""
+import os
+import sys
+import types
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+for name in ("src", "src.stores", "rag", "rag.core"):
+    if name not in sys.modules:
+        pkg = types.ModuleType(name)
+        pkg.__path__ = [os.path.join(ROOT, *name.split("."))]
+        sys.modules[name] = pkg
@@ -0,0 +1,34 @@
+import pytest
+
+from src.stores.answer_cache import SemanticAnswerCache
+
+
+class FakeEmbedding:
+    def batch_encode_queries(self, queries):
+        return [[1.0, float(len(q) % 3), 0.5] for q in queries]
+
+
+def _refs(**kwargs):
+    return {"timeouts": [], "skipped": [], "errors": {}, "degraded": [], **kwargs}
+
+
+@pytest.mark.parametrize("refs,expected", [
+    (_refs(), True),
+    (None, False),
+    (_refs(timeouts=["web_search"]), False),
+    (_refs(skipped=["graph_base"]), False),
+    (_refs(errors={"knowledge_base": "boom"}), False),
+    (_refs(degraded=["rerank"]), False),
+])
+def test_cacheable(refs, expected):
+    assert SemanticAnswerCache.cacheable(refs) is expected
+
+
+def test_budget_and_rewrite_are_part_of_scope():
+    cache = SemanticAnswerCache(FakeEmbedding())
+    meta = {"db_id": "kb_a"}
+    cache.add("问题", meta, ["答案"], _refs())
+    assert cache.lookup("问题", meta) is not None
+    assert cache.lookup("问题", {**meta, "latency_budget_ms": 200}) is None
+    assert cache.lookup("问题", {**meta, "use_rewrite_query": "hyde"}) is None
+    assert cache.lookup("问题", {**meta, "multi_query": True}) is None
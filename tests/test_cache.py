@@ -0,0 +1,69 @@
+from src.utils import cache
+from src.utils.cache import shared_cache
+
+
+def test_shared_cache_is_one_per_file(tmp_path, monkeypatch):
+    monkeypatch.setattr(cache, "_shared", {})
+    path = str(tmp_path / "query_embedding.db")
+    a = shared_cache("query_embedding", maxsize=4, persist_path=path)
+    assert shared_cache("query_embedding", maxsize=8, persist_path=path) is a
+    assert shared_cache("rerank_score", persist_path=str(tmp_path / "rerank_score.db")) is not a
+
+
+def test_lru_evicts_least_recently_used():
+    c = cache.LRUCache("t", maxsize=2)
+    c.set("a", 1)
+    c.set("b", 2)
+    assert c.get("a") == 1
+    c.set("c", 3)
+    assert c.get("b") is None and c.get("a") == 1 and c.get("c") == 3
+    assert c.stats()["hits"] == 3 and c.stats()["misses"] == 1
+
+
+def test_ttl_expires(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(cache.time, "time", lambda: now[0])
+    c = cache.LRUCache("t", ttl=10)
+    c.set("a", 1)
+    now[0] += 5
+    assert c.get("a") == 1
+    now[0] += 6
+    assert c.get("a", "missing") == "missing" and len(c) == 0
+
+
+def test_disk_layer_survives_restart_and_respects_ttl(tmp_path, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(cache.time, "time", lambda: now[0])
+    path = str(tmp_path / "c.db")
+    c = cache.LRUCache("t", ttl=10, persist_path=path)
+    c.set("vec", [0.1, 0.2])
+    c.set("gone", 1)
+    c.pop("gone")
+
+    fresh = cache.LRUCache("t", ttl=10, persist_path=path)
+    assert fresh.get("vec") == [0.1, 0.2] and fresh.disk_hits == 1
+    assert fresh.get("gone") is None
+
+    now[0] += 11
+    assert cache.LRUCache("t", ttl=10, persist_path=path).get("vec") is None
+    assert c._db.execute("SELECT COUNT(*) FROM cache").fetchone()[0] == 0
+
+
+def test_normalized_keys():
+    assert cache.normalize_text("  ＡＢＣ\t 问题 ") == "abc 问题"
+    assert cache.make_key("q", {"b": 1, "a": 2}) == cache.make_key("q", {"a": 2, "b": 1})
+
+
+def test_disk_layer_is_bounded(tmp_path, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(cache.time, "time", lambda: now[0])
+    c = cache.LRUCache("t", maxsize=2, ttl=100, persist_path=str(tmp_path / "c.db"))
+    for i in range(1000):
+        now[0] += 0.01
+        c.set(f"k{i}", "x" * 1000)
+    assert c._db.execute("SELECT COUNT(*) FROM cache").fetchone()[0] == 2
+
+    # 过期条目在下次写入时清理，不依赖读取
+    now[0] += 101
+    c.set("fresh", 1)
+    assert [r[0] for r in c._db.execute("SELECT key FROM cache")] == ["fresh"]
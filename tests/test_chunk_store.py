@@ -0,0 +1,37 @@
+from src.stores.chunk_store import ChunkStore
+
+
+def test_put_get_and_missing_ids(tmp_path):
+    store = ChunkStore(str(tmp_path))
+    store.put([1, 2], "f1", ["hello", "世界"])
+    store.put([3], "f2", [""])
+    assert store.get([2, 1, 3, 404]) == {1: "hello", 2: "世界", 3: ""}
+    assert len(store) == 3
+
+
+def test_delete_file_compacts(tmp_path):
+    store = ChunkStore(str(tmp_path))
+    store.put([1, 2], "f1", ["x" * 100, "y" * 100])
+    store.put([3], "f2", ["keep"])
+    store.delete_file("f1")
+    assert store.get([1, 2, 3]) == {3: "keep"}
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["chunks.1.bin", "chunks.idx"]
+    store.put([4], "f3", ["after"])
+    assert store.get([3, 4]) == {3: "keep", 4: "after"}
+
+
+def test_two_instances_after_compaction(tmp_path):
+    a, b = ChunkStore(str(tmp_path)), ChunkStore(str(tmp_path))
+    a.put([1, 2], "f1", ["x" * 100, "y" * 100])
+    a.put([3], "f2", ["keep"])
+    assert b.get([1, 3]) == {1: "x" * 100, 3: "keep"}  # b 映射了压缩前的文件
+
+    a.delete_file("f1")
+    assert b.get([3]) == {3: "keep"}
+
+    # b 的写入句柄必须切换到新文件，a 才能读到
+    b.put([4], "f3", ["from b"])
+    assert a.get([3, 4]) == {3: "keep", 4: "from b"}
+    a.close()
+    b.close()
+    assert ChunkStore(str(tmp_path)).get([3, 4]) == {3: "keep", 4: "from b"}
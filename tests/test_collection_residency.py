@@ -0,0 +1,114 @@
+import threading
+
+import pytest
+
+from src.stores import collection_residency
+from src.stores.collection_residency import CollectionResidency, shared_residency
+
+
+class FakeMilvus:
+    def __init__(self, names):
+        self.loaded = {name: False for name in names}
+        self.loads = []
+
+    def load_collection(self, name):
+        self.loads.append(name)
+        self.loaded[name] = True
+
+    def release_collection(self, name):
+        self.loaded[name] = False
+
+    def list_collections(self):
+        return list(self.loaded)
+
+    def get_load_state(self, name):
+        return {"state": "Loaded" if self.loaded[name] else "NotLoad"}
+
+
+def _residency(client, **kwargs):
+    return CollectionResidency(client, lambda name: 100, **kwargs)
+
+
+def test_use_loads_once():
+    client = FakeMilvus(["kb_a"])
+    r = _residency(client)
+    with r.use("kb_a"):
+        assert client.loaded["kb_a"]
+    with r.use("kb_a") as ms:
+        assert ms == 0
+    assert client.loads == ["kb_a"]
+
+
+def test_idle_collections_are_released_but_not_inflight():
+    client = FakeMilvus(["kb_a", "kb_b"])
+    r = _residency(client, idle_ttl=60)
+    with r.use("kb_a"):
+        pass
+    with r.use("kb_b"):
+        r._entries["kb_a"]["last_used"] = 0
+        r._entries["kb_b"]["last_used"] = 0
+        assert r.release_idle() == ["kb_a"]
+    assert client.loaded == {"kb_a": False, "kb_b": True}
+
+
+def test_memory_budget_releases_least_recently_used():
+    client = FakeMilvus(["kb_a", "kb_b", "kb_c"])
+    r = _residency(client, memory_budget=250)
+    for name in ("kb_a", "kb_b", "kb_c"):
+        with r.use(name):
+            pass
+    assert client.loaded == {"kb_a": False, "kb_b": True, "kb_c": True}
+    assert r.resident_memory() == 200
+
+
+def test_reload_after_external_release():
+    client = FakeMilvus(["kb_a"])
+    r = _residency(client)
+    with r.use("kb_a"):
+        pass
+    client.release_collection("kb_a")  # 其他进程 release，本地状态仍认为已加载
+    r.reload("kb_a")
+    assert client.loaded["kb_a"] and client.loads == ["kb_a", "kb_a"]
+
+
+@pytest.mark.parametrize("err,expected", [
+    (type("E", (Exception,), {"code": 101})("collection not loaded"), True),
+    (Exception("collection not loaded[collection=kb_a]"), True),
+    (Exception("connection refused"), False),
+])
+def test_is_not_loaded_error(err, expected):
+    assert CollectionResidency.is_not_loaded_error(err) is expected
+
+
+def test_hotness_persists(tmp_path):
+    path = str(tmp_path / "state.json")
+    client = FakeMilvus(["kb_a", "kb_b"])
+    r = _residency(client, state_path=path)
+    for _ in range(3):
+        with r.use("kb_b"):
+            pass
+    with r.use("kb_a"):
+        pass
+    r._save_state()
+    assert _residency(client, state_path=path).hot_collections(1) == ["kb_b"]
+
+
+def test_shared_residency_is_one_per_state_file(tmp_path, monkeypatch):
+    monkeypatch.setattr(collection_residency, "_shared", {})
+    client = FakeMilvus(["kb_a"])
+    created = []
+
+    def factory():
+        r = _residency(client, interval=3600)
+        created.append(r)
+        return r
+
+    path = str(tmp_path / "state.json")
+    threads = [threading.Thread(target=shared_residency, args=(path, factory)) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(created) == 1
+    assert shared_residency(path, factory) is created[0]
+    created[0].stop()
@@ -0,0 +1,29 @@
+from rag.core.context_packer import ContextPacker, count_tokens
+
+
+def _refs(n, text="检索到的段落内容。" * 8):
+    return {
+        "knowledge_base": {"results": [{"id": i, "entity": {"text": f"{i}{text}"}, "rerank_score": 1 / (i + 1)}
+                                       for i in range(n)]},
+        "web_search": {"results": [{"title": f"网页{i}", "content": f"网页{i}的内容。" * 5} for i in range(n)]},
+    }
+
+
+def test_newlines_are_counted():
+    assert count_tokens("a\nb") == count_tokens("a b") + 1
+    assert count_tokens("a\n\nb") == count_tokens("a\nb")
+
+
+def test_joined_context_fits_budget():
+    for budget in (60, 150, 400):
+        parts, stats = ContextPacker(budget=budget).pack("段落内容", _refs(20), reserved=10)
+        joined = "\n\n".join(parts)
+        assert count_tokens(joined) == stats["packed_tokens"] <= budget - 10
+        assert stats["dropped"]["knowledge_base"] > 0
+
+
+def test_knowledge_base_sorted_by_rerank_score():
+    refs = _refs(3)
+    refs["knowledge_base"]["results"].reverse()
+    parts, _ = ContextPacker(budget=1000).pack("段落", refs)
+    assert parts[0] == "知识库信息:" and parts[1].split("\n")[0].startswith("0: ")
@@ -0,0 +1,104 @@
+import numpy as np
+import pytest
+
+from src.stores.embedded_vector_store import EmbeddedVectorClient, parse_filter
+
+
+def _rows(start, n, dim=4, seed=0):
+    rng = np.random.default_rng(seed)
+    return [{"id": i, "vector": rng.random(dim).tolist(), "file_id": f"f{i % 3}"} for i in range(start, start + n)]
+
+
+@pytest.fixture
+def client(tmp_path):
+    c = EmbeddedVectorClient(str(tmp_path))
+    c.create_collection("kb_test", 4)
+    return c
+
+
+def test_parse_filter():
+    sql, params = parse_filter('file_id in ["a", "b"] and id != 3')
+    assert sql == "json_extract(data, '$.file_id') IN (?, ?) AND id != ?"
+    assert params == ["a", "b", 3]
+    with pytest.raises(ValueError):
+        parse_filter("file_id like 'a%'")
+
+
+def test_insert_search_and_upsert(client):
+    client.insert("kb_test", _rows(0, 10))
+    client.insert("kb_test", [{"id": 3, "vector": [1, 0, 0, 0], "file_id": "new"}])
+    assert client.get_collection_stats("kb_test")["row_count"] == 10
+
+    hits = client.search("kb_test", [[1, 0, 0, 0]], limit=1, output_fields=["file_id"])[0]
+    assert hits[0].id == 3 and hits[0]["entity"] == {"file_id": "new"}
+    assert hits[0].distance == pytest.approx(1.0, abs=1e-3)
+
+
+def test_filter_and_delete(client):
+    client.insert("kb_test", _rows(0, 9))
+    hits = client.search("kb_test", [[1, 1, 1, 1]], limit=10, filter='file_id == "f1"')[0]
+    assert sorted(h.id for h in hits) == [1, 4, 7]
+    assert client.delete("kb_test", filter='file_id == "f1"')["delete_count"] == 3
+    assert client.get_collection_stats("kb_test")["row_count"] == 6
+
+
+def test_query_returns_vectors(client):
+    client.insert("kb_test", [{"id": 1, "vector": [0.6, 0.8, 0, 0]}])
+    row = client.query("kb_test", ids=[1], output_fields=["vector"])[0]
+    assert row["vector"] == pytest.approx([0.6, 0.8, 0, 0], abs=1e-3)
+
+
+def test_query_iterator_pages_by_primary_key(client):
+    client.insert("kb_test", _rows(0, 25))
+    it = client.query_iterator("kb_test", batch_size=10, output_fields=["file_id"])
+    seen = []
+    while True:
+        page = it.next()
+        if not page:
+            break
+        seen += [r["id"] for r in page]
+    assert seen == list(range(25))
+
+
+def test_clients_share_directory(tmp_path):
+    a, b = EmbeddedVectorClient(str(tmp_path)), EmbeddedVectorClient(str(tmp_path))
+    a.create_collection("kb_test", 4)
+    a.insert("kb_test", _rows(0, 5))
+    assert b.get_collection_stats("kb_test")["row_count"] == 5
+
+    # a 扩容后 b 仍然按最新的 size 追加，不会覆盖 a 写入的行
+    a.insert("kb_test", _rows(5, 2000, seed=1))
+    b.insert("kb_test", [{"id": 9999, "vector": [1, 0, 0, 0]}])
+    assert a.get_collection_stats("kb_test")["row_count"] == 2006
+    assert a.search("kb_test", [[1, 0, 0, 0]], limit=1)[0][0].id == 9999
+
+    fresh = EmbeddedVectorClient(str(tmp_path))
+    assert len(fresh.query("kb_test", ids=list(range(2005)) + [9999])) == 2006
+
+    b.delete("kb_test", ids=[9999])
+    assert a.get_collection_stats("kb_test")["row_count"] == 2005
+
+
+def test_recreated_collection_is_reopened(tmp_path):
+    a, b = EmbeddedVectorClient(str(tmp_path)), EmbeddedVectorClient(str(tmp_path))
+    a.create_collection("kb_test", 4)
+    a.insert("kb_test", _rows(0, 5))
+    assert b.get_collection_stats("kb_test")["row_count"] == 5
+
+    a.drop_collection("kb_test")
+    with pytest.raises(ValueError):
+        b.get_collection_stats("kb_test")
+    a.create_collection("kb_test", 4)
+    assert b.get_collection_stats("kb_test")["row_count"] == 0
+
+
+def test_ivf_index_sees_rows_from_other_client(tmp_path):
+    a = EmbeddedVectorClient(str(tmp_path), ann_threshold=200, nprobe=64)
+    b = EmbeddedVectorClient(str(tmp_path), ann_threshold=200, nprobe=64)
+    a.create_collection("kb_test", 4)
+    a.insert("kb_test", _rows(0, 300))
+    a.search("kb_test", [[1, 1, 1, 1]], limit=1)  # 构建 IVF 索引
+    assert a.describe_collection("kb_test")["index_type"] == "IVF_FLAT"
+
+    b.insert("kb_test", [{"id": 5000, "vector": [0, 0, 0, 1]}])
+    assert a.search("kb_test", [[0, 0, 0, 1]], limit=1)[0][0].id == 5000
@@ -0,0 +1,31 @@
+import pytest
+
+from src.stores.fusion import minmax, reciprocal_rank_fusion
+
+
+def test_minmax():
+    assert minmax([1.0, 3.0, None, 2.0]) == [0.0, 1.0, 0.0, 0.5]
+    assert minmax([5.0, 5.0]) == [1.0, 1.0]
+    assert minmax([None, None]) == [0.0, 0.0]
+
+
+def test_rrf_rewards_items_in_both_lists():
+    vector = [{"id": 1, "distance": 0.2}, {"id": 2, "distance": 0.3}, {"id": 3, "distance": 0.4}]
+    bm25 = [{"id": 3, "bm25_score": 7.0}, {"id": 4, "bm25_score": 5.0}]
+    fused = reciprocal_rank_fusion([vector, bm25], k=60)
+    assert [r["id"] for r in fused] == [3, 1, 2, 4]
+    assert fused[0]["rrf_score"] == pytest.approx(1 / 63 + 1 / 61)
+    # 两路字段合并，BM25 命中没有 distance
+    assert fused[0]["distance"] == 0.4 and fused[0]["bm25_score"] == 7.0
+    assert "distance" not in fused[-1]
+
+
+def test_rrf_weights_and_best_distance_by_metric():
+    a = [{"id": 1, "distance": 0.5}, {"id": 2, "distance": 0.6}]
+    b = [{"id": 2, "distance": 0.1}, {"id": 1, "distance": 0.7}]
+    fused = reciprocal_rank_fusion([a, b], weights=[1.0, 3.0])
+    assert [r["id"] for r in fused] == [2, 1]
+    # COSINE 越大越近，保留最高相似度；L2 越小越近，保留最小距离
+    assert {r["id"]: r["distance"] for r in fused} == {1: 0.7, 2: 0.6}
+    fused = reciprocal_rank_fusion([a, b], weights=[1.0, 3.0], metric_type="L2")
+    assert {r["id"]: r["distance"] for r in fused} == {1: 0.5, 2: 0.1}
@@ -0,0 +1,37 @@
+import numpy as np
+
+from src.stores.kb_router import CentroidRouter
+
+
+def _cluster(center, n=20, seed=0):
+    rng = np.random.default_rng(seed)
+    return (np.asarray(center, dtype=np.float32) + 0.05 * rng.standard_normal((n, len(center)))).tolist()
+
+
+def test_route_prefers_closest_kb_and_keeps_unknown(tmp_path):
+    router = CentroidRouter(str(tmp_path / "router.db"), n_centroids=2)
+    router.update("kb_a", _cluster([1, 0, 0]))
+    router.update("kb_b", _cluster([0, 1, 0]))
+    picked = router.route([1, 0.1, 0], ["kb_a", "kb_b", "kb_new"], top_n=1)
+    assert [db_id for db_id, _ in picked] == ["kb_a", "kb_new"]
+    assert picked[1][1] is None
+
+
+def test_summaries_survive_restart(tmp_path):
+    path = str(tmp_path / "router.db")
+    CentroidRouter(path, n_centroids=2).update("kb_a", _cluster([1, 0, 0]))
+    assert CentroidRouter(path).has("kb_a")
+
+
+def test_two_instances_see_each_other(tmp_path):
+    path = str(tmp_path / "router.db")
+    a, b = CentroidRouter(path, n_centroids=2), CentroidRouter(path, n_centroids=2)
+    a.update("kb_a", _cluster([1, 0, 0]))
+    assert b.has("kb_a")
+
+    # b 在 a 的质心基础上增量更新，而不是覆盖
+    b.update("kb_a", _cluster([1, 0, 0], seed=1))
+    assert a.has("kb_a") and int(a._summaries["kb_a"][1].sum()) == 40
+
+    b.drop("kb_a")
+    assert a.scores([1, 0, 0], ["kb_a"]) == {"kb_a": None}
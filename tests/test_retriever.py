@@ -0,0 +1,145 @@
+import importlib
+import sys
+import time
+import types
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from src.utils import metrics as metrics_module
+from src.utils.metrics import LatencyMetrics
+
+
+class FakeConfig(dict):
+    enable_web_search = True
+    enable_knowledge_base = True
+    enable_reranker = False
+    use_rewrite_query = "off"
+    model_name = "fake"
+    save_dir = "/tmp"
+
+
+@pytest.fixture
+def retriever_module(monkeypatch):
+    """retriever 依赖的 src.config / knowledge_base / 模型在导入时就会初始化，这里换成轻量的替身"""
+    src = sys.modules["src"]
+    monkeypatch.setattr(src, "config", FakeConfig(), raising=False)
+    monkeypatch.setattr(src, "knowledge_base", None, raising=False)
+    models = types.ModuleType("src.models")
+    models.__path__ = []
+    models.select_model = None
+    reranker = types.ModuleType("src.models.reranker_model")
+    reranker.RerankerWrapper = None
+    monkeypatch.setitem(sys.modules, "src.models", models)
+    monkeypatch.setitem(sys.modules, "src.models.reranker_model", reranker)
+    monkeypatch.delitem(sys.modules, "rag.core.retriever", raising=False)
+    module = importlib.import_module("rag.core.retriever")
+    monkeypatch.setattr(module, "latency_metrics", LatencyMetrics())
+    yield module
+    sys.modules.pop("rag.core.retriever", None)
+
+
+def _retriever(module, workers=4, timeout=5):
+    r = module.Retriever.__new__(module.Retriever)
+    r._pool = ThreadPoolExecutor(max_workers=workers)
+    r.default_source_timeout = timeout
+    return r
+
+
+def _refs(**meta):
+    return {"meta": {"use_web": True, "use_graph": True, "db_id": "kb_a", **meta},
+            "timeouts": [], "skipped": [], "errors": {}, "latency": {"timings": {}, "counts": {}}}
+
+
+def _source(result, sleep=0.0, error=None):
+    def run(query, history, refs):
+        time.sleep(sleep)
+        refs["latency"]["counts"]["written_by_source"] = 1
+        if error:
+            raise error
+        return result
+    return run
+
+
+def test_slow_source_times_out_and_late_thread_does_not_touch_refs(retriever_module):
+    r = _retriever(retriever_module)
+    refs = _refs(timeouts={"web_search": 0.1})
+    r._run_sources({"knowledge_base": _source({"results": [1]}), "web_search": _source({"results": [2]}, sleep=0.4)},
+                   "q", [], refs)
+    assert refs["timeouts"] == ["web_search"]
+    assert refs["web_search"]["timeout"] is True and refs["web_search"]["results"] == []
+    assert refs["knowledge_base"] == {"results": [1]}
+    assert "knowledge_base" in refs["latency"]["timings"]
+
+    time.sleep(0.5)  # 等超时的线程执行完
+    assert "web_search" not in refs["latency"]["timings"]
+    assert refs["web_search"]["results"] == []
+
+
+def test_queued_source_times_out_from_submission(retriever_module):
+    r = _retriever(retriever_module, workers=1)
+    refs = _refs(timeouts={"knowledge_base": 1, "web_search": 0.1})
+    start = time.monotonic()
+    r._run_sources({"knowledge_base": _source({"results": [1]}, sleep=0.3), "web_search": _source({"results": [2]})},
+                   "q", [], refs)
+    assert refs["timeouts"] == ["web_search"]
+    assert refs["knowledge_base"] == {"results": [1]}
+    assert time.monotonic() - start < 0.9
+
+
+def test_required_sources_skip_the_rest(retriever_module):
+    r = _retriever(retriever_module)
+    refs = _refs(required_sources=["knowledge_base", "unknown"])
+    start = time.monotonic()
+    r._run_sources({"knowledge_base": _source({"results": [1]}), "graph_base": _source({"answer": "x"}, sleep=0.5)},
+                   "q", [], refs)
+    assert time.monotonic() - start < 0.4
+    assert refs["skipped"] == ["graph_base"] and refs["timeouts"] == []
+    assert refs["graph_base"]["skipped"] is True and refs["graph_base"]["answer"] is None
+
+
+def test_source_error_becomes_placeholder(retriever_module):
+    r = _retriever(retriever_module)
+    refs = _refs()
+    done = []
+    r._run_sources({"knowledge_base": _source(None, error=RuntimeError("milvus down")),
+                    "web_search": _source({"results": [2]})},
+                   "q", [], refs, on_source_done=lambda name, result: done.append(name))
+    assert refs["errors"] == {"knowledge_base": "milvus down"}
+    assert refs["knowledge_base"]["error"] is True and refs["knowledge_base"]["rw_query"] == "q"
+    assert refs["web_search"] == {"results": [2]}
+    assert sorted(done) == ["knowledge_base", "web_search"]
+
+
+def test_plan_without_budget_is_unchanged(retriever_module):
+    meta = {"use_web": True}
+    assert _retriever(retriever_module).plan(meta) == (meta, [])
+
+
+def test_plan_degrades_slow_stages(retriever_module):
+    metrics = retriever_module.latency_metrics
+    for _ in range(10):
+        metrics.observe("web_search", 800)
+        metrics.observe("graph_base", 50)
+        metrics.observe("embedding", 50)
+        metrics.observe("milvus_search", 100)
+        metrics.observe("rerank", 300)
+
+    meta = {"use_web": True, "use_graph": True, "db_id": "kb_a", "latency_budget_ms": 200}
+    planned, degraded = _retriever(retriever_module).plan(meta)
+    assert degraded == ["web_search", "rerank"]
+    assert planned["use_web"] is False and planned["use_graph"] is True
+    assert planned["max_query_count"] == 10 and planned["rerank_top_n"] == 5
+    assert planned["timeouts"]["knowledge_base"] == 0.2
+    assert meta["use_web"] is True  # 不修改调用方的 meta
+
+
+def test_plan_ignores_expired_samples(retriever_module, monkeypatch):
+    metrics = retriever_module.latency_metrics
+    now = [1000.0]
+    monkeypatch.setattr(metrics_module, "time", types.SimpleNamespace(monotonic=lambda: now[0]))
+    metrics.observe("web_search", 800)
+    now[0] += 301  # 超过 latency_planner_max_age 默认的 300 秒
+
+    _, degraded = _retriever(retriever_module).plan({"use_web": True, "latency_budget_ms": 200})
+    assert degraded == []
@@ -0,0 +1,39 @@
+import pytest
+
+from src.stores.vector_index import estimate_memory, is_quantized, mmr_select, rescore, within_threshold
+
+
+def test_mmr_skips_near_duplicates():
+    vectors = [[1, 0], [0.999, 0.01], [0, 1]]
+    assert mmr_select(vectors, [1.0, 0.99, 0.5], k=2, lambda_mult=0.5) == [0, 2]
+
+
+def test_mmr_lambda_one_is_relevance_order():
+    vectors = [[1, 0], [1, 0], [0, 1]]
+    assert mmr_select(vectors, [0.2, 0.9, 0.5], k=3, lambda_mult=1.0) == [1, 2, 0]
+
+
+def test_mmr_candidates_without_vectors():
+    # BM25 命中没有向量，视为与其他候选都不相似
+    assert mmr_select([None, [1, 0], [1, 0]], [0.5, 1.0, 0.9], k=2, lambda_mult=0.5) == [1, 0]
+    assert mmr_select([None, None], [0.1, 0.2], k=5) == [1, 0]
+
+
+def test_mmr_empty():
+    assert mmr_select([], [], k=3) == []
+
+
+def test_rescore_orders_by_full_precision_distance():
+    hits = [{"id": 1, "distance": 0.9, "vector": [0, 1]}, {"id": 2, "distance": 0.1, "vector": [1, 0]}]
+    assert [h["id"] for h in rescore([1, 0], hits)] == [2, 1]
+
+
+def test_quantized_index_uses_less_memory():
+    assert is_quantized("IVF_SQ8") and not is_quantized("HNSW")
+    assert estimate_memory("IVF_SQ8", 1000, 1024) < estimate_memory("FLAT", 1000, 1024)
+
+
+def test_threshold_follows_metric():
+    assert within_threshold(0.8, 0.5, "COSINE") and not within_threshold(0.2, 0.5, "COSINE")
+    assert within_threshold(0.5, 0.5, "IP")
+    assert within_threshold(0.2, 0.5, "L2") and not within_threshold(0.8, 0.5, "L2")